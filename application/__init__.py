@@ -1,17 +1,38 @@
 from flask import Flask
 
+from config import Config
+
 
 def create_app():
     """Create the core application."""
+    # A write-behind queue only knows about the messages queued in its own process, so an edit or delete
+    # handled by another worker could reach the database before the message it refers to
+    if Config.WRITE_BEHIND and (Config.WORKERS > 1 or Config.MESSAGE_QUEUE):
+        raise RuntimeError("WRITE_BEHIND can only be used with a single worker, so unset WORKERS and MESSAGE_QUEUE or disable it")
+
     app = Flask(__name__)
 
     with app.app_context():
         # Imports
         from .views import view
         from .api import api
+        from .admin import admin
+        from .database import DataBase
+        from .metrics import instrument_app
+        from .metrics import metrics_view
+
+        # Make sure the database indexes exist before any queries are made
+        db = DataBase()
+        db.create_indexes()
+        db.close()
 
         # Register routes
         app.register_blueprint(view, url_prefix="/")
         app.register_blueprint(api, url_prefix="/api")
+        app.register_blueprint(metrics_view, url_prefix="/")
+        app.register_blueprint(admin, url_prefix="/admin")
+
+        # Time every request for the metrics
+        instrument_app(app)
 
         return app
\ No newline at end of file
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from flask import Blueprint
+from flask import request
+
+from config import Config
+from application.profiling import SamplingProfiler
+from application.profiling import memory_tracer
+from application.utils import is_superuser
+
+
+admin = Blueprint("admin", __name__)
+
+# Only one CPU profile is taken at a time
+_profile_lock = threading.Lock()
+
+
+# Routes
+
+
+@admin.route("/profile")
+@is_superuser
+def profile():
+    """Samples the stacks of the socket event handlers of this worker for a number of seconds and
+    returns them as a downloadable folded stack profile. With several workers, the profile only covers
+    the worker that handled the request.
+
+    Query args:
+        seconds: The number of seconds to profile for, up to Config.PROFILE_MAX_SECONDS. Defaults to 10.
+        interval_ms: The number of milliseconds between samples. Defaults to 5.
+        all: Include every thread instead of only the socket event handlers when set.
+
+    Returns:
+        str: The folded stacks
+    """
+    try:
+        seconds = min(float(request.args.get("seconds", 10)), Config.PROFILE_MAX_SECONDS)
+        interval = max(float(request.args.get("interval_ms", 5)), 1) / 1000
+    except ValueError:
+        return "seconds and interval_ms must be numbers", 400
+    if not _profile_lock.acquire(blocking=False):
+        return "A profile is already being taken", 409
+    try:
+        profiler = SamplingProfiler(interval, handlers_only="all" not in request.args)
+        profiler.start(seconds)
+        # Wait with the app's own sleep so that other requests keep being handled
+        while not profiler.done:
+            time.sleep(0.1)
+    finally:
+        _profile_lock.release()
+    return profiler.folded(), 200, {
+        "Content-Type": "text/plain; charset=utf-8",
+        "Content-Disposition": f"attachment; filename=profile-{int(time.time())}.folded"
+    }
+
+@admin.route("/memory/start", methods=["POST"])
+@is_superuser
+def start_memory_trace():
+    """Starts tracing the memory allocations of this worker, taking the snapshot that later snapshots
+    are compared against.
+
+    Query args:
+        frames: The number of frames kept for each allocation, from 1 to 100. Defaults to 10.
+
+    Returns:
+        str: Whether tracing was started
+    """
+    try:
+        frames = min(max(int(request.args.get("frames", 10)), 1), 100)
+    except ValueError:
+        return "frames must be a whole number", 400
+    if memory_tracer.running:
+        return "Memory tracing is already running", 409
+    memory_tracer.start(frames)
+    return "Memory tracing started\n"
+
+@admin.route("/memory")
+@is_superuser
+def memory_trace_diff():
+    """Compares a new snapshot of the memory allocations of this worker against the one taken when
+    tracing started.
+
+    Query args:
+        limit: The number of biggest differences to include. Defaults to 25.
+        group_by: "lineno", "filename" or "traceback". Defaults to "lineno".
+
+    Returns:
+        str: The report of the differences
+    """
+    if not memory_tracer.running:
+        return "Memory tracing is not running, POST to /admin/memory/start first", 409
+    try:
+        limit = max(int(request.args.get("limit", 25)), 1)
+    except ValueError:
+        return "limit must be a whole number", 400
+    group_by = request.args.get("group_by", "lineno")
+    if group_by not in ["lineno", "filename", "traceback"]:
+        return "group_by must be lineno, filename or traceback", 400
+    report = memory_tracer.diff(limit, group_by)
+    return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@admin.route("/memory/stop", methods=["POST"])
+@is_superuser
+def stop_memory_trace():
+    """Stops tracing the memory allocations of this worker, which removes the overhead of tracing.
+
+    Returns:
+        str: Whether tracing was stopped
+    """
+    if not memory_tracer.running:
+        return "Memory tracing is not running", 409
+    memory_tracer.stop()
+    return "Memory tracing stopped\n"
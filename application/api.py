@@ -2,10 +2,10 @@ from flask import Blueprint
 from flask import request
 from flask import session
 
+from config import Config
 from application.database import DataBase
 from application.utils import is_superuser
 from application.utils import logged_in
-from application.utils import claim_codes
 
 
 api = Blueprint("api", __name__)
@@ -68,6 +68,36 @@ def get_message_by_id(msg_id):
     else:
         return {}
 
+@api.route("/rooms/<room_code>/messages")
+@logged_in
+def get_room_messages(room_code):
+    """Gets a page of messages from a room. The page contains the newest messages sent before the
+    message with the ID given in the `before` query arg, or the newest messages in the room if no ID
+    is given. The number of messages is set by the `limit` query arg.
+
+    Args:
+        room_code (str): The code of the room to get the messages from
+
+    Returns:
+        dict: A dict containing the messages sorted from old -> new and whether there are older messages
+    """
+    # Read the page bounds from the query args
+    try:
+        before = request.args.get("before")
+        before = int(before) if before is not None else None
+        limit = int(request.args.get("limit", Config.HISTORY_PAGE_SIZE))
+    except ValueError:
+        return {"messages": [], "has_more": False}, 400
+    limit = max(1, min(limit, Config.HISTORY_MAX_PAGE_SIZE))
+    # Fetch one extra message to find out whether there are older messages to load
+    db = DataBase()
+    messages = db.get_room_message_dicts(room_code, limit=limit + 1, before=before)
+    db.close()
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[1:]
+    return {"messages": messages, "has_more": has_more}
+
 '''@api.route("/get_database_url")
 def get_database_url():
     return {"db_url": db.db_url}'''
\ No newline at end of file
@@ -0,0 +1,213 @@
+import inspect
+import logging
+import threading
+from importlib import metadata
+
+from engineio import packet as eio_packet
+from engineio import socket as eio_socket
+from socketio import packet as sio_packet
+
+
+logger = logging.getLogger(__name__)
+
+# The actions that can be taken when a socket's outbound queue is full
+SLOW_CONSUMER_POLICIES = ["resync", "coalesce", "disconnect"]
+
+
+class OutboundQueueGuard:
+
+    def __init__(self, server, limit: int, policy: str="resync", check_interval: float=0.5):
+        """Initializes a guard that stops slow clients from making the server buffer an ever-growing
+        queue of packets. Every packet sent by the server goes through the Engine.IO send_packet()
+        method, which this replaces on the given server. Once a socket has `limit` packets waiting to be
+        written, the policy decides what happens to the packets sent to it until it has caught up:
+
+        - "resync": the packets are dropped, and the client is sent a "resync" event once it catches up,
+          after which it reconnects and is sent the changes it missed
+        - "coalesce": the events are held back and sent as one "events" packet once the client catches
+          up. If `limit` events are held back, the rest are dropped as with "resync"
+        - "disconnect": the socket is disconnected, and its queued packets and any sent to it are thrown away
+
+        A socket has caught up once its queue is down to half the limit, which is checked every
+        `check_interval` seconds.
+
+        Args:
+            server (socketio.Server): The Socket.IO server
+            limit (int): The number of packets that can be waiting to be sent to one socket
+            policy (str, optional): One of SLOW_CONSUMER_POLICIES. Defaults to "resync".
+            check_interval (float, optional): The number of seconds between checks of the sockets that
+                are being held back. Defaults to 0.5.
+        """
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        check_engineio_internals(server)
+        self.server = server
+        self.eio = server.eio
+        self.limit = limit
+        self.policy = policy
+        self.check_interval = check_interval
+        self.dropped_packets = 0
+        self.coalesced_events = 0
+        self.resyncs_sent = 0
+        self.slow_disconnects = 0
+        self._held = {} # eio sid -> list of held back events, or None once they have been dropped
+        self._draining = False
+        # Sending a packet can run the disconnect handlers of a socket that timed out, which may send more
+        self._lock = threading.RLock()
+        self._send_packet = self.eio.send_packet
+        self.eio.send_packet = self.send_packet
+
+    def send_packet(self, sid: str, pkt):
+        """Sends an Engine.IO packet to a socket unless the socket has fallen too far behind.
+
+        Args:
+            sid (str): The Engine.IO session id of the socket
+            pkt (engineio.packet.Packet): The packet to send
+        """
+        socket = self.eio.sockets.get(sid)
+        # Only messages are held back, since pings and other control packets keep the connection alive.
+        # Binary attachments follow their header packet, so they are only checked when it was held back
+        if socket is None or pkt.packet_type != eio_packet.MESSAGE or (
+            sid not in self._held and (pkt.binary or socket.queue.qsize() < self.limit)
+        ):
+            self._send_packet(sid, pkt)
+            return
+
+        disconnect = False
+        with self._lock:
+            if sid not in self._held:
+                if socket.queue.qsize() < self.limit:
+                    self._send_packet(sid, pkt)
+                    return
+                # The socket has fallen behind, so the packets sent to it are held back until it catches up
+                self._held[sid] = [] if self.policy == "coalesce" else None
+                self._start_draining()
+                if self.policy == "disconnect":
+                    self.slow_disconnects += 1
+                    disconnect = True
+            self._hold(sid, pkt)
+        if disconnect:
+            self._disconnect(sid, socket)
+
+    def stats(self):
+        """Returns the depths of the outbound queues and the number of packets that were held back,
+        dropped and disconnected.
+
+        Returns:
+            dict: The backpressure statistics
+        """
+        depths = [s.queue.qsize() for s in list(self.eio.sockets.values())]
+        with self._lock:
+            return {
+                "sockets": len(depths),
+                "queued_packets": sum(depths),
+                "max_queue_depth": max(depths, default=0),
+                "held_sockets": len(self._held),
+                "dropped_packets": self.dropped_packets,
+                "coalesced_events": self.coalesced_events,
+                "resyncs_sent": self.resyncs_sent,
+                "slow_disconnects": self.slow_disconnects
+            }
+
+    def _hold(self, sid: str, pkt):
+        held = self._held[sid]
+        if held is None:
+            self.dropped_packets += 1
+            return
+        # Only plain events with a single argument can be merged into an "events" packet
+        event = None
+        if not pkt.binary:
+            decoded = sio_packet.Packet(encoded_packet=pkt.data)
+            if decoded.packet_type == sio_packet.EVENT and decoded.id is None and len(decoded.data) == 2:
+                event = {"event": decoded.data[0], "data": decoded.data[1]}
+        if event is None or len(held) >= self.limit:
+            self.dropped_packets += len(held) + 1
+            self._held[sid] = None
+            return
+        held.append(event)
+
+    def _start_draining(self):
+        if not self._draining:
+            self._draining = True
+            self.server.start_background_task(self._drain)
+
+    def _drain(self):
+        # Send the held back events or the resync event to every socket that has caught up
+        while True:
+            self.server.sleep(self.check_interval)
+            with self._lock:
+                for sid, held in list(self._held.items()):
+                    socket = self.eio.sockets.get(sid)
+                    if socket is None or socket.closed:
+                        del self._held[sid]
+                    elif socket.queue.qsize() <= self.limit // 2:
+                        del self._held[sid]
+                        if held is None:
+                            self.resyncs_sent += 1
+                            self._send_event(sid, ["resync"])
+                        elif held:
+                            self.coalesced_events += len(held)
+                            self._send_event(sid, ["events", held])
+                if not self._held:
+                    self._draining = False
+                    return
+
+    def _send_event(self, sid: str, data: list):
+        pkt = self.server.packet_class(sio_packet.EVENT, namespace="/", data=data)
+        encoded = pkt.encode()
+        for p in encoded if isinstance(encoded, list) else [encoded]:
+            self._send_packet(sid, eio_packet.Packet(eio_packet.MESSAGE, p))
+
+    def _disconnect(self, sid: str, socket):
+        logger.warning(f"Disconnecting socket {sid}, which has {socket.queue.qsize()} packets waiting to be sent")
+        # The socket is closed without waiting for its queue to be written, since the client is not reading it
+        socket.close(wait=False, abort=True)
+        self.eio.sockets.pop(sid, None)
+        queue_empty = self.eio.get_queue_empty_exception()
+        try:
+            while True:
+                socket.queue.get(block=False)
+                socket.queue.task_done()
+        except queue_empty:
+            pass
+        # Let the writer of the socket know that it is closed
+        socket.queue.put(None)
+
+
+def check_engineio_internals(server):
+    """Checks that the Engine.IO server still has the internals the guard relies on. They are not part
+    of the public API of python-engineio, so a new release could rename them and leave every socket
+    unguarded without an error. requirements.txt pins the versions the guard was written against.
+
+    Args:
+        server (socketio.Server): The Socket.IO server
+
+    Raises:
+        RuntimeError: If any of the internals are missing
+    """
+    eio = server.eio
+    missing = [f"engineio.Server.{name}" for name in ("send_packet", "sockets", "create_queue", "get_queue_empty_exception") if not hasattr(eio, name)]
+    missing += [f"socketio.Server.{name}" for name in ("packet_class", "start_background_task", "sleep") if not hasattr(server, name)]
+    socket_class = getattr(eio_socket, "Socket", None)
+    if socket_class is None:
+        missing.append("engineio.socket.Socket")
+    else:
+        close = getattr(socket_class, "close", None)
+        if close is None or not {"wait", "abort"} <= set(inspect.signature(close).parameters):
+            missing.append("Socket.close(wait, abort)")
+        # The queue and closed flag are only set on instances, so check a socket that is never connected
+        if "create_queue" not in missing:
+            socket = socket_class(eio, "outbound-queue-guard-check")
+            if not hasattr(getattr(socket, "queue", None), "qsize"):
+                missing.append("Socket.queue")
+            if not hasattr(socket, "closed"):
+                missing.append("Socket.closed")
+    if missing:
+        try:
+            version = metadata.version("python-engineio")
+        except metadata.PackageNotFoundError:
+            version = "unknown"
+        raise RuntimeError(
+            f"The outbound queue guard does not support python-engineio {version}, which is missing "
+            f"{', '.join(missing)}. Install the version in requirements.txt or set OUTBOUND_QUEUE_LIMIT=0"
+        )
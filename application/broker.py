@@ -0,0 +1,170 @@
+"""A small publish/subscribe broker that relays Socket.IO events between the worker processes on one
+machine over a Unix domain socket.
+
+Every worker keeps one connection open to the broker. Each newline-terminated line a worker sends is
+forwarded to every connected worker, including the one that sent it. The broker does not look at the
+lines, so it only has to be restarted if the socket path changes.
+
+Usage (from the repository root):
+    python -m application.broker [/tmp/chatapp-broker.sock]
+"""
+import logging
+import os
+import selectors
+import socket
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+# The socket path used when none is configured
+DEFAULT_SOCKET_PATH = "/tmp/chatapp-broker.sock"
+
+
+class MessageBroker:
+
+    def __init__(self, path: str, max_buffer: int=16 * 1024 * 1024):
+        """Initializes a broker that listens on a Unix domain socket.
+
+        Args:
+            path (str): The path of the socket file
+            max_buffer (int, optional): The number of bytes that can be waiting to be sent to one worker.
+                A worker that falls further behind is disconnected, and reconnects once it catches up.
+                Defaults to 16 MiB.
+        """
+        self.path = path
+        self.max_buffer = max_buffer
+        self.lines_relayed = 0
+        self._selector = selectors.DefaultSelector()
+        self._clients = {} # socket -> _BrokerClient
+        self._listener = None
+
+    def serve_forever(self):
+        """Listens for workers and relays their lines until the process is stopped."""
+        # Remove the socket file left by a broker that did not shut down cleanly. A broker that is still
+        # running accepts the connection, in which case this one refuses to start
+        if os.path.exists(self.path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError(f"A broker is already listening on {self.path}")
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        # Only the user running the app may publish, since the workers trust every line they receive
+        os.chmod(self.path, 0o600)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        logger.info(f"Message broker listening on {self.path}")
+        try:
+            while True:
+                for key, mask in self._selector.select():
+                    if key.fileobj is self._listener:
+                        self._accept()
+                        continue
+                    # Skip workers that were disconnected while handling an earlier event
+                    if key.fileobj not in self._clients:
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.fileobj)
+                    if mask & selectors.EVENT_WRITE and key.fileobj in self._clients:
+                        self._write(key.fileobj)
+        finally:
+            self.close()
+
+    def close(self):
+        """Disconnects every worker and removes the socket file."""
+        for conn in list(self._clients):
+            self._drop(conn)
+        if self._listener is not None:
+            self._selector.unregister(self._listener)
+            self._listener.close()
+            self._listener = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _accept(self):
+        conn, _ = self._listener.accept()
+        conn.setblocking(False)
+        self._clients[conn] = _BrokerClient()
+        self._selector.register(conn, selectors.EVENT_READ)
+
+    def _read(self, conn: socket.socket):
+        try:
+            data = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(conn)
+            return
+
+        # Relay every complete line and keep the partial line until the rest of it arrives
+        client = self._clients[conn]
+        client.inbox += data
+        end = client.inbox.rfind(b"\n")
+        if end == -1:
+            return
+        lines = bytes(client.inbox[:end + 1])
+        del client.inbox[:end + 1]
+        self.lines_relayed += lines.count(b"\n")
+        for other in list(self._clients):
+            self._send(other, lines)
+
+    def _send(self, conn: socket.socket, data: bytes):
+        client = self._clients[conn]
+        was_empty = not client.outbox
+        client.outbox += data
+        if len(client.outbox) > self.max_buffer:
+            logger.warning("Disconnected a worker that stopped reading from the message broker")
+            self._drop(conn)
+        elif was_empty:
+            self._selector.modify(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _write(self, conn: socket.socket):
+        client = self._clients[conn]
+        try:
+            sent = conn.send(client.outbox)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop(conn)
+            return
+        del client.outbox[:sent]
+        if not client.outbox:
+            self._selector.modify(conn, selectors.EVENT_READ)
+
+    def _drop(self, conn: socket.socket):
+        self._clients.pop(conn, None)
+        self._selector.unregister(conn)
+        conn.close()
+
+
+class _BrokerClient:
+
+    __slots__ = ("inbox", "outbox")
+
+    def __init__(self):
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+
+if __name__ == "__main__":
+    from config import Config
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Use the path from the command line, then the one in MESSAGE_QUEUE, then the default path
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    elif Config.MESSAGE_QUEUE.startswith("unix://"):
+        path = Config.MESSAGE_QUEUE[len("unix://"):]
+    else:
+        path = DEFAULT_SOCKET_PATH
+    try:
+        MessageBroker(path).serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,329 @@
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+
+
+class RecentMessageCache:
+
+    def __init__(self, max_rooms: int=1000, messages_per_room: int=200, max_messages: int=100000):
+        """Initializes a cache that holds the newest serialized messages of recently used rooms. Each
+        room keeps a ring buffer of its newest messages. Rooms that have not been used recently are
+        evicted first when either the number of rooms or the total number of messages goes over its cap.
+
+        Args:
+            max_rooms (int, optional): The maximum number of rooms to cache. Defaults to 1000.
+            messages_per_room (int, optional): The number of messages kept for each room. Defaults to 200.
+            max_messages (int, optional): The maximum number of messages kept across all rooms.
+                Defaults to 100000.
+        """
+        self.max_rooms = max_rooms
+        self.messages_per_room = messages_per_room
+        self.max_messages = max_messages
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rooms = OrderedDict() # room_code -> _RoomWindow, ordered from least -> most recently used
+        self._msg_rooms = {} # msg_id -> room_code for every cached message
+        self._loading = {} # room_code -> [number of writes while it was being loaded, number of loads in progress]
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_rooms > 0 and self.messages_per_room > 0
+
+    def get(self, room_code: str, limit: int):
+        """Gets the newest messages of a room from the cache.
+
+        Args:
+            room_code (str): The code of the room
+            limit (int): The number of messages wanted
+
+        Returns:
+            list[dict]: The newest `limit` messages of the room sorted from old -> new, or None if the
+                cache cannot answer the request. The dicts are shared with the cache and must not be
+                modified.
+        """
+        with self._lock:
+            window = self._rooms.get(room_code)
+            # The cache can answer if it holds enough messages or it holds every message in the room
+            if window is None or (len(window.messages) < limit and window.has_older):
+                self.misses += 1
+                return None
+            self._rooms.move_to_end(room_code)
+            self.hits += 1
+            if limit >= len(window.messages):
+                return list(window.messages)
+            return list(window.messages)[-limit:]
+
+    def get_message(self, msg_id: int):
+        """Gets a single cached message.
+
+        Args:
+            msg_id (int): The unique id of the message
+
+        Returns:
+            dict: The serialized message, or None if it is not cached
+        """
+        with self._lock:
+            room_code = self._msg_rooms.get(msg_id)
+            if room_code is None:
+                return None
+            for m in self._rooms[room_code].messages:
+                if m["msg_id"] == msg_id:
+                    return m
+            return None
+
+    def begin_load(self, room_code: str):
+        """Marks a room as being loaded from the database. Any write to the room after this and before
+        finish_load() is called means the loaded messages may be out of date, so they will not be cached.
+        Several loads of the same room can be in progress at once.
+
+        Args:
+            room_code (str): The code of the room being loaded
+
+        Returns:
+            int: The write version of the room when the load began, to pass to finish_load()
+        """
+        with self._lock:
+            loading = self._loading.setdefault(room_code, [0, 0])
+            loading[1] += 1
+            return loading[0]
+
+    def finish_load(self, room_code: str, messages: list, has_older: bool, version: int):
+        """Stores the newest messages of a room after they were loaded from the database, unless the
+        room was written to since the load began. A load that failed is finished with `messages` set
+        to None so that it is no longer tracked.
+
+        Args:
+            room_code (str): The code of the room that was loaded
+            messages (list[dict]): The newest serialized messages of the room sorted from old -> new,
+                or None if the load failed
+            has_older (bool): Whether the room contains messages older than the ones loaded
+            version (int): The write version returned by begin_load()
+        """
+        with self._lock:
+            loading = self._loading.get(room_code)
+            if loading is None:
+                return
+            dirty = loading[0] != version
+            loading[1] -= 1
+            if loading[1] == 0:
+                del self._loading[room_code]
+            if messages is None or dirty or not self.enabled:
+                return
+            self._drop_room(room_code)
+            window = _RoomWindow(self.messages_per_room)
+            window.messages.extend(messages)
+            window.has_older = has_older or len(messages) > self.messages_per_room
+            self._rooms[room_code] = window
+            for m in window.messages:
+                self._msg_rooms[m["msg_id"]] = room_code
+            self._total += len(window.messages)
+            self._evict()
+
+    def add(self, room_code: str, message: dict):
+        """Adds a newly sent message to the cached room it was sent in.
+
+        Args:
+            room_code (str): The code of the room the message was sent in
+            message (dict): The serialized message
+        """
+        with self._lock:
+            if room_code in self._loading:
+                self._loading[room_code][0] += 1
+            window = self._rooms.get(room_code)
+            if window is None:
+                return
+            # Drop the oldest message when the ring buffer is full
+            if len(window.messages) == window.messages.maxlen:
+                oldest = window.messages.popleft()
+                self._msg_rooms.pop(oldest["msg_id"], None)
+                window.has_older = True
+                self._total -= 1
+            # Messages relayed from other workers can arrive slightly out of order, so the message is
+            # inserted after the newest message with a smaller id to keep the window sorted
+            i = len(window.messages)
+            while i > 0 and window.messages[i - 1]["msg_id"] > message["msg_id"]:
+                i -= 1
+            window.messages.insert(i, message)
+            self._msg_rooms[message["msg_id"]] = room_code
+            self._total += 1
+            self._evict()
+
+    def edit(self, msg_id: int, new_content: str):
+        """Updates the content of a cached message.
+
+        Args:
+            msg_id (int): The unique id of the message
+            new_content (str): The new content of the message
+        """
+        with self._lock:
+            self._mark_loading_dirty()
+            room_code = self._msg_rooms.get(msg_id)
+            if room_code is None:
+                return
+            window = self._rooms[room_code]
+            for i, m in enumerate(window.messages):
+                if m["msg_id"] == msg_id:
+                    # Replace the dict so that lists already handed out by get() are not changed
+                    m = dict(m)
+                    m["content"] = new_content
+                    window.messages[i] = m
+                    break
+
+    def remove(self, msg_ids: list):
+        """Removes messages from the cache.
+
+        Args:
+            msg_ids (list[int]): The unique ids of the messages to remove
+        """
+        with self._lock:
+            self._mark_loading_dirty()
+            for msg_id in msg_ids:
+                room_code = self._msg_rooms.pop(msg_id, None)
+                if room_code is None:
+                    continue
+                window = self._rooms[room_code]
+                for m in window.messages:
+                    if m["msg_id"] == msg_id:
+                        window.messages.remove(m)
+                        self._total -= 1
+                        break
+
+    def clear(self):
+        """Removes every room from the cache."""
+        with self._lock:
+            self._mark_loading_dirty()
+            self._rooms.clear()
+            self._msg_rooms.clear()
+            self._total = 0
+
+    def stats(self):
+        """Returns the hit/miss counters and the current size of the cache.
+
+        Returns:
+            dict: The cache statistics
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "rooms": len(self._rooms),
+                "messages": self._total
+            }
+
+    def _mark_loading_dirty(self):
+        # The room of an edited or deleted message is unknown unless it is cached, so every load
+        # in progress has to be treated as out of date
+        for loading in self._loading.values():
+            loading[0] += 1
+
+    def _drop_room(self, room_code: str):
+        window = self._rooms.pop(room_code, None)
+        if window is None:
+            return
+        for m in window.messages:
+            self._msg_rooms.pop(m["msg_id"], None)
+        self._total -= len(window.messages)
+
+    def _evict(self):
+        # Evict the least recently used rooms until the cache is back under its caps
+        while self._rooms and (len(self._rooms) > self.max_rooms or self._total > self.max_messages):
+            room_code = next(iter(self._rooms))
+            self._drop_room(room_code)
+            self.evictions += 1
+
+
+class _RoomWindow:
+
+    __slots__ = ("messages", "has_older")
+
+    def __init__(self, size: int):
+        self.messages = deque(maxlen=size)
+        self.has_older = False
+
+
+class TTLCache:
+
+    def __init__(self, max_size: int=10000, ttl: float=300):
+        """Initializes a bounded cache where entries expire after a fixed time. Once the cache is full,
+        the least recently used entry is evicted to make room for a new one.
+
+        Args:
+            max_size (int, optional): The maximum number of entries. Defaults to 10000.
+            ttl (float, optional): The number of seconds an entry stays valid for. Defaults to 300.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (expiry time, value), ordered from least -> most recently used
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Gets a value from the cache.
+
+        Args:
+            key: The key of the entry
+
+        Returns:
+            The cached value, or None if there is no valid entry for the key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Adds a value to the cache, replacing any existing entry for the key.
+
+        Args:
+            key: The key of the entry
+            value: The value to cache
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes the entry for a key from the cache.
+
+        Args:
+            key: The key of the entry
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss counters and the current size of the cache.
+
+        Returns:
+            dict: The cache statistics
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries)
+            }
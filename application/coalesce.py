@@ -0,0 +1,142 @@
+import threading
+import time
+
+from .metrics import record_fanout
+
+
+class EventCoalescer:
+
+    def __init__(self, socketio, window_ms: float=0, max_delay_ms: float=100, max_batch: int=100):
+        """Initializes a coalescer that batches the events emitted to each room during bursts. The first
+        event for a room starts a batch, and the batch is sent once no event has been added for
+        `window_ms`, once its oldest event has waited `max_delay_ms`, or as soon as it holds `max_batch`
+        events. A batch of several events is sent as a single "events" packet holding a list of
+        {"event", "data"} dicts in the order they were emitted, and a batch of one event is sent as the
+        event itself.
+
+        Args:
+            socketio (flask_socketio.SocketIO): The server used to emit the batches
+            window_ms (float, optional): The number of milliseconds to wait for more events. Defaults to
+                0, which emits every event right away.
+            max_delay_ms (float, optional): The longest an event may be held back for, in milliseconds.
+                Defaults to 100.
+            max_batch (int, optional): The most events sent in one packet. Defaults to 100.
+        """
+        self.socketio = socketio
+        self.window = window_ms / 1000
+        self.max_delay = max(max_delay_ms, window_ms) / 1000
+        self.max_batch = max_batch
+        self.events_emitted = 0
+        self.packets_emitted = 0
+        self._batches = {} # room -> _Batch
+        self._turns = {} # room -> [next turn to give out, turn of the batch being sent]
+        self._lock = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_batch > 1
+
+    def emit(self, event: str, data, room: str):
+        """Emits an event to every client in a room, batching it with the other events emitted to the
+        room if coalescing is enabled.
+
+        Args:
+            event (str): The name of the event
+            data: The data of the event
+            room (str): The room to send the event to
+        """
+        if not self.enabled:
+            self._send(room, [(event, data)])
+            return
+        now = time.monotonic()
+        with self._lock:
+            batch = self._batches.get(room)
+            if batch is None:
+                batch = self._batches[room] = _Batch(now)
+                self.socketio.start_background_task(self._flush_later, room, batch)
+            batch.events.append((event, data))
+            batch.last_added = now
+            # Send a full batch right away, and let the next event start a new one
+            if len(batch.events) < self.max_batch:
+                return
+            self._take(room, batch)
+        self._send_in_turn(room, batch)
+
+    def flush(self):
+        """Emits every batch that is waiting to be sent."""
+        with self._lock:
+            batches = list(self._batches.items())
+            for room, batch in batches:
+                self._take(room, batch)
+        for room, batch in batches:
+            self._send_in_turn(room, batch)
+
+    def stats(self):
+        """Returns the number of events emitted and the number of packets they were sent in.
+
+        Returns:
+            dict: The coalescer statistics
+        """
+        with self._lock:
+            return {"events": self.events_emitted, "packets": self.packets_emitted, "pending_rooms": len(self._batches)}
+
+    def _flush_later(self, room: str, batch):
+        while True:
+            # Wait until the room has been quiet for the window or the oldest event has used up its budget
+            with self._lock:
+                if batch.sent:
+                    return
+                deadline = min(batch.last_added + self.window, batch.started + self.max_delay)
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    self._take(room, batch)
+                    break
+            self.socketio.sleep(delay)
+        self._send_in_turn(room, batch)
+
+    def _take(self, room: str, batch):
+        # Removes a batch that is about to be sent and gives it the next turn of its room. This must be
+        # called with the lock held
+        del self._batches[room]
+        batch.sent = True
+        turns = self._turns.setdefault(room, [0, 0])
+        batch.turn = turns[0]
+        turns[0] += 1
+
+    def _send_in_turn(self, room: str, batch):
+        # A full batch is sent by the thread that filled it, so it could otherwise overtake an older batch
+        # of the same room that is being sent by another thread
+        with self._lock:
+            turns = self._turns[room]
+            while turns[1] != batch.turn:
+                self._lock.wait()
+        try:
+            self._send(room, batch.events)
+        finally:
+            with self._lock:
+                turns[1] += 1
+                if turns[1] == turns[0]:
+                    del self._turns[room]
+                self._lock.notify_all()
+
+    def _send(self, room: str, events: list):
+        with self._lock:
+            self.events_emitted += len(events)
+            self.packets_emitted += 1
+        record_fanout(self.socketio, events[0][0] if len(events) == 1 else "events", room)
+        if len(events) == 1:
+            self.socketio.emit(events[0][0], events[0][1], to=room)
+        else:
+            self.socketio.emit("events", [{"event": event, "data": data} for event, data in events], to=room)
+
+
+class _Batch:
+
+    __slots__ = ("events", "started", "last_added", "sent", "turn")
+
+    def __init__(self, now: float):
+        self.events = []
+        self.started = now
+        self.last_added = now
+        self.sent = False
+        self.turn = None
@@ -1,31 +1,542 @@
+import atexit
+import datetime
+import logging
+import os
 import sqlite3
-import copy
+import threading
+import time
 import pymongo
 
 from config import Config
+from .cache import RecentMessageCache
+from .cache import TTLCache
+from .executor import blocking
 from .message import Message
+from .message import message_doc_to_dict
+from .message import to_epoch
 from .user import User
+from .writer import MessageWriter
 
 
-class DataBase:
+logger = logging.getLogger(__name__)
+
+# The room code of the tombstone left when every message is deleted, which applies to every room
+ALL_ROOMS = "*"
+
+
+def now_ms():
+    """Returns the current time as the number of milliseconds since the UNIX epoch, which is the unit of
+    the edit and delete times used to resync reconnecting clients.
+
+    Returns:
+        int: The current time in milliseconds
+    """
+    return int(time.time() * 1000)
+
+
+# The MongoClient shared by the whole process. MongoClient is thread-safe and manages its own
+# connection pool, so one client is created lazily and every DataBase instance borrows it.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide MongoClient, creating it on first use. A new client is created
+    if the process has been forked since the client was made, since MongoClient is not fork-safe.
+
+    Returns:
+        pymongo.MongoClient: The shared client
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = pymongo.MongoClient(
+                Config.DB_CONNECTION_STRING,
+                maxPoolSize=Config.DB_MAX_POOL_SIZE,
+                minPoolSize=Config.DB_MIN_POOL_SIZE,
+                maxIdleTimeMS=Config.DB_MAX_IDLE_TIME_MS,
+                connectTimeoutMS=Config.DB_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=Config.DB_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=Config.DB_SOCKET_TIMEOUT_MS
+            )
+            _client_pid = os.getpid()
+    return _client
+
+def close_client():
+    """Closes the process-wide MongoClient, releasing its pooled connections and monitor threads.
+    This is run automatically when the process exits. A new client will be created if the database
+    is used again afterwards.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+atexit.register(close_client)
+
+
+# The write-behind queue for new messages, which is only used when Config.WRITE_BEHIND is enabled
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Returns the process-wide write-behind queue for new messages, creating it on first use. The
+    queued messages are written when the process exits.
+
+    Returns:
+        MessageWriter: The shared writer, or None if write-behind is disabled
+    """
+    global _writer, _writer_pid
+    if not Config.WRITE_BEHIND:
+        return None
+    if _writer is not None and _writer_pid == os.getpid():
+        return _writer
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = MessageWriter(
+                lambda msg_dicts: DataBase().insert_message_dicts(msg_dicts),
+                batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=Config.WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+                max_pending=Config.WRITE_BEHIND_MAX_PENDING,
+                max_retries=Config.WRITE_BEHIND_MAX_RETRIES,
+                retry_backoff=Config.WRITE_BEHIND_RETRY_BACKOFF_MS / 1000
+            )
+            _writer_pid = os.getpid()
+            # This runs before close_client() since atexit functions run in reverse order
+            atexit.register(_writer.close)
+    return _writer
+
+
+# The fields needed to construct a Message object. Queries for messages only fetch these fields
+MESSAGE_PROJECTION = {
+    "content": 1,
+    "author_id": 1,
+    "author_username": 1,
+    "timestamp": 1,
+    "room_code": 1,
+    "replying_to": 1
+}
+
+
+# The newest serialized messages of recently used rooms. This is kept up to date by the DataBase
+# methods that write messages so that joining a room usually does not need to query the database
+recent_messages = RecentMessageCache(
+    Config.RECENT_CACHE_ROOMS,
+    Config.RECENT_CACHE_MESSAGES_PER_ROOM,
+    Config.RECENT_CACHE_MAX_MESSAGES
+)
+
+
+# Users looked up by their id, keyed by the user id. Users rarely change, so this saves a query on
+# every page load and reconnect. Entries are removed whenever the user is changed
+user_cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+
+
+class BaseDataBase:
+    """The storage logic shared by every database backend. This keeps the recent message cache and
+    the write-behind queue in sync with the database, while the subclasses make the actual queries.
+    """
+
+    def close(self):
+        """Releases this handle. Connections are shared between handles, so they stay open until
+        the process shuts down.
+        """
+        pass
+
+    def add_user(self, user_object: User):
+        """Adds a new user to the database.
+
+        Args:
+            user_object (User): The user to add
+
+        Returns:
+            bool: True if the user was added, or False if the username is already taken
+        """
+        added = self._insert_user(user_object)
+        self.invalidate_user(user_object.user_id)
+        return added
+
+    def get_user_by_id(self, user_id):
+        """Gets a user by their id. Users are served from the user cache when possible.
+
+        Args:
+            user_id (int): The unique id of the user
+
+        Returns:
+            User: The user, or False if no user has the id. The user may be shared with the cache and
+                must not be modified.
+        """
+        user_object = user_cache.get(int(user_id))
+        if user_object is not None:
+            return user_object
+        user_object = self._find_user_by_id(int(user_id))
+        if user_object != False:
+            user_cache.set(user_object.user_id, user_object)
+        return user_object
+
+    def invalidate_user(self, user_id):
+        """Removes a user from the user cache. This must be run whenever a user is changed in the database.
+
+        Args:
+            user_id (int): The unique id of the user
+        """
+        user_cache.invalidate(int(user_id))
+
+    def add_message(self, msg_object: Message):
+        # Format the message object data into JSON
+        msg_dict = {
+            "content": msg_object.content,
+            "author_id": msg_object.author_id,
+            "author_username": msg_object.author_username,
+            "timestamp": msg_object.timestamp,
+            "_id": msg_object.msg_id,
+            "room_code": msg_object.room_code,
+            "replying_to": msg_object.replying_to
+        }
+
+        # Queue the message to be written in the background if write-behind is enabled. Otherwise,
+        # make the query to the database. Then, add the message to the room's cached messages
+        writer = get_writer()
+        if writer is not None:
+            writer.submit(msg_dict)
+        else:
+            self.insert_message_dicts([msg_dict])
+        recent_messages.add(msg_object.room_code, msg_object.to_dict())
+    
+    def flush_writes(self):
+        """Writes all messages queued by the write-behind queue to the database. This is run before
+        reading messages from the database so that the reads include every message that was sent.
+        """
+        writer = get_writer()
+        if writer is not None:
+            writer.flush()
+    
+    def get_room_messages(self, room_code="GLOBAL", limit: int=None, before: int=None):
+        """Gets the messages sent in the specified chat room from the database and returns them. When
+        a limit is given, only the newest messages are returned. Older pages can then be fetched by
+        passing the ID of the oldest message already fetched as `before`.
+
+        Args:
+            room_code (str, optional): The code of the chat room. Defaults to "GLOBAL".
+            limit (int, optional): The maximum number of messages to return. Defaults to None, which
+                returns every message in the room.
+            before (int, optional): Only return messages sent before the message with this ID.
+                Defaults to None.
+        
+        Returns:
+            list[Message]: A list of Message objects that were sent in the chat room with the specified
+                room code, sorted from old -> new.
+        """
+        self.flush_writes()
+        return [self._construct_message(msg) for msg in self._find_room_message_docs(room_code, limit, before)]
+    
+    def get_room_message_dicts(self, room_code="GLOBAL", limit: int=None, before: int=None):
+        """Gets the same messages as get_room_messages(), but converts the database rows straight into
+        the dicts sent to clients without creating Message objects. This should be used whenever the
+        messages are only going to be sent to clients.
+
+        Args:
+            room_code (str, optional): The code of the chat room. Defaults to "GLOBAL".
+            limit (int, optional): The maximum number of messages to return. Defaults to None, which
+                returns every message in the room.
+            before (int, optional): Only return messages sent before the message with this ID.
+                Defaults to None.
+        
+        Returns:
+            list[dict]: The messages converted to dicts and sorted from old -> new.
+        """
+        self.flush_writes()
+        return [message_doc_to_dict(msg) for msg in self._find_room_message_docs(room_code, limit, before)]
+    
+    def get_recent_messages(self, room_code="GLOBAL", limit: int=50):
+        """Gets the newest messages sent in the specified chat room as dicts. These are served from the
+        recent message cache when possible, and the room is loaded into the cache otherwise.
+
+        Args:
+            room_code (str, optional): The code of the chat room. Defaults to "GLOBAL".
+            limit (int, optional): The maximum number of messages to return. Defaults to 50.
+
+        Returns:
+            list[dict]: The newest messages of the room converted to dicts and sorted from old -> new.
+                These may be shared with the cache and must not be modified.
+        """
+        messages = recent_messages.get(room_code, limit)
+        if messages is not None:
+            return messages
+        
+        # Skip the cache if more messages are wanted than it keeps for each room
+        window = recent_messages.messages_per_room
+        if not recent_messages.enabled or limit > window:
+            return self.get_room_message_dicts(room_code, limit=limit)
+        
+        # Load the newest messages of the room into the cache. One extra message is fetched to find
+        # out whether the cache holds every message in the room
+        version = recent_messages.begin_load(room_code)
+        try:
+            messages = self.get_room_message_dicts(room_code, limit=window + 1)
+        except Exception:
+            recent_messages.finish_load(room_code, None, False, version)
+            raise
+        has_older = len(messages) > window
+        if has_older:
+            messages = messages[1:]
+        recent_messages.finish_load(room_code, messages, has_older, version)
+
+        return messages[-limit:]
+    
+    def get_message(self, msg_id: int):
+        """Retrieves a message from the database and converts it to a Message object
+
+        Args:
+            msg_id (int): The unique id of the message you wish to get
+
+        Returns:
+            Message: The Message object containing the message data
+        """
+        # Check whether the message is still waiting to be written before querying the database
+        writer = get_writer()
+        m = writer.get_pending(int(msg_id)) if writer is not None else None
+        if m is None:
+            m = self._find_message(int(msg_id))
+        if m is None:
+            return None
+        else:
+            return self._construct_message(m)
+
+    def get_message_room(self, msg_id: int):
+        """Gets the code of the room a message was sent in, using the cached copy of the message if
+        there is one.
+
+        Args:
+            msg_id (int): The unique id of the message
+
+        Returns:
+            str: The room code, or None if the message does not exist or the id is not a valid message id
+        """
+        # The id comes from the client, so it may not be a number at all
+        try:
+            msg_id = int(msg_id)
+        except (TypeError, ValueError):
+            return None
+        m = recent_messages.get_message(msg_id)
+        if m is not None:
+            return m["room_code"]
+        m = self.get_message(msg_id)
+        return m.room_code if m is not None else None
+
+    def delete_all_messages(self):
+        """Removes all messages from the database.
+        """
+        self.flush_writes()
+        self._delete_all_message_docs()
+        # Leave a tombstone for every room so that reconnecting clients reload their room
+        self._insert_tombstones(ALL_ROOMS, [0], now_ms())
+        recent_messages.clear()
+    
+    def delete_message(self, msg_id: int, room_code: str=None):
+        """Deletes the specified message from the database.
+
+        Args:
+            msg_id (int): The unique id of the message to be deleted
+            room_code (str, optional): The code of the room the message was sent in. Defaults to None,
+                which looks up the room of the message.
+        """
+        if room_code is None:
+            room_code = self.get_message_room(msg_id)
+            if room_code is None:
+                return
+        # Remove the message from the write-behind queue if it has not been written yet
+        writer = get_writer()
+        if writer is None or not writer.discard_pending(int(msg_id)):
+            self._delete_message_docs([int(msg_id)])
+        # Clients may have already received the message, so a tombstone is left either way
+        self._insert_tombstones(room_code, [int(msg_id)], now_ms())
+        recent_messages.remove([int(msg_id)])
+    
+    def purge_room_messages(self, room_code: str, count: int):
+        """Deletes the newest messages from a room with a single query.
+
+        Args:
+            room_code (str): The code of the room to delete the messages from
+            count (int): The number of messages to delete
+
+        Returns:
+            list[int]: The unique ids of the messages that were deleted, which is empty if `count` is
+                not positive
+        """
+        # SQLite treats a negative limit as no limit and MongoDB as the absolute value, so check it here
+        if count <= 0:
+            return []
+        self.flush_writes()
+        msg_ids = self._find_newest_message_ids(room_code, count)
+        if len(msg_ids) > 0:
+            self._delete_message_docs(msg_ids)
+            self._insert_tombstones(room_code, msg_ids, now_ms())
+            recent_messages.remove(msg_ids)
+        return msg_ids
+    
+    def purge_author_messages(self, room_code: str, author_username: str):
+        """Deletes every message sent by a user in a room with a single query.
+
+        Args:
+            room_code (str): The code of the room to delete the messages from
+            author_username (str): The username of the user whose messages are deleted
+
+        Returns:
+            list[int]: The unique ids of the messages that were deleted
+        """
+        self.flush_writes()
+        msg_ids = self._find_author_message_ids(room_code, author_username)
+        if len(msg_ids) > 0:
+            self._delete_message_docs(msg_ids)
+            self._insert_tombstones(room_code, msg_ids, now_ms())
+            recent_messages.remove(msg_ids)
+        return msg_ids
+    
+    def edit_message(self, msg_id: int, new_content: str):
+        """Edits the specified message in the database.
+        
+        Args:
+            msg_id (int): The unique id of the message to be edited
+            new_content (str): The new content of the message which will replace the existing content
+        """
+        # Edit the queued message if it has not been written yet so that the edit is not lost. The time
+        # of the edit is stored so that reconnecting clients can be sent the edits they missed
+        edited_at = now_ms()
+        writer = get_writer()
+        if writer is None or not writer.update_pending(int(msg_id), {"content": new_content, "edited_at": edited_at}):
+            self._update_message_content(int(msg_id), new_content, edited_at)
+        recent_messages.edit(int(msg_id), str(new_content))
+
+    def get_room_changes(self, room_code: str, last_msg_id: int, since: int):
+        """Gets the changes made to a room since a client last saw it, so that a reconnecting client only
+        has to be sent what it missed. The changes are the messages sent after the client's newest message,
+        and the messages edited or deleted after the watermark the client was given.
+
+        Args:
+            room_code (str): The code of the room
+            last_msg_id (int): The id of the newest message the client has
+            since (int): The watermark the client was given, in milliseconds since the epoch
+
+        Returns:
+            dict: The new messages sorted from old -> new, the edits, the ids of the deleted messages and
+                the watermark for the next reconnect, or None if the client has to reload the room because
+                it missed more than a page of messages or its watermark is too old
+        """
+        watermark = now_ms()
+        if since < watermark - Config.RESYNC_MAX_AGE * 1000:
+            return None
+
+        # The newest page of messages holds every new message unless there are more than a page of them
+        page = self.get_recent_messages(room_code, limit=Config.HISTORY_PAGE_SIZE + 1)
+        if len(page) > Config.HISTORY_PAGE_SIZE and page[0]["msg_id"] > last_msg_id:
+            return None
+        messages = [m for m in page if m["msg_id"] > last_msg_id]
+
+        # Find the edits and deletes of the messages the client already has
+        deleted = self._find_tombstone_ids(room_code, since)
+        if 0 in deleted:
+            return None
+        self.flush_writes()
+        edited = [
+            {"msg_id": m["_id"], "new_content": m["content"]}
+            for m in self._find_edited_message_docs(room_code, since, last_msg_id)
+        ]
+        return {"messages": messages, "edited": edited, "deleted": deleted, "watermark": watermark}
+
+    def _construct_message(self, msg: dict):
+        # Messages are stored with naive UTC timestamps in MongoDB and UNIX timestamps in SQLite, while
+        # queued messages still have the timezone aware timestamp they were created with
+        timestamp = msg["timestamp"]
+        if not isinstance(timestamp, datetime.datetime) or timestamp.tzinfo is not None:
+            timestamp = datetime.datetime.fromtimestamp(to_epoch(timestamp), datetime.timezone.utc).replace(tzinfo=None)
+        return Message.construct_message(
+            msg["content"],
+            msg["author_id"],
+            msg["author_username"],
+            timestamp,
+            msg["room_code"],
+            msg["_id"],
+            msg.get("replying_to", 0)
+        )
+
+
+class MongoDataBase(BaseDataBase):
 
     def __init__(self):
-        self.client = pymongo.MongoClient(Config.DB_CONNECTION_STRING)
+        """Creates a lightweight handle onto the shared MongoClient. This is cheap, so a new
+        instance can be created for every request or socket event.
+        """
+        self.client = get_client()
         self.db = self.client["ChatApp"]
         self.users = self.db["Users"]
         self.messages = self.db["Messages"]
+        self.tombstones = self.db["Tombstones"]
     
     def close(self):
-        pass
+        """Releases this handle. The shared client stays open so that its pooled connections can be
+        reused by other handles, and is closed by close_client() when the process shuts down.
+        """
+        self.users = None
+        self.messages = None
+        self.tombstones = None
+        self.db = None
+        self.client = None
+
+    @blocking
+    def create_indexes(self):
+        """Creates the indexes used by the queries in this class. Creating an index that already
+        exists does nothing, so this is safe to run every time the application starts.
+        """
+        self.messages.create_index(
+            [("room_code", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+            name="room_code_id"
+        )
+        self.messages.create_index(
+            [("room_code", pymongo.ASCENDING), ("author_username", pymongo.ASCENDING)],
+            name="room_code_author_username"
+        )
+        self.messages.create_index(
+            [("room_code", pymongo.ASCENDING), ("edited_at", pymongo.ASCENDING)],
+            name="room_code_edited_at",
+            partialFilterExpression={"edited_at": {"$exists": True}}
+        )
+        # Tombstones are only needed by clients that reconnect soon after, so MongoDB removes old ones
+        self.tombstones.create_index(
+            [("room_code", pymongo.ASCENDING), ("deleted_at", pymongo.ASCENDING)],
+            name="room_code_deleted_at"
+        )
+        self.tombstones.create_index("created", expireAfterSeconds=Config.RESYNC_MAX_AGE, name="created")
+        # Usernames must be unique. If the collection already contains duplicate usernames, fall back
+        # to a regular index so that logging in is still an indexed lookup
+        try:
+            self.users.create_index("username", unique=True, name="username")
+        except pymongo.errors.OperationFailure:
+            logger.exception("Could not create a unique index on the usernames, falling back to a regular index")
+            self.users.create_index("username", name="username")
 
-    def add_user(self, user_object: User):
+    @blocking
+    def _insert_user(self, user_object: User):
         # Convert the user_object to JSON
         user_dict = user_object.to_dict()
         user_dict["_id"] = user_dict.pop("user_id")
 
-        # Update the users collection with the new user object
-        self.users.insert_one(user_dict)
+        # Update the users collection with the new user object. The unique index on the username
+        # rejects the user if the username is taken
+        try:
+            self.users.insert_one(user_dict)
+        except pymongo.errors.DuplicateKeyError:
+            return False
+        return True
     
+    @blocking
     def get_all_users(self):
         """Gets all users from the database and converts them into User objects.
 
@@ -46,7 +557,8 @@ class DataBase:
         
         return user_objects
 
-    def get_user_by_id(self, user_id):
+    @blocking
+    def _find_user_by_id(self, user_id: int):
         # Make the query to the database
         user_data = self.users.find_one({"_id": user_id})
         
@@ -64,8 +576,9 @@ class DataBase:
 
         return user_object
     
+    @blocking
     def get_user_by_credentials(self, username: str, password: str):
-        # Make the query to the database
+        # Make the query to the database using the unique index on the username
         user_data = self.users.find_one({"username" : username, "password": password})
         
         # Check if the user was found
@@ -82,20 +595,20 @@ class DataBase:
 
         return user_object
     
-    def add_message(self, msg_object: Message):
-        # Format the message object data into JSON
-        msg_dict = {
-            "content": msg_object.content,
-            "author_id": msg_object.author_id,
-            "author_username": msg_object.author_username,
-            "timestamp": msg_object.timestamp,
-            "_id": msg_object.msg_id,
-            "room_code": msg_object.room_code,
-            "replying_to": msg_object.replying_to
-        }
+    @blocking
+    def insert_message_dicts(self, msg_dicts: list):
+        """Inserts a batch of messages that are already formatted as database documents. Messages that
+        were already inserted are skipped, so a batch can be retried after a partial failure.
 
-        # Make the query to the database
-        self.messages.insert_one(msg_dict)
+        Args:
+            msg_dicts (list[dict]): The messages to insert
+        """
+        try:
+            self.messages.insert_many(msg_dicts, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Ignore duplicate key errors, since those messages were written by an earlier attempt
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
     
     def get_all_messages(self):
         """Gets all messages from the message database.
@@ -103,146 +616,110 @@ class DataBase:
         Returns:
             list[Message]: A list of Message objects containing the message data from the database.
         """
-        message_data = self.messages.find()
-        
-        # Check if there were any messages in the database
-        if message_data is None:
-            return []
-        
-        # Construct the Message objects from the message dict
-        messages = []
-        for msg in message_data:
-            m = Message.construct_message(
-                msg["content"],
-                msg["author_id"],
-                msg["author_username"],
-                msg["timestamp"],
-                msg["room_code"],
-                msg["_id"],
-                msg["replying_to"]
-            )
-            messages.append(m)
+        self.flush_writes()
+        # Construct the Message objects from the message dicts
+        messages = [self._construct_message(msg) for msg in self._find_all_message_docs()]
         
         # Sort the messages from old -> new
         messages.sort(key=lambda m: m.timestamp)
 
         return messages
     
+    @blocking
+    def _find_all_message_docs(self):
+        return list(self.messages.find())
+
+
+    @blocking
+    def _find_room_message_docs(self, room_code: str, limit: int, before: int):
+        # Message ids are ordered by the time the messages were sent, so pages are read by walking the
+        # (room_code, _id) index backwards from the `before` message instead of skipping over documents
+        query = {"room_code": room_code}
+        if before is not None:
+            query["_id"] = {"$lt": int(before)}
+
+        # Fetch the messages from the specified room. Pages are read from new -> old so that the limit
+        # keeps the newest messages, and are then sorted from old -> new
+        if limit is None:
+            return list(self.messages.find(query, MESSAGE_PROJECTION).sort("_id", pymongo.ASCENDING))
+        message_data = list(self.messages.find(query, MESSAGE_PROJECTION).sort("_id", pymongo.DESCENDING).limit(limit))
+        message_data.reverse()
+        return message_data
+
+    @blocking
+    def _find_message(self, msg_id: int):
+        return self.messages.find_one({"_id": msg_id})
+
+    @blocking
+    def _find_newest_message_ids(self, room_code: str, count: int):
+        # Find the ids of the newest messages using the (room_code, _id) index
+        return [m["_id"] for m in self.messages.find({"room_code": room_code}, {"_id": 1}).sort(
+            "_id", pymongo.DESCENDING
+        ).limit(count)]
+
+    @blocking
+    def _find_author_message_ids(self, room_code: str, author_username: str):
+        query = {"room_code": room_code, "author_username": author_username}
+        return [m["_id"] for m in self.messages.find(query, {"_id": 1})]
+
+    @blocking
+    def _delete_all_message_docs(self):
+        self.messages.delete_many({})
 
-    def get_room_messages(self, room_code="GLOBAL"):
-        """Gets all messages sent in the specified chat room from the database and returns them.
+    @blocking
+    def _delete_message_docs(self, msg_ids: list):
+        self.messages.delete_many({"_id": {"$in": msg_ids}})
 
-        Args:
-            room_code (str, optional): The code of the chat room. Defaults to "GLOBAL".
-        
-        Returns:
-            list[Message]: A list of Message objects that were sent in the chat room with the specified
-                room code.
-        """
-        message_data = self.messages.find()
-        
-        # Check if there were any messages in the database
-        if message_data is None:
-            return []
+    @blocking
+    def _update_message_content(self, msg_id: int, new_content: str, edited_at: int):
+        self.messages.update_one({"_id": msg_id}, {"$set": {"content": new_content, "edited_at": edited_at}})
 
-        # Construct the Message objects from the message dict
-        messages = []
-        for msg in message_data:
-            # Skip over all messages that are not from the specified room
-            if msg["room_code"] != room_code:
-                continue
-            m = Message.construct_message(
-                msg["content"],
-                msg["author_id"],
-                msg["author_username"],
-                msg["timestamp"],
-                msg["room_code"],
-                msg["_id"],
-                msg["replying_to"]
-            )
-            messages.append(m)
-        
-        # Sort the messages from old -> new
-        messages.sort(key=lambda m: m.timestamp)
+    @blocking
+    def _find_edited_message_docs(self, room_code: str, since: int, up_to_id: int):
+        query = {"room_code": room_code, "edited_at": {"$gt": since}, "_id": {"$lte": up_to_id}}
+        return list(self.messages.find(query, {"_id": 1, "content": 1}))
 
-        return messages
-    
-    def get_message(self, msg_id: int):
-        """Retrieves a message from the database and converts it to a Message object
+    @blocking
+    def _insert_tombstones(self, room_code: str, msg_ids: list, deleted_at: int):
+        created = datetime.datetime.utcnow()
+        self.tombstones.bulk_write([
+            pymongo.ReplaceOne(
+                {"_id": msg_id},
+                {"room_code": room_code, "deleted_at": deleted_at, "created": created},
+                upsert=True
+            ) for msg_id in msg_ids
+        ], ordered=False)
 
-        Args:
-            msg_id (int): The unique id of the message you wish to get
+    @blocking
+    def _find_tombstone_ids(self, room_code: str, since: int):
+        query = {"room_code": {"$in": [room_code, ALL_ROOMS]}, "deleted_at": {"$gt": since}}
+        return [t["_id"] for t in self.tombstones.find(query, {"_id": 1})]
 
-        Returns:
-            Message: The Message object containing the message data
-        """
-        m = self.messages.find_one({"_id": msg_id})
-        if m is None:
-            return None
-        else:
-            return Message(
-                m["content"],
-                m["author_id"],
-                m["author_username"],
-                m["room_code"],
-                m["replying_to"]
-            )
 
-    def delete_all_messages(self):
-        """Removes all messages from the Messages collection in the database.
-        """
-        self.messages.delete_many({})
-    
-    def delete_message(self, msg_id: int):
-        """Deletes the specified message from the Messages collection.
+class SQLiteDataBase(BaseDataBase):
 
-        Args:
-            msg_id (int): The unique id of the message to be deleted
-        """
-        self.messages.delete_one({"_id": int(msg_id)})
-    
-    def edit_message(self, msg_id: int, new_content: str):
-        """Edits the specified message from the Messages collection.
-        
-        Args:
-            msg_id (int): The unique id of the message to be edited
-            new_content (str): The new content of the message which will replace the existing content
-        """
-        self.messages.update_one({"_id": int(msg_id)}, {"$set": {"content": new_content}})
-
-
-class SQLiteDataBase:
-
-    def __init__(self, db_path="database.db"):
-        """Attempt to create a connection to the database via the provided path. Additionally,
-        the cursor from the connection is saved.
+    def __init__(self, db_path: str=None):
+        """Creates a handle onto the SQLite database at the provided path. Each thread gets its own
+        connection to the database, which is opened the first time the thread uses the database and
+        is reused by every handle made in that thread afterwards.
 
         Args:
-            db_path (str, optional): The path to the database. Defaults to "messages.db".
+            db_path (str, optional): The path to the database. Defaults to Config.SQLITE_PATH.
         """
-        try:
-            self.conn = sqlite3.connect(db_path)
-        except Exception as e:
-            print(e)
-        else:
-            self.cursor = self.conn.cursor()
-            self._create_users_table()
-            self._create_messages_table()
-    
-    def _create_users_table(self):
-        query = f"""CREATE TABLE IF NOT EXISTS Users
-                (username TEXT, password TEXT, user_type INTEGER, user_id INTEGER PRIMARY KEY)"""
-        self.cursor.execute(query)
-        self.conn.commit()
+        self.db_path = db_path or Config.SQLITE_PATH
+
+    @property
+    def conn(self):
+        # Queries can run on any thread of the database executor, so the connection is looked up on
+        # every use instead of being kept on the handle
+        return get_sqlite_connection(self.db_path)
     
-    def _create_messages_table(self):
-        """Create the table containing all messages in the database. If the table already exists,
-        then do not create the table.
+    @blocking
+    def create_indexes(self):
+        """Creates the tables and indexes used by the queries in this class. This is run when the first
+        connection to a database is opened and is safe to run again.
         """
-        query = f"""CREATE TABLE IF NOT EXISTS Messages 
-                (content TEXT, author_id INTEGER, author_username TEXT, timestamp Date, room_code TEXT, msg_id INTEGER PRIMARY KEY)"""
-        self.cursor.execute(query)
-        self.conn.commit()
+        _prepare_sqlite_database(self.conn)
     
     def perform_query(self, query, args=[]):
         """Performs the specified query. When using this function, make sure that the input query
@@ -254,21 +731,23 @@ class SQLiteDataBase:
         Returns:
             sqlite3.Cursor: The cursor object containing the result of the query
         """
-        res = self.cursor.execute(query, args)
-        self.conn.commit()
-        return res
+        with self.conn:
+            return self.conn.execute(query, args)
     
-    def close(self):
-        """Closes the database connection. This should be run once the database instance is
-        no longer needed.
-        """
-        self.conn.close()
-    
-    def add_user(self, user_object: User):
-        query = """INSERT INTO Users(username, password, user_type, user_id) VALUES (?,?,?,?)"""
-        self.cursor.execute(query, (user_object.username, user_object.password, user_object.user_type, user_object.user_id))
-        self.conn.commit()
+    @blocking
+    def _insert_user(self, user_object: User):
+        # The unique index on the username rejects the user if the username is taken
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """INSERT INTO Users(username, password, user_type, user_id) VALUES (?,?,?,?)""",
+                    (user_object.username, user_object.password, user_object.user_type, user_object.user_id)
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
     
+    @blocking
     def get_all_users(self):
         """Gets all users from the database and converts them into User objects.
 
@@ -276,70 +755,64 @@ class SQLiteDataBase:
             list[User]: A list of all users registered in the site
         """
         # Make the query to get all users from the database
-        query = """SELECT * FROM Users"""
-        all_users = self.cursor.execute(query)
+        query = """SELECT username, password, user_type, user_id FROM Users"""
         
         # Convert the user tuples into User objects
         user_objects: list[User] = []
-        for user_tuple in all_users:
-            user_objects.append(
-                User(
-                    user_tuple[0],
-                    user_tuple[1],
-                    user_tuple[2],
-                    user_tuple[3]
-                )
-            )
+        for user_tuple in self.conn.execute(query):
+            user_objects.append(User(*user_tuple))
         
         return user_objects
 
-    def get_user_by_id(self, user_id):
+    @blocking
+    def _find_user_by_id(self, user_id: int):
         # Make the query to get the user from the database
-        query = """SELECT * FROM Users WHERE user_id = ?"""
-        user_tuples = self.cursor.execute(query, (str(user_id),)).fetchall()
+        query = """SELECT username, password, user_type, user_id FROM Users WHERE user_id = ?"""
+        user_tuple = self.conn.execute(query, (user_id,)).fetchone()
         
         # Check if the user was found
-        if len(user_tuples) == 0:
+        if user_tuple is None:
             return False
-        else:
-            user_tuple = user_tuples[0]
 
         # Construct the user object using the user tuple data
-        u = User(
-            user_tuple[0],
-            user_tuple[1],
-            user_tuple[2],
-            user_tuple[3]
-        )
-
-        return u
+        return User(*user_tuple)
     
+    @blocking
     def get_user_by_credentials(self, username: str, password: str):
-        # Make the query to get the user from the database
-        query = """SELECT * FROM Users WHERE username = ? AND password = ?"""
-        user_tuples = self.cursor.execute(query, (username, password)).fetchall()
+        # Make the query to get the user from the database using the unique index on the username
+        query = """SELECT username, password, user_type, user_id FROM Users WHERE username = ? AND password = ?"""
+        user_tuple = self.conn.execute(query, (username, password)).fetchone()
         
         # Check if the user was found
-        if len(user_tuples) == 0:
+        if user_tuple is None:
             return False
-        else:
-            user_tuple = user_tuples[0]
 
         # Construct the user object using the user tuple data
-        u = User(
-            user_tuple[0],
-            user_tuple[1],
-            user_tuple[2],
-            user_tuple[3]
-        )
-
-        return u
+        return User(*user_tuple)
     
-    def add_message(self, msg_object: Message):
-        query = """INSERT INTO Messages(content, author_id, author_username, timestamp, room_code, msg_id)
-                VALUES (?,?,?,?,?,?)"""
-        self.cursor.execute(query, (msg_object.content, msg_object.author_id, msg_object.author_username, msg_object.timestamp, msg_object.room_code, msg_object.msg_id))
-        self.conn.commit()
+    @blocking
+    def insert_message_dicts(self, msg_dicts: list):
+        """Inserts a batch of messages that are already formatted as database documents in a single
+        transaction. Messages that were already inserted are skipped, so a batch can be retried.
+
+        Args:
+            msg_dicts (list[dict]): The messages to insert
+        """
+        query = """INSERT OR IGNORE INTO Messages(content, author_id, author_username, timestamp, room_code, msg_id, replying_to, edited_at)
+                VALUES (?,?,?,?,?,?,?,?)"""
+        with self.conn:
+            self.conn.executemany(query, [
+                (
+                    str(m["content"]),
+                    m["author_id"],
+                    m["author_username"],
+                    to_epoch(m["timestamp"]),
+                    m["room_code"],
+                    m["_id"],
+                    m["replying_to"],
+                    m.get("edited_at")
+                ) for m in msg_dicts
+            ])
     
     def get_all_messages(self):
         """Gets all messages from the message database.
@@ -347,78 +820,200 @@ class SQLiteDataBase:
         Returns:
             list[Message]: A list of Message objects containing the message data from the database.
         """
-        # Make the query to fetch all messages from the Messages table
-        query = """SELECT * FROM Messages"""
-        self.cursor.execute(query)
-        message_tuples = self.cursor.fetchall()
-        
-        # Construct the Message objects from the tuple data
-        messages = []
-        for msg in message_tuples:
-            m = Message.construct_message(msg[0], msg[1], msg[2], msg[3], msg[4], msg[5])
-            messages.append(m)
-        
-        # Sort the messages from old -> new
-        messages.sort(key=lambda m: m.timestamp)
-
-        return messages
+        self.flush_writes()
+        return [self._construct_message(msg) for msg in self._find_all_message_docs()]
     
-    def get_room_messages(self, room_code="GLOBAL"):
-        """Gets all messages sent in the specified chat room from the database and returns them.
-
-        Args:
-            room_code (str, optional): The code of the chat room. Defaults to "GLOBAL".
-        
-        Returns:
-            list[Message]: A list of Message objects that were sent in the chat room with the specified
-                room code.
-        """
-        # Make the query to fetch all messages from the Messages table
-        query = """SELECT * FROM Messages"""
-        self.cursor.execute(query)
-        message_tuples = self.cursor.fetchall()
-
-        # Remove the messages that are not from the correct room
-        for msg in copy.copy(message_tuples):
-            if msg[4] != room_code:
-                message_tuples.remove(msg)
-        
-        # Construct the Message objects from the remaining tuple data
-        messages = []
-        for msg in message_tuples:
-            m = Message.construct_message(msg[0], msg[1], msg[2], msg[3], msg[4], msg[5], msg[6])
-            messages.append(m)
-        
-        # Sort the messages from old -> new
-        messages.sort(key=lambda m: m.timestamp)
+    @blocking
+    def _find_all_message_docs(self):
+        query = f"""SELECT {SQLITE_MESSAGE_COLUMNS} FROM Messages ORDER BY msg_id"""
+        return [_row_to_doc(row) for row in self.conn.execute(query)]
+
+    @blocking
+    def _find_room_message_docs(self, room_code: str, limit: int, before: int):
+        # Fetch the messages from the specified room by walking the (room_code, msg_id) index. Pages are
+        # read from new -> old so that the limit keeps the newest messages, and are then sorted from old -> new
+        if limit is None:
+            query = f"""SELECT {SQLITE_MESSAGE_COLUMNS} FROM Messages WHERE room_code = ? ORDER BY msg_id"""
+            rows = self.conn.execute(query, (room_code,)).fetchall()
+        else:
+            query = f"""SELECT {SQLITE_MESSAGE_COLUMNS} FROM Messages WHERE room_code = ? AND msg_id < ?
+                    ORDER BY msg_id DESC LIMIT ?"""
+            rows = self.conn.execute(query, (room_code, int(before) if before is not None else SQLITE_MAX_ID, limit)).fetchall()
+            rows.reverse()
+
+        return [_row_to_doc(row) for row in rows]
+
+    @blocking
+    def _find_message(self, msg_id: int):
+        query = f"""SELECT {SQLITE_MESSAGE_COLUMNS} FROM Messages WHERE msg_id = ?"""
+        row = self.conn.execute(query, (msg_id,)).fetchone()
+        return _row_to_doc(row) if row is not None else None
+
+    @blocking
+    def _find_newest_message_ids(self, room_code: str, count: int):
+        query = """SELECT msg_id FROM Messages WHERE room_code = ? ORDER BY msg_id DESC LIMIT ?"""
+        return [row[0] for row in self.conn.execute(query, (room_code, count))]
+
+    @blocking
+    def _find_author_message_ids(self, room_code: str, author_username: str):
+        query = """SELECT msg_id FROM Messages WHERE room_code = ? AND author_username = ?"""
+        return [row[0] for row in self.conn.execute(query, (room_code, author_username))]
+
+    @blocking
+    def _delete_all_message_docs(self):
+        with self.conn:
+            self.conn.execute("""DELETE FROM Messages""")
+
+    @blocking
+    def _delete_message_docs(self, msg_ids: list):
+        with self.conn:
+            self.conn.executemany("""DELETE FROM Messages WHERE msg_id = ?""", [(msg_id,) for msg_id in msg_ids])
+
+    @blocking
+    def _update_message_content(self, msg_id: int, new_content: str, edited_at: int):
+        with self.conn:
+            self.conn.execute(
+                """UPDATE Messages SET content = ?, edited_at = ? WHERE msg_id = ?""", (str(new_content), edited_at, msg_id)
+            )
 
-        return messages
-    
-    def delete_all_messages(self):
-        """Removes all messages from the Messages table. This preserves all tables in the database and
-        only deletes the content from the Messages table.
-        """
-        query = """DELETE FROM Messages"""
-        self.cursor.execute(query)
-        self.conn.commit()
-    
-    def delete_message(self, msg_id: int):
-        """Deletes the specified message from the Messages table.
+    @blocking
+    def _find_edited_message_docs(self, room_code: str, since: int, up_to_id: int):
+        query = """SELECT msg_id, content FROM Messages WHERE room_code = ? AND edited_at > ? AND msg_id <= ?"""
+        return [{"_id": row[0], "content": row[1]} for row in self.conn.execute(query, (room_code, since, up_to_id))]
+
+    @blocking
+    def _insert_tombstones(self, room_code: str, msg_ids: list, deleted_at: int):
+        with self.conn:
+            self.conn.executemany(
+                """INSERT OR REPLACE INTO Tombstones(msg_id, room_code, deleted_at) VALUES (?,?,?)""",
+                [(msg_id, room_code, deleted_at) for msg_id in msg_ids]
+            )
+            # Tombstones are only needed by clients that reconnect soon after, so old ones are removed
+            self.conn.execute(
+                """DELETE FROM Tombstones WHERE deleted_at < ?""", (deleted_at - Config.RESYNC_MAX_AGE * 1000,)
+            )
 
-        Args:
-            msg_id (int): The unique id of the message to be deleted
-        """
-        query = """DELETE FROM Messages WHERE msg_id = ?"""
-        self.cursor.execute(query, (msg_id,))
-        self.conn.commit()
-    
-    def edit_message(self, msg_id: int, new_content: str):
-        """Edits the specified message from the Messages table.
-        
-        Args:
-            msg_id (int): The unique id of the message to be edited
-            new_content (str): The new content of the message which will replace the existing content
-        """
-        query = """UPDATE Messages SET content = ? WHERE msg_id = ?"""
-        self.cursor.execute(query, (new_content, msg_id))
-        self.conn.commit()
\ No newline at end of file
+    @blocking
+    def _find_tombstone_ids(self, room_code: str, since: int):
+        query = """SELECT msg_id FROM Tombstones WHERE room_code IN (?, ?) AND deleted_at > ?"""
+        return [row[0] for row in self.conn.execute(query, (room_code, ALL_ROOMS, since))]
+
+
+# The tables and indexes used by SQLiteDataBase
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Users
+    (username TEXT, password TEXT, user_type INTEGER, user_id INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS Messages
+    (content TEXT, author_id INTEGER, author_username TEXT, timestamp REAL, room_code TEXT,
+    msg_id INTEGER PRIMARY KEY, replying_to INTEGER DEFAULT 0, edited_at INTEGER);
+CREATE TABLE IF NOT EXISTS Tombstones
+    (msg_id INTEGER PRIMARY KEY, room_code TEXT, deleted_at INTEGER);
+CREATE INDEX IF NOT EXISTS Tombstones_room_code_deleted_at ON Tombstones(room_code, deleted_at);
+DROP INDEX IF EXISTS Messages_room_code_timestamp;
+CREATE INDEX IF NOT EXISTS Messages_room_code_msg_id ON Messages(room_code, msg_id);
+CREATE INDEX IF NOT EXISTS Messages_room_code_author_username ON Messages(room_code, author_username);
+"""
+
+# The largest value that fits in an INTEGER column, used as the upper bound when reading the newest messages
+SQLITE_MAX_ID = 2 ** 63 - 1
+
+# The columns needed to construct a Message object, in the order read by _row_to_doc()
+SQLITE_MESSAGE_COLUMNS = "content, author_id, author_username, timestamp, room_code, msg_id, replying_to"
+
+# The connections opened by each thread, keyed by the database path
+_sqlite_local = threading.local()
+_sqlite_connections = [] # (thread, connection) for every open connection
+_sqlite_prepared = set() # The database paths that have had their schema created
+_sqlite_lock = threading.Lock()
+
+
+def get_sqlite_connection(db_path: str):
+    """Returns the calling thread's connection to a SQLite database, opening it on first use. The
+    database is put in WAL mode so that readers do not block the writer. Connections belonging to
+    threads that have finished are closed whenever a new connection is opened.
+
+    Args:
+        db_path (str): The path to the database
+
+    Returns:
+        sqlite3.Connection: The connection for this thread
+    """
+    connections = getattr(_sqlite_local, "connections", None)
+    if connections is None:
+        connections = _sqlite_local.connections = {}
+    conn = connections.get(db_path)
+    if conn is not None:
+        return conn
+
+    # The connection is only used by this thread, but may be closed by another thread once this one ends
+    conn = sqlite3.connect(db_path, timeout=Config.SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _sqlite_lock:
+        if db_path not in _sqlite_prepared:
+            _prepare_sqlite_database(conn)
+            _sqlite_prepared.add(db_path)
+        for thread, old_conn in list(_sqlite_connections):
+            if not thread.is_alive():
+                old_conn.close()
+                _sqlite_connections.remove((thread, old_conn))
+        _sqlite_connections.append((threading.current_thread(), conn))
+    connections[db_path] = conn
+    return conn
+
+def close_sqlite_connections():
+    """Closes every open SQLite connection. This is run automatically when the process exits."""
+    with _sqlite_lock:
+        for thread, conn in _sqlite_connections:
+            conn.close()
+        _sqlite_connections.clear()
+
+atexit.register(close_sqlite_connections)
+
+
+def _prepare_sqlite_database(conn: sqlite3.Connection):
+    # Create the tables and indexes, and upgrade databases made before the replying_to column was added,
+    # before usernames were unique and before timestamps were stored as UNIX timestamps
+    with conn:
+        conn.executescript(SQLITE_SCHEMA)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(Messages)")]
+        if "replying_to" not in columns:
+            conn.execute("ALTER TABLE Messages ADD COLUMN replying_to INTEGER DEFAULT 0")
+        if "edited_at" not in columns:
+            conn.execute("ALTER TABLE Messages ADD COLUMN edited_at INTEGER")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS Messages_room_code_edited_at ON Messages(room_code, edited_at) WHERE edited_at IS NOT NULL"
+        )
+        # Usernames must be unique. If the table already contains duplicate usernames, fall back to a
+        # regular index so that logging in is still an indexed lookup
+        try:
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS Users_username_unique ON Users(username)")
+            conn.execute("DROP INDEX IF EXISTS Users_username")
+        except sqlite3.IntegrityError:
+            logger.exception("Could not create a unique index on the usernames, falling back to a regular index")
+            conn.execute("CREATE INDEX IF NOT EXISTS Users_username ON Users(username)")
+        rows = conn.execute("SELECT msg_id, timestamp FROM Messages WHERE typeof(timestamp) = 'text'").fetchall()
+        conn.executemany("UPDATE Messages SET timestamp = ? WHERE msg_id = ?", [
+            (datetime.datetime.fromisoformat(timestamp).timestamp(), msg_id)
+            for msg_id, timestamp in rows
+        ])
+
+def _row_to_doc(row: tuple):
+    # Convert a row of SQLITE_MESSAGE_COLUMNS into the document format used by MongoDB. The timestamp is
+    # left as a UNIX timestamp, which is all that is needed to serialize the message
+    return {
+        "content": row[0],
+        "author_id": row[1],
+        "author_username": row[2],
+        "timestamp": row[3],
+        "room_code": row[4],
+        "_id": row[5],
+        "replying_to": row[6] or 0
+    }
+
+
+# The storage backend used by the application, which is selected by Config.DB_BACKEND
+if Config.DB_BACKEND == "sqlite":
+    DataBase = SQLiteDataBase
+else:
+    DataBase = MongoDataBase
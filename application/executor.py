@@ -0,0 +1,113 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from config import Config
+from .metrics import timed_db_call
+
+
+# The function that runs blocking calls for the whole process. This is created lazily for each process,
+# since the pools it uses cannot be shared with a forked child
+_run = None
+_run_pid = None
+_run_lock = threading.Lock()
+
+# Marks the workers of the executor so that blocking calls made by a call that is already running on
+# a worker run inline instead of waiting for another worker, which could deadlock a full pool
+_worker = threading.local()
+
+
+def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call, such as a database query, on the bounded executor selected by
+    Config.ASYNC_MODE and waits for its result. Only the caller waits, so other sockets keep being
+    served while the call runs. Exceptions raised by the call are raised again in the caller.
+
+    Args:
+        func (function): The function to call
+        *args: The positional arguments passed to the function
+        **kwargs: The keyword arguments passed to the function
+
+    Returns:
+        The value returned by the function
+    """
+    if Config.DB_EXECUTOR_SIZE <= 0 or getattr(_worker, "active", False):
+        return func(*args, **kwargs)
+    return get_executor()(_run_as_worker, func, args, kwargs)
+
+def blocking(func):
+    """Decorates a function so that every call to it is made through run_blocking(). The calls are timed
+    for the metrics under the name of the function.
+
+    Args:
+        func (function): The blocking function
+
+    Returns:
+        function: The wrapped function
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return run_blocking(func, *args, **kwargs)
+    return timed_db_call(wrapper)
+
+def get_executor():
+    """Returns the function used by run_blocking() to hand calls to the executor, creating the
+    executor on first use.
+
+    - threading: a ThreadPoolExecutor with Config.DB_EXECUTOR_SIZE threads
+    - eventlet/gevent with the SQLite backend: the native thread pool of the async library, since
+      sqlite3 blocks inside C code where the event loop cannot switch to other sockets
+    - eventlet/gevent with the MongoDB backend: a pool of green threads, since monkey patching makes
+      the sockets used by pymongo cooperative and the pool only has to bound the concurrent queries
+
+    Returns:
+        function: Takes a function followed by its arguments, and returns its result
+    """
+    global _run, _run_pid
+    if _run is not None and _run_pid == os.getpid():
+        return _run
+    with _run_lock:
+        if _run is None or _run_pid != os.getpid():
+            _run = _create_executor(Config.ASYNC_MODE, Config.DB_EXECUTOR_SIZE)
+            _run_pid = os.getpid()
+    return _run
+
+
+def _create_executor(async_mode: str, size: int):
+    if async_mode == "eventlet":
+        import eventlet
+        from eventlet import tpool
+        if Config.DB_BACKEND == "sqlite":
+            tpool.set_num_threads(size)
+            return tpool.execute
+        pool = eventlet.GreenPool(size)
+        return lambda func, *args: pool.spawn(func, *args).wait()
+
+    if async_mode == "gevent":
+        import gevent
+        import gevent.pool
+        if Config.DB_BACKEND == "sqlite":
+            threadpool = gevent.get_hub().threadpool
+            threadpool.maxsize = size
+            return lambda func, *args: threadpool.apply(func, args)
+        pool = gevent.pool.Pool(size)
+        return lambda func, *args: pool.apply(func, args)
+
+    executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="DataBase")
+    def run(func, *args):
+        try:
+            future = executor.submit(func, *args)
+        except RuntimeError:
+            # The executor stops accepting calls once the interpreter starts shutting down, so the
+            # messages written by the atexit functions are written by the calling thread instead
+            return func(*args)
+        return future.result()
+    return run
+
+def _run_as_worker(func, args, kwargs):
+    previous = getattr(_worker, "active", False)
+    _worker.active = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _worker.active = previous
@@ -1,8 +1,15 @@
 import datetime
+import functools
 import pytz
-import time
-import random
-from dateutil import tz
+
+from .snowflake import generate_id
+
+
+# The timezone that timestamps are displayed in and the format of the pretty timestamps. The timezone
+# object is created once since looking it up is slow
+EASTERN = pytz.timezone("US/Eastern")
+PRETTY_TIMESTAMP_FORMAT = "%I:%M %p on %A, %B %d %Y"
+_EPOCH = datetime.datetime(1970, 1, 1)
 
 
 class Message:
@@ -21,9 +28,9 @@ class Message:
         self.content = content
         self.author_id = author_id
         self.author_username = author_username
-        self.timestamp = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(pytz.timezone("US/Eastern")) # Conver the UTC timestamp into an EST timestamp using pytz
-        self.pretty_timestamp = self.timestamp.strftime("%I:%M %p on %A, %B %d %Y")
-        self.msg_id = int(str(round(time.time())) + str(random.randint(1000, 9999))) # Construct a random message id using the current time and a random number
+        self.timestamp = datetime.datetime.now(EASTERN) # Get the current time as an EST timestamp
+        self.pretty_timestamp = pretty_timestamp(self.timestamp.timestamp())
+        self.msg_id = generate_id() # Construct a unique message id that is ordered by the time the message was sent
         self.room_code = room_code
         self.replying_to = replying_to
 
@@ -35,7 +42,8 @@ class Message:
             "timestamp": self.pretty_timestamp,
             "msg_id": self.msg_id,
             "room_code": self.room_code,
-            "replying_to": self.replying_to
+            "replying_to": self.replying_to,
+            "sent_at": int(to_epoch(self.timestamp) * 1000)
         }
 
     @classmethod
@@ -59,11 +67,73 @@ class Message:
             timestamp = datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f%z")
         # Convert timestamp from UTC datetime to EST
         elif type(timestamp) == datetime.datetime:
-            timestamp = timestamp.replace(tzinfo=tz.tzutc())
-            timestamp = timestamp.astimezone(tz.gettz("US/Eastern"))
-        m = Message(content, author_id, author_username, room_code)
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+            timestamp = timestamp.astimezone(EASTERN)
+        # Skip __init__ since the timestamp and id it generates would be replaced anyway
+        m = cls.__new__(cls)
+        m.content = content
+        m.author_id = author_id
+        m.author_username = author_username
         m.timestamp = timestamp
-        m.pretty_timestamp = m.timestamp.strftime("%I:%M %p on %A, %B %d %Y")
+        m.pretty_timestamp = pretty_timestamp(timestamp.timestamp())
         m.msg_id = int(msg_id)
+        m.room_code = room_code
         m.replying_to = replying_to
-        return m
\ No newline at end of file
+        return m
+
+
+def to_epoch(timestamp):
+    """Converts a message timestamp into a UNIX timestamp. Naive datetimes are treated as UTC, which
+    is how they are returned by MongoDB.
+
+    Args:
+        timestamp (datetime | float): The timestamp to convert
+
+    Returns:
+        float: The number of seconds since the UNIX epoch
+    """
+    if type(timestamp) == datetime.datetime and timestamp.tzinfo is None:
+        return (timestamp - _EPOCH).total_seconds()
+    elif isinstance(timestamp, datetime.datetime):
+        return timestamp.timestamp()
+    return timestamp
+
+def pretty_timestamp(epoch: float):
+    """Formats a UNIX timestamp as a readable EST timestamp, such as "03:14 PM on Monday, January 01 2024".
+
+    Args:
+        epoch (float): The number of seconds since the UNIX epoch
+
+    Returns:
+        str: The pretty timestamp
+    """
+    return _format_minute(int(epoch // 60))
+
+@functools.lru_cache(maxsize=4096)
+def _format_minute(minute: int):
+    # Pretty timestamps only show the minute, so each minute is only formatted once. Messages in a room
+    # are mostly loaded in order, so most lookups hit the cache
+    return datetime.datetime.fromtimestamp(minute * 60, EASTERN).strftime(PRETTY_TIMESTAMP_FORMAT)
+
+def message_doc_to_dict(msg: dict):
+    """Converts a message document from the database straight into the dict sent to clients. This gives
+    the same result as constructing a Message object and calling to_dict() on it without creating the
+    object.
+
+    Args:
+        msg (dict): The message document
+
+    Returns:
+        dict: The message data sent to clients
+    """
+    epoch = to_epoch(msg["timestamp"])
+    return {
+        "content": msg["content"],
+        "author_id": msg["author_id"],
+        "author_username": msg["author_username"],
+        "timestamp": _format_minute(int(epoch // 60)),
+        "msg_id": int(msg["_id"]),
+        "room_code": msg["room_code"],
+        "replying_to": msg.get("replying_to", 0),
+        "sent_at": int(epoch * 1000)
+    }
@@ -0,0 +1,389 @@
+import bisect
+import functools
+import hmac
+import logging
+import random
+import threading
+import time
+
+from flask import Blueprint
+from flask import g
+from flask import request
+
+from config import Config
+
+
+logger = logging.getLogger(__name__)
+
+# The latency buckets of the histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# The buckets of the number of sockets an event is sent to
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple=()):
+        """Initializes a counter, which only goes up, with a value for every combination of labels.
+
+        Args:
+            name (str): The name of the metric
+            documentation (str): The help text of the metric
+            labelnames (tuple, optional): The names of the labels. Defaults to no labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {} # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float=1):
+        """Adds to the counter of the given label values.
+
+        Args:
+            *labelvalues: The values of the labels, in the order of the label names
+            amount (float, optional): The amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, labels)), value) for labels, value in self._values.items()]
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple=(), buckets: tuple=LATENCY_BUCKETS):
+        """Initializes a histogram, which counts the observed values that fall in each bucket, for every
+        combination of labels.
+
+        Args:
+            name (str): The name of the metric
+            documentation (str): The help text of the metric
+            labelnames (tuple, optional): The names of the labels. Defaults to no labels.
+            buckets (tuple, optional): The upper bounds of the buckets, in increasing order. Defaults to
+                LATENCY_BUCKETS.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {} # label values -> [count of each bucket and of +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        """Records a value.
+
+        Args:
+            value (float): The observed value, such as a duration in seconds
+            *labelvalues: The values of the labels, in the order of the label names
+        """
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labelvalues, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, labelvalues))
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", dict(labels, le=str(bound)), cumulative))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        """Initializes a registry of the metrics exported by this process, along with the collectors
+        that read the current values of other components when the metrics are scraped.
+        """
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds a Counter or Histogram to the registry.
+
+        Args:
+            metric: The metric
+
+        Returns:
+            The metric
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """Adds a function that is called on every scrape and returns a list of (name, type, help, samples)
+        tuples, where samples is a list of (labels dict, value) tuples.
+
+        Args:
+            collector (function): The collector
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {'counter' if isinstance(metric, Counter) else 'histogram'}")
+            lines.extend(_format_sample(name, labels, value) for name, labels, value in metric.samples())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception:
+                logger.exception(f"Could not collect metrics from {collector.__name__}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(_format_sample(name, labels, value) for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def _format_sample(name: str, labels: dict, value: float):
+    if labels:
+        label_text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+        return f"{name}{{{label_text}}} {value}"
+    return f"{name} {value}"
+
+def _escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# The metrics of this process
+registry = Registry()
+socket_event_seconds = registry.register(Histogram(
+    "chatapp_socket_event_seconds", "Time taken to handle each Socket.IO event", ("event",)
+))
+socket_event_errors = registry.register(Counter(
+    "chatapp_socket_event_errors_total", "Socket.IO event handlers that raised an exception", ("event",)
+))
+http_request_seconds = registry.register(Histogram(
+    "chatapp_http_request_seconds", "Time taken to handle each HTTP request", ("endpoint",)
+))
+http_request_errors = registry.register(Counter(
+    "chatapp_http_request_errors_total", "HTTP requests that raised an exception or returned a 5xx status", ("endpoint",)
+))
+db_call_seconds = registry.register(Histogram(
+    "chatapp_db_call_seconds", "Time taken by each database call, including the wait for the executor", ("method",)
+))
+fanout_recipients = registry.register(Histogram(
+    "chatapp_fanout_recipients", "Sockets on this worker that each room event was sent to", ("event",), FANOUT_BUCKETS
+))
+
+
+def instrument_socketio(socketio):
+    """Times every handler registered with `socketio.on` from now on, and counts the handlers that
+    raise an exception. This has to be called before the handlers are registered.
+
+    Args:
+        socketio (flask_socketio.SocketIO): The Socket.IO server
+    """
+    register = socketio.on
+
+    def on(message, namespace=None):
+        def decorator(handler):
+            @functools.wraps(handler)
+            def timed_handler(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                except Exception:
+                    socket_event_errors.inc(message)
+                    raise
+                finally:
+                    socket_event_seconds.observe(time.perf_counter() - start, message)
+            return register(message, namespace)(timed_handler)
+        return decorator
+    socketio.on = on
+
+def instrument_app(app):
+    """Times every HTTP request by the endpoint that handled it, and counts the requests that fail.
+
+    Args:
+        app (Flask): The app
+    """
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_failed = response.status_code >= 500
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        endpoint = request.endpoint or "unmatched"
+        http_request_seconds.observe(time.perf_counter() - start, endpoint)
+        if exc is not None or g.pop("metrics_failed", False):
+            http_request_errors.inc(endpoint)
+
+def timed_db_call(func):
+    """Times each call of a database method.
+
+    Args:
+        func (function): The database method
+    """
+    name = func.__qualname__
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_call_seconds.observe(time.perf_counter() - start, name)
+    return wrapper
+
+def record_fanout(socketio, event: str, room: str):
+    """Records the number of sockets on this worker that an event sent to a room reaches.
+
+    Args:
+        socketio (flask_socketio.SocketIO): The Socket.IO server
+        event (str): The name of the event
+        room (str): The room the event is sent to
+    """
+    room_sockets = socketio.server.manager.rooms.get("/", {}).get(room)
+    fanout_recipients.observe(len(room_sockets) if room_sockets is not None else 0, event)
+
+def stats_collector(prefix: str, documentation: str, stats):
+    """Makes a collector that exports the dict returned by a component's stats() method. Numbers are
+    exported as `<prefix>_<key>`, and dicts of numbers as `<prefix>_<key>` with their keys in the
+    "event" label.
+
+    Args:
+        prefix (str): The prefix of the metric names
+        documentation (str): The help text of the metrics
+        stats (function): Returns the statistics, such as the stats() method of the component
+
+    Returns:
+        function: The collector
+    """
+    def collect():
+        families = []
+        for key, value in stats().items():
+            if isinstance(value, dict):
+                samples = [({"event": k}, v) for k, v in value.items()]
+            else:
+                samples = [({}, value)]
+            families.append((f"{prefix}_{key}", "untyped", f"{documentation}: {key}", samples))
+        return families
+    collect.__name__ = prefix
+    return collect
+
+def room_collector(socketio, public_rooms):
+    """Makes a collector that exports the number of sockets on this worker in each room. Room codes are
+    how private rooms are joined, so only the public rooms are labelled by name and the sizes of the
+    private rooms are summed up.
+
+    Args:
+        socketio (flask_socketio.SocketIO): The Socket.IO server
+        public_rooms (function): Returns the codes of the public rooms
+
+    Returns:
+        function: The collector
+    """
+    def collect():
+        rooms = socketio.server.manager.rooms.get("/", {})
+        public = set(public_rooms()) | {"GLOBAL"}
+        samples = []
+        private_rooms = 0
+        private_sockets = 0
+        connected = 0
+        for room, members in list(rooms.items()):
+            if room is None:
+                connected = len(members)
+            # Every socket is also in a room named after its own sid
+            elif len(members) == 1 and room in members:
+                continue
+            elif room in public:
+                samples.append(({"room": room}, len(members)))
+            else:
+                private_rooms += 1
+                private_sockets += len(members)
+        return [
+            ("chatapp_connected_sockets", "gauge", "Sockets connected to this worker", [({}, connected)]),
+            ("chatapp_room_sockets", "gauge", "Sockets on this worker in each public room", samples),
+            ("chatapp_private_rooms", "gauge", "Private rooms with sockets on this worker", [({}, private_rooms)]),
+            ("chatapp_private_room_sockets", "gauge", "Sockets on this worker in private rooms", [({}, private_sockets)])
+        ]
+    return collect
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through a random sample of the log records."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return random.random() < self.rate
+
+def packet_logger(name: str):
+    """Gets the logger for the Socket.IO or Engine.IO server, which logs every packet, according to
+    Config.PACKET_LOGGING:
+
+    - "all": every packet is logged
+    - "sampled": a random Config.PACKET_LOG_SAMPLE_RATE of the packets are logged
+    - "off": only errors are logged
+
+    Args:
+        name (str): The name of the logger, such as "socketio.server"
+
+    Returns:
+        The logger to pass to the server, or True/False to use the server's default logger
+    """
+    if Config.PACKET_LOGGING == "all":
+        return True
+    if Config.PACKET_LOGGING != "sampled":
+        return False
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    logger.addFilter(SamplingFilter(Config.PACKET_LOG_SAMPLE_RATE))
+    return logger
+
+
+# The /metrics endpoint
+metrics_view = Blueprint("metrics", __name__)
+
+
+@metrics_view.route("/metrics")
+def metrics():
+    """Returns the metrics of this worker in the Prometheus text format. If Config.METRICS_TOKEN is set,
+    the scraper has to send it as a bearer token.
+
+    Returns:
+        str: The metrics
+    """
+    if Config.METRICS_TOKEN:
+        expected = f"Bearer {Config.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            return "Unauthorized", 401
+    return registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
@@ -0,0 +1,156 @@
+import collections
+import os
+import sys
+import time
+import tracemalloc
+
+from config import Config
+from . import metrics
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval: float=0.005, handlers_only: bool=True):
+        """Initializes a profiler that samples the stack of every thread of the process at a fixed
+        interval. Nothing is hooked into the interpreter, so the app runs at full speed while the
+        profiler is not running, and the cost of a running profiler does not depend on how many
+        functions are called.
+
+        Args:
+            interval (float, optional): The number of seconds between samples. Defaults to 0.005.
+            handlers_only (bool, optional): Whether to only keep the samples taken while a Socket.IO event
+                handler was running, leaving out idle and unrelated threads. Defaults to True.
+        """
+        self.interval = interval
+        self.handlers_only = handlers_only
+        self.samples = 0
+        self.done = False
+        self._stacks = collections.Counter() # folded stack -> number of samples
+        self._labels = {} # code object -> label of its frames
+
+    def start(self, seconds: float):
+        """Starts sampling for the given number of seconds. The sampler runs on a real OS thread even
+        when eventlet or gevent are used, since a green thread would only run while the app is idle.
+        `done` is set once it has finished.
+
+        Args:
+            seconds (float): The number of seconds to sample for
+        """
+        _original("_thread", "start_new_thread")(self._run, (seconds,))
+
+    def folded(self):
+        """Returns the samples as folded stacks, with one line of "outer;inner;... count" for each
+        distinct stack. These can be opened in speedscope or turned into a flame graph with flamegraph.pl.
+
+        Returns:
+            str: The folded stacks, with the most sampled first
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def _run(self, seconds: float):
+        own_frame = sys._getframe()
+        sleep = _original("time", "sleep")
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for frame in sys._current_frames().values():
+                    if frame is not own_frame:
+                        self._sample(frame)
+                sleep(self.interval)
+        finally:
+            self.done = True
+
+    def _sample(self, frame):
+        labels = []
+        in_handler = False
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name == "timed_handler" and code.co_filename == metrics.__file__:
+                in_handler = True
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        if in_handler or not self.handlers_only:
+            self.samples += 1
+            self._stacks[";".join(reversed(labels))] += 1
+
+
+class MemoryTracer:
+
+    def __init__(self):
+        """Initializes a tracer of the memory allocated by the app, which compares snapshots taken by
+        tracemalloc against the one taken when tracing started. Tracing slows down every allocation, so
+        it is only turned on between start() and stop().
+        """
+        self.baseline = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.baseline is not None
+
+    def start(self, frames: int=10):
+        """Starts tracing allocations and takes the baseline snapshot.
+
+        Args:
+            frames (int, optional): The number of frames kept for each allocation. Defaults to 10.
+        """
+        tracemalloc.start(frames)
+        self.baseline = self._snapshot()
+        self.started = time.time()
+
+    def stop(self):
+        """Stops tracing allocations and throws away the snapshots."""
+        tracemalloc.stop()
+        self.baseline = None
+        self.started = None
+
+    def diff(self, limit: int=25, group_by: str="lineno"):
+        """Compares a new snapshot against the baseline.
+
+        Args:
+            limit (int, optional): The number of biggest differences to include. Defaults to 25.
+            group_by (str, optional): "lineno", "filename" or "traceback". Defaults to "lineno".
+
+        Returns:
+            str: A report of the traced memory and the lines whose allocations grew or shrank the most
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        stats = self._snapshot().compare_to(self.baseline, group_by)
+        lines = [
+            f"Tracing for {time.time() - self.started:.0f}s, traced memory {current / 1024 / 1024:.1f} MiB "
+            f"(peak {peak / 1024 / 1024:.1f} MiB)",
+            f"Top {limit} differences since tracing started, grouped by {group_by}:",
+            ""
+        ]
+        for stat in stats[:limit]:
+            lines.append(str(stat))
+            if group_by == "traceback":
+                lines.extend(f"    {line}" for line in stat.traceback.format())
+        return "\n".join(lines) + "\n"
+
+    def _snapshot(self):
+        # Leave out the memory used by tracemalloc itself and by imports
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ])
+
+
+def _original(module: str, name: str):
+    # eventlet and gevent replace the thread and time functions with green versions, which only run
+    # while the app is idle, so the profiler uses the original ones to run alongside the app
+    if Config.ASYNC_MODE == "eventlet":
+        import eventlet.patcher
+        return getattr(eventlet.patcher.original(module), name)
+    if Config.ASYNC_MODE == "gevent":
+        from gevent import monkey
+        return monkey.get_original(module, name)
+    return getattr(__import__(module), name)
+
+
+# The memory tracer of this process
+memory_tracer = MemoryTracer()
@@ -0,0 +1,154 @@
+import socket
+import threading
+import time
+
+import socketio
+
+from .broker import DEFAULT_SOCKET_PATH
+from .database import recent_messages
+from .state import get_state_store
+
+
+def create_client_manager(url: str):
+    """Creates the Socket.IO client manager for a message queue URL. Events emitted by any worker that
+    uses the same message queue are delivered to the clients of every worker.
+
+    - "" (the default): events are only delivered to the clients of this process
+    - "unix:///path/to/broker.sock": the workers on this machine share the broker started with
+      `python -m application.broker`. "unix://" on its own uses the default socket path
+    - "redis://host:port/0": the workers share a Redis server, which needs the `redis` package
+
+    Args:
+        url (str): The message queue URL from Config.MESSAGE_QUEUE
+
+    Returns:
+        socketio.Manager: The client manager, or None to use the in-process manager
+    """
+    if not url:
+        return None
+    if url.startswith("unix://"):
+        return UnixSocketManager(url[len("unix://"):] or DEFAULT_SOCKET_PATH)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisManager(url)
+    raise ValueError(f"Unsupported message queue URL: {url}")
+
+
+class CacheSyncMixin:
+    """Keeps the in-memory state of this worker up to date with the events emitted by other workers.
+    Each worker updates its own caches when it handles an event, so only the events received from the
+    message queue have to be applied here.
+    """
+
+    def _handle_emit(self, message):
+        if message.get("host_id") != self.host_id:
+            try:
+                self._apply_remote_event(message["event"], message["data"])
+            except Exception:
+                self._get_logger().exception(f"Could not apply the {message.get('event')} event from another worker")
+        super()._handle_emit(message)
+
+    def _apply_remote_event(self, event: str, data: list):
+        # The data of an emit is sent as a list of its arguments
+        data = data[0] if len(data) == 1 else None
+        # A batch of coalesced events is applied one event at a time
+        if event == "events" and isinstance(data, list):
+            for e in data:
+                self._apply_remote_event(e["event"], [e["data"]])
+            return
+        if not isinstance(data, dict):
+            return
+        if event == "new message":
+            recent_messages.add(data["room_code"], data)
+        elif event == "message edited":
+            recent_messages.edit(int(data["msg_id"]), str(data["new_content"]))
+        elif event == "message deleted":
+            recent_messages.remove([int(data["msg_id"])])
+        elif event == "messages deleted":
+            recent_messages.remove([int(msg_id) for msg_id in data["msg_ids"]])
+        elif event == "room status changed":
+            # A shared state store has already been updated by the worker that handled the change
+            state = get_state_store()
+            if not state.shared and data["action"] in ["Public", "Private"]:
+                state.set_room_public(data["room_code"], data["action"] == "Public")
+
+
+class UnixSocketManager(CacheSyncMixin, socketio.PubSubManager):
+
+    name = "unix"
+
+    def __init__(self, path: str, channel: str="socketio", write_only: bool=False, logger=None):
+        """Initializes a client manager that shares events with the other workers on this machine through
+        the broker in application/broker.py. Events are sent as JSON lines over a single connection to
+        the broker, which is reopened whenever it is lost. Events published while the broker is down are
+        only delivered to the clients of this worker.
+
+        Args:
+            path (str): The path of the broker's socket file
+            channel (str, optional): Unused, since every worker connected to a broker shares its events.
+                Defaults to "socketio".
+            write_only (bool, optional): Whether this manager only publishes events. Defaults to False.
+            logger (optional): The logger to use. Defaults to the server's logger.
+        """
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self._sock = None
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _publish(self, data):
+        line = (self.json.dumps(data) + "\n").encode("utf-8")
+        with self._send_lock:
+            # A write-only manager has no listener to open the connection for it
+            if self._sock is None and self.write_only:
+                try:
+                    self._sock = self._connect()
+                except OSError:
+                    pass
+            if self._sock is not None:
+                try:
+                    self._sock.sendall(line)
+                    return
+                except OSError as e:
+                    self._get_logger().error(f"Could not publish an event to the message broker: {e}")
+                    if self.write_only:
+                        self._sock.close()
+                        self._sock = None
+                    return
+        self._get_logger().error(f"Could not publish an event, since the message broker at {self.path} is not connected")
+
+    def _listen(self):
+        delay = 0.1
+        while True:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                # Wait for the broker to start, backing off up to a few seconds between attempts
+                self._get_logger().error(f"Cannot connect to the message broker at {self.path}: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+                continue
+            delay = 0.1
+            with self._send_lock:
+                self._sock = sock
+            self._get_logger().info(f"Connected to the message broker at {self.path}")
+            try:
+                for line in sock.makefile("rb"):
+                    yield line
+            except OSError as e:
+                self._get_logger().error(f"Lost the connection to the message broker: {e}")
+            with self._send_lock:
+                self._sock = None
+            sock.close()
+
+
+class RedisManager(CacheSyncMixin, socketio.RedisManager):
+    """A Redis client manager that keeps the in-memory state of this worker in sync."""
+    pass
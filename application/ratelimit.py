@@ -0,0 +1,143 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+from flask import session
+
+from config import Config
+from .state import get_state_store
+
+
+class TokenBucketLimiter:
+
+    def __init__(self, limits: dict, sweep_interval: float=60, max_entries: int=100000, store=None):
+        """Initializes a ratelimiter that gives every key a bucket of tokens for each limited event. Each
+        event takes one token, and tokens are refilled at a steady rate up to the size of the bucket, so
+        short bursts are allowed while the long term rate is capped. Buckets that have refilled completely
+        are removed every `sweep_interval` seconds, since a full bucket behaves the same as a missing one.
+
+        The buckets are kept in this process unless `store` returns a shared state store, in which case
+        they are kept in the store so that a user gets one budget no matter which workers their sockets
+        are connected to.
+
+        Args:
+            limits (dict): Maps each limited event name to a (rate, burst) tuple, where rate is the number
+                of tokens added per second and burst is the size of the bucket. Events that are not in
+                the dict are not limited.
+            sweep_interval (float, optional): The number of seconds between sweeps of the idle buckets.
+                Defaults to 60.
+            max_entries (int, optional): The maximum number of buckets. Once there are more buckets, the
+                least recently used ones are removed. Defaults to 100000.
+            store (function, optional): Returns the state store, such as get_state_store. Defaults to None,
+                which always keeps the buckets in this process.
+        """
+        self.limits = limits
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self.max_entries = max_entries
+        self.allowed = dict.fromkeys(limits, 0)
+        self.rejected = dict.fromkeys(limits, 0)
+        self._buckets = OrderedDict() # (event, key) -> [tokens, last refill time], ordered from least -> most recently used
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self, event: str, key):
+        """Takes a token from the bucket of a key for an event.
+
+        Args:
+            event (str): The name of the event
+            key: The key being limited, such as a user id
+
+        Returns:
+            bool: True if the event is allowed, or False if the key has run out of tokens
+        """
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        rate, burst = limit
+        store = self.store() if self.store is not None else None
+        if store is not None and store.shared:
+            allowed = store.take_token(f"{event}:{key}", rate, burst)
+            with self._lock:
+                if allowed:
+                    self.allowed[event] += 1
+                else:
+                    self.rejected[event] += 1
+            return allowed
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            bucket = self._buckets.get((event, key))
+            if bucket is None:
+                bucket = self._buckets[(event, key)] = [burst, now]
+                if len(self._buckets) > self.max_entries:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((event, key))
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                self.rejected[event] += 1
+                return False
+            bucket[0] -= 1
+            self.allowed[event] += 1
+            return True
+
+    def stats(self):
+        """Returns the number of allowed and rejected events of each type and the number of buckets.
+
+        Returns:
+            dict: The ratelimiter statistics
+        """
+        with self._lock:
+            return {
+                "allowed": dict(self.allowed),
+                "rejected": dict(self.rejected),
+                "buckets": len(self._buckets)
+            }
+
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        for (event, key), (tokens, last) in list(self._buckets.items()):
+            rate, burst = self.limits[event]
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[(event, key)]
+
+
+# The ratelimits of the socket events, shared by every worker when the state store is shared
+limiter = TokenBucketLimiter(
+    {
+        "send message": (Config.RATELIMIT_MESSAGE_RATE, Config.RATELIMIT_MESSAGE_BURST),
+        "on message edit": (Config.RATELIMIT_EDIT_RATE, Config.RATELIMIT_EDIT_BURST),
+        "on message delete": (Config.RATELIMIT_DELETE_RATE, Config.RATELIMIT_DELETE_BURST),
+        "room status update": (Config.RATELIMIT_ROOM_STATUS_RATE, Config.RATELIMIT_ROOM_STATUS_BURST)
+    },
+    sweep_interval=Config.RATELIMIT_SWEEP_INTERVAL,
+    max_entries=Config.RATELIMIT_MAX_ENTRIES,
+    store=get_state_store
+)
+
+
+def ratelimited(event: str):
+    """Drops a socket event if the user sending it has run out of tokens for the event. Users are
+    identified by the user id in their session, or by their socket id if they are not logged in.
+    Superusers are not ratelimited.
+
+    Args:
+        event (str): The name of the event, which selects the limit in `limiter`
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            user = session.get("user")
+            if user is not None and user.user_type == 1:
+                return func(*args, **kwargs)
+            key = user.user_id if user is not None else request.sid
+            if not limiter.allow(event, key):
+                return
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from config import Config
+
+
+# The layout of the ids. The ids fit in 53 bits so that they stay exact as JavaScript numbers
+EPOCH_MS = 1640995200000 # 2022-01-01 00:00:00 UTC
+WORKER_ID_BITS = 5
+SEQUENCE_BITS = 7
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class SnowflakeGenerator:
+
+    def __init__(self, worker_id: int=0):
+        """Initializes a generator of unique ids that are ordered by the time they were generated.
+        Each id is made of the number of milliseconds since EPOCH_MS, the id of the worker process
+        that generated it, and a sequence number that counts the ids generated in the same millisecond.
+        Ids generated by workers with different worker ids can never collide.
+
+        Args:
+            worker_id (int, optional): The id of this worker process, from 0 to MAX_WORKER_ID. Defaults to 0.
+        """
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"The worker id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def generate(self):
+        """Generates a new id. Ids generated by the same generator always increase, even if the system
+        clock goes backwards or more ids are generated in a millisecond than the sequence can count. In
+        those cases, the id is taken from the next millisecond after the last id.
+
+        Returns:
+            int: The new id
+        """
+        with self._lock:
+            now_ms = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+            if now_ms == self._last_ms:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    now_ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (WORKER_ID_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+# The generator used for all message and user ids in this process
+_generator = SnowflakeGenerator(Config.WORKER_ID)
+
+
+def generate_id():
+    """Generates a new unique, time ordered id using the worker id from Config.WORKER_ID.
+
+    Returns:
+        int: The new id
+    """
+    return _generator.generate()
@@ -0,0 +1,332 @@
+import datetime
+import os
+import threading
+import time
+
+import pymongo
+
+from config import Config
+from .database import get_client
+from .database import get_sqlite_connection
+from .executor import blocking
+
+
+# The rooms that are public when the state is first created
+DEFAULT_PUBLIC_ROOMS = ["Suggestions", "Feedback"]
+
+# The state store shared by the whole process, created lazily for each process
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Returns the process-wide store for the public rooms, claim codes and shared ratelimits, creating
+    it on first use. Config.STATE_BACKEND selects where the state is kept:
+
+    - "memory": in this process. Each worker has its own copy, so this only suits a single worker
+    - "database": in the database selected by Config.DB_BACKEND, shared by every worker using it
+
+    Returns:
+        The shared state store
+    """
+    global _store, _store_pid
+    if _store is not None and _store_pid == os.getpid():
+        return _store
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            if Config.STATE_BACKEND == "memory":
+                _store = MemoryStateStore()
+            elif Config.DB_BACKEND == "sqlite":
+                _store = SQLiteStateStore()
+            else:
+                _store = MongoStateStore()
+            _store_pid = os.getpid()
+    return _store
+
+
+class MemoryStateStore:
+    """Keeps the state in dicts belonging to this process."""
+
+    # Whether other processes see the changes made through this store
+    shared = False
+
+    def __init__(self):
+        self._public_rooms = dict.fromkeys(DEFAULT_PUBLIC_ROOMS) # Used as an ordered set
+        self._claim_codes = {} # claim_code -> (username, expiry time)
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+
+    def get_public_rooms(self):
+        """Gets the codes of every public room.
+
+        Returns:
+            list[str]: The room codes, in the order the rooms were made public
+        """
+        with self._lock:
+            return list(self._public_rooms)
+
+    def is_public_room(self, room_code: str):
+        """Checks whether a room is public.
+
+        Args:
+            room_code (str): The code of the room
+
+        Returns:
+            bool: True if the room is public
+        """
+        return room_code in self._public_rooms
+
+    def set_room_public(self, room_code: str, public: bool):
+        """Makes a room public or private.
+
+        Args:
+            room_code (str): The code of the room
+            public (bool): True to make the room public, or False to make it private
+        """
+        with self._lock:
+            if public:
+                self._public_rooms.setdefault(room_code)
+            else:
+                self._public_rooms.pop(room_code, None)
+
+    def add_claim_code(self, claim_code: str, username: str, ttl: float=None):
+        """Adds a claim code that lets someone create the account with the given username. Adding a
+        claim code that already exists replaces it.
+
+        Args:
+            claim_code (str): The claim code
+            username (str): The username of the account that can be claimed
+            ttl (float, optional): The number of seconds the code stays valid for. Defaults to
+                Config.CLAIM_CODE_TTL.
+        """
+        expires_at = time.time() + (ttl if ttl is not None else Config.CLAIM_CODE_TTL)
+        with self._lock:
+            self._claim_codes[claim_code] = (username, expires_at)
+            self._sweep()
+
+    def get_claim_code(self, claim_code: str):
+        """Gets the username a claim code was made for.
+
+        Args:
+            claim_code (str): The claim code
+
+        Returns:
+            str: The username, or None if the code does not exist or has expired
+        """
+        with self._lock:
+            entry = self._claim_codes.get(claim_code)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[0]
+
+    def remove_claim_code(self, claim_code: str):
+        """Removes a claim code once it has been used.
+
+        Args:
+            claim_code (str): The claim code
+        """
+        with self._lock:
+            self._claim_codes.pop(claim_code, None)
+
+    def _sweep(self):
+        # Remove expired claim codes every minute so that they do not pile up
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        self._claim_codes = {code: entry for code, entry in self._claim_codes.items() if entry[1] > now}
+
+
+class SQLiteStateStore:
+    """Keeps the state in the SQLite database, so that every worker using the database shares it. The
+    methods are the same as those of MemoryStateStore.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str=None):
+        """Creates the state tables in the SQLite database if they do not exist yet.
+
+        Args:
+            db_path (str, optional): The path to the database. Defaults to Config.SQLITE_PATH.
+        """
+        self.db_path = db_path or Config.SQLITE_PATH
+        self._last_sweep = time.time()
+        self._create_tables()
+
+    @property
+    def conn(self):
+        return get_sqlite_connection(self.db_path)
+
+    @blocking
+    def _create_tables(self):
+        with self.conn:
+            created = self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'PublicRooms'"
+            ).fetchone() is None
+            self.conn.executescript(SQLITE_STATE_SCHEMA)
+            # Only add the default public rooms to a new table so that rooms made private stay private
+            if created:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO PublicRooms(room_code, made_public) VALUES (?,?)",
+                    list(zip(DEFAULT_PUBLIC_ROOMS, range(len(DEFAULT_PUBLIC_ROOMS))))
+                )
+
+    @blocking
+    def get_public_rooms(self):
+        return [row[0] for row in self.conn.execute("SELECT room_code FROM PublicRooms ORDER BY made_public")]
+
+    @blocking
+    def is_public_room(self, room_code: str):
+        return self.conn.execute("SELECT 1 FROM PublicRooms WHERE room_code = ?", (room_code,)).fetchone() is not None
+
+    @blocking
+    def set_room_public(self, room_code: str, public: bool):
+        with self.conn:
+            if public:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO PublicRooms(room_code, made_public) VALUES (?,?)", (room_code, time.time())
+                )
+            else:
+                self.conn.execute("DELETE FROM PublicRooms WHERE room_code = ?", (room_code,))
+
+    @blocking
+    def add_claim_code(self, claim_code: str, username: str, ttl: float=None):
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else Config.CLAIM_CODE_TTL)
+        with self.conn:
+            self.conn.execute("DELETE FROM ClaimCodes WHERE expires_at <= ?", (now,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ClaimCodes(claim_code, username, expires_at) VALUES (?,?,?)",
+                (claim_code, username, expires_at)
+            )
+
+    @blocking
+    def get_claim_code(self, claim_code: str):
+        row = self.conn.execute(
+            "SELECT username FROM ClaimCodes WHERE claim_code = ? AND expires_at > ?", (claim_code, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    @blocking
+    def remove_claim_code(self, claim_code: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM ClaimCodes WHERE claim_code = ?", (claim_code,))
+
+    @blocking
+    def take_token(self, key: str, rate: float, burst: int):
+        # Refill the bucket and take a token in a single statement, so that two workers cannot both take
+        # the last token. The bucket is only updated if it has a token to take
+        now = time.time()
+        refilled = "MIN(:burst, tokens + MAX(:now - updated, 0) * :rate)"
+        with self.conn:
+            cursor = self.conn.execute(
+                f"""INSERT INTO TokenBuckets(key, tokens, updated, full_at) VALUES (:key, :burst - 1, :now, :now + 1 / :rate)
+                ON CONFLICT(key) DO UPDATE SET
+                    tokens = {refilled} - 1,
+                    updated = :now,
+                    full_at = :now + (:burst - {refilled} + 1) / :rate
+                WHERE {refilled} >= 1""",
+                {"key": key, "rate": rate, "burst": burst, "now": now}
+            )
+            # Remove the buckets that have refilled every minute, since a full bucket behaves the same as a missing one
+            if now - self._last_sweep >= 60:
+                self._last_sweep = now
+                self.conn.execute("DELETE FROM TokenBuckets WHERE full_at <= ?", (now,))
+        return cursor.rowcount > 0
+
+class MongoStateStore:
+    """Keeps the state in MongoDB, so that every worker using the database shares it. The methods are
+    the same as those of MemoryStateStore.
+    """
+
+    shared = True
+
+    def __init__(self):
+        """Creates the indexes for the state collections and adds the default public rooms to a new
+        database.
+        """
+        self.db = get_client()["ChatApp"]
+        self.public_rooms = self.db["PublicRooms"]
+        self.claim_codes = self.db["ClaimCodes"]
+        self.token_buckets = self.db["TokenBuckets"]
+        self._create_indexes()
+
+    @blocking
+    def _create_indexes(self):
+        # MongoDB removes expired claim codes and refilled token buckets by itself using TTL indexes
+        self.claim_codes.create_index("expires_at", expireAfterSeconds=0, name="expires_at")
+        self.token_buckets.create_index("full_at", expireAfterSeconds=0, name="full_at")
+        # Only add the default public rooms to a new database so that rooms made private stay private
+        if "PublicRooms" not in self.db.list_collection_names():
+            for i, room_code in enumerate(DEFAULT_PUBLIC_ROOMS):
+                self.public_rooms.update_one({"_id": room_code}, {"$setOnInsert": {"made_public": i}}, upsert=True)
+
+    @blocking
+    def get_public_rooms(self):
+        return [r["_id"] for r in self.public_rooms.find({}, {"_id": 1}).sort("made_public", pymongo.ASCENDING)]
+
+    @blocking
+    def is_public_room(self, room_code: str):
+        return self.public_rooms.find_one({"_id": room_code}, {"_id": 1}) is not None
+
+    @blocking
+    def set_room_public(self, room_code: str, public: bool):
+        if public:
+            self.public_rooms.update_one(
+                {"_id": room_code}, {"$setOnInsert": {"made_public": time.time()}}, upsert=True
+            )
+        else:
+            self.public_rooms.delete_one({"_id": room_code})
+
+    @blocking
+    def add_claim_code(self, claim_code: str, username: str, ttl: float=None):
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=ttl if ttl is not None else Config.CLAIM_CODE_TTL
+        )
+        self.claim_codes.replace_one(
+            {"_id": claim_code}, {"username": username, "expires_at": expires_at}, upsert=True
+        )
+
+    @blocking
+    def get_claim_code(self, claim_code: str):
+        # The TTL monitor only runs every minute, so expired codes are also filtered out here
+        code_data = self.claim_codes.find_one({"_id": claim_code, "expires_at": {"$gt": datetime.datetime.utcnow()}})
+        return code_data["username"] if code_data is not None else None
+
+    @blocking
+    def remove_claim_code(self, claim_code: str):
+        self.claim_codes.delete_one({"_id": claim_code})
+
+    @blocking
+    def take_token(self, key: str, rate: float, burst: int):
+        # Refill the bucket and take a token in a single update, so that two workers cannot both take the
+        # last token. A missing bucket starts out full
+        now = time.time()
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$max": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 0]}, rate]}
+        ]}]}
+        bucket = self.token_buckets.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+                {"$set": {"full_at": {"$toDate": {"$multiply": [
+                    {"$add": [now, {"$divide": [{"$subtract": [burst, "$tokens"]}, rate]}]}, 1000
+                ]}}}}
+            ],
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return bucket["allowed"]
+
+
+# The tables used by SQLiteStateStore
+SQLITE_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS PublicRooms (room_code TEXT PRIMARY KEY, made_public REAL);
+CREATE TABLE IF NOT EXISTS ClaimCodes (claim_code TEXT PRIMARY KEY, username TEXT, expires_at REAL);
+CREATE TABLE IF NOT EXISTS TokenBuckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL);
+"""
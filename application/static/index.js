@@ -15,6 +15,13 @@ async function getRoomCode () {
         });
 }
 
+async function getOlderMessages (beforeId) {
+    return await fetch(`/api/rooms/${encodeURIComponent(roomCode)}/messages?before=${beforeId}`)
+        .then(async function (resp) {
+            return await resp.json();
+        });
+}
+
 async function getMessageById (msgId) {
     var xmlHttp = new XMLHttpRequest();
     xmlHttp.open( "GET", "/api/get_message_by_id/" + msgId, false ); // false for synchronous request
@@ -26,10 +33,15 @@ async function getMessageById (msgId) {
         });*/ // Messages do not scroll into view
 }
 
-async function addMessage (m, loadingMessages) {
+async function addMessage (m, loadingMessages, prepend = false) {
     let messageContainer = document.getElementById("message-container");
     let messageDiv = document.createElement("div");
-    messageContainer.appendChild(messageDiv);
+    // Older messages are added above the messages already on the screen
+    if (prepend) {
+        messageContainer.insertBefore(messageDiv, messageContainer.firstElementChild);
+    } else {
+        messageContainer.appendChild(messageDiv);
+    }
     // Make the message border yellow if the user is being mentioned in it
     mentionCls = ""
     mentionStyle = "border-width: 4px !important; border-color: transparent !important;"
@@ -57,13 +69,16 @@ async function addMessage (m, loadingMessages) {
     reply = ""
     if (m.replying_to != 0) {
         // Get the messages from the cache if the messages are being loaded, since they will be up to date
+        replyTargetMsg = undefined;
         if (loadingMessages) {
             cachedMsgs.forEach(function (cacheM) {
                 if (cacheM.msg_id == m.replying_to) {
                     replyTargetMsg = cacheM;
                 }
             });
-        } else {
+        }
+        // The message being replied to may be older than the loaded messages
+        if (replyTargetMsg == undefined) {
             replyTargetMsg = await getMessageById(m.replying_to);
         }
         if (replyTargetMsg.content != undefined) {
@@ -115,7 +130,9 @@ async function addMessage (m, loadingMessages) {
     } else if (!(document.hidden)) {
         notified = false; // Reset notified back to false
     }
-    messageDiv.scrollIntoView();
+    if (!prepend) {
+        messageDiv.scrollIntoView();
+    }
     // Scroll down to the lowest message unless the user is trying to scroll up
     //let scrollPercent = (messageContainer.scrollTop / (messageContainer.scrollHeight - messageContainer.clientHeight)) * 100;
     /*let scrollPercent = (messageContainer.scrollTop + messageContainer.clientHeight) / messageContainer.scrollHeight * 100;
@@ -132,6 +149,50 @@ async function addMessage (m, loadingMessages) {
     // Percentages are different when site is reloaded
 }
 
+// Load the page of messages sent before the oldest message on the screen and add them above it
+async function loadOlderMessages () {
+    if (loadingOlderMsgs || !hasOlderMsgs || oldestMsgId == undefined) {
+        return;
+    }
+    loadingOlderMsgs = true;
+    let messageContainer = document.getElementById("message-container");
+    let data = await getOlderMessages(oldestMsgId);
+    cachedMsgs = data.messages.concat(cachedMsgs);
+    hasOlderMsgs = data.has_more;
+    if (data.messages.length > 0) {
+        oldestMsgId = data.messages[0].msg_id;
+    }
+    // Add the messages from new -> old so that they end up in order, then keep the screen on the same message
+    let oldScrollHeight = messageContainer.scrollHeight;
+    for (let i = data.messages.length - 1; i >= 0; i--) {
+        addMessage(data.messages[i], true, true);
+    }
+    messageContainer.scrollTop += messageContainer.scrollHeight - oldScrollHeight;
+    loadingOlderMsgs = false;
+}
+
+// Edit a message on the screen to say that the message was deleted
+function markMessageDeleted (msgId) {
+    let msgContainer = document.getElementById(`msg-${msgId}`);
+    // Skip messages that are not loaded on the screen
+    if (msgContainer == null) {
+        return;
+    }
+    // Remove all icons attached to the message
+    try {
+        msgContainer.querySelector("#icons").remove();
+    } catch (error) {
+    }
+    // If the user is in the edit message UI, remove the edit UI and make the message content visible again
+    try {
+        msgContainer.querySelector("#edit-msg-input").remove();
+        $(msgContainer.querySelector("#content")).removeClass("d-none");
+    } catch (error) {
+    }
+    let msgText = msgContainer.querySelector("p");
+    msgText.innerHTML = "<strong>Message Deleted</strong>";
+}
+
 // Add a room code to the list of public room codes on the screen
 function addPublicRoomCode (code) {
     let publicRoomsContainer = document.getElementById("public-rooms-container");
@@ -175,11 +236,33 @@ function editConfirmed (msgContainer) {
 }
 
 
-// Create socket object
-var socket = io.connect(document.domain + ":" + location.port);
+// Create socket object. Websockets are used first so that the connection stays on one worker when
+// several workers share the server port, and long polling is only used if websockets are blocked.
+// When reconnecting, the newest message on the screen and the watermark from the server are sent so
+// that the server only has to send what was missed
+var socket = io.connect(document.domain + ":" + location.port, {
+    transports: ["websocket"],
+    auth: function (cb) {
+        let auth = {wire: wireEncodings()};
+        if (lastMsgId != undefined) {
+            auth.last_msg_id = lastMsgId;
+            auth.watermark = watermark;
+        }
+        cb(auth);
+    }
+});
+socket.on("connect_error", function () {
+    socket.io.opts.transports = ["polling", "websocket"];
+});
 var userData;
 var roomCode;
 var cachedMsgs; // Stores some of the messages that were previously sent
+var oldestMsgId; // The id of the oldest message on the screen, used to load the page of messages before it
+var lastMsgId; // The id of the newest message on the screen, sent to the server when reconnecting
+var watermark; // The time of the last edit and delete the server has sent, sent to the server when reconnecting
+var roomDataDecoded = Promise.resolve(); // Resolves once room data sent in the compact wire format has been decoded
+var hasOlderMsgs = false; // Shows whether there are older messages in the room that have not been loaded
+var loadingOlderMsgs = false; // Shows whether a page of older messages is currently being loaded
 var notified = false; // Shows whether the user has been already been notified about a new message
 var replyingTo = 0; // 0 is used if the user is not replying to a message while the message id is used if the user is replying to a message
 
@@ -189,10 +272,11 @@ roomStatus.setAttribute("class", "align-self-center btn badge badge-pill");
 roomStatus.setAttribute("style", "background-color: var(--blue-green)");
 roomStatus.setAttribute("onclick", "roomStatusToggleListener(this)");
 
-// Fetch username on connection and send "client connected" event to the server
-socket.on("connect", async function () {
-    userData = await getUser();
-    roomCode = await getRoomCode();
+// The server sends the user, room code, public rooms and newest messages as soon as the socket connects
+socket.on("bootstrap", async function (data) {
+    data = await decodeRoomDataInOrder(data);
+    userData = data.user;
+    roomCode = data.room_code;
     document.getElementById("username-display").innerText = `Sending messages as ${userData.username}:`;
     let roomCodeDisplay = document.getElementById("room-code-display");
     if (roomCode == "GLOBAL") {
@@ -201,14 +285,38 @@ socket.on("connect", async function () {
         roomCodeDisplay.innerText = `Room Code: ${roomCode} `;
     }
     roomCodeDisplay.appendChild(roomStatus);
-    socket.emit("client connected");
+    // A reconnecting client is only sent the changes it missed, which are applied to the messages on the screen
+    if (data.resync) {
+        applyRoomChanges(data);
+    } else {
+        loadRoom(data);
+    }
 })
 
 // Load all messages to the screen after connecting
 socket.on("after connection", async function (data) {
+    loadRoom(await decodeRoomDataInOrder(data));
+})
+
+// Room data sent in the compact wire format arrives as binary, and other events wait for it to be decoded
+// so that they are not handled before the room is loaded
+async function decodeRoomDataInOrder (data) {
+    if (data instanceof ArrayBuffer) {
+        roomDataDecoded = decodeRoomData(data);
+        return await roomDataDecoded;
+    }
+    return data;
+}
+
+function loadRoom (data) {
     // Add all the messages to the screen and scroll to the bottom
     let messages = data.messages;
     cachedMsgs = data.messages; // Updated the message cache
+    hasOlderMsgs = data.has_more;
+    oldestMsgId = messages.length > 0 ? messages[0].msg_id : undefined;
+    lastMsgId = messages.length > 0 ? messages[messages.length - 1].msg_id : 0;
+    watermark = data.watermark;
+    document.getElementById("message-container").innerHTML = ""; // Clear the messages from before a reconnect
     messages.forEach(async (m) => {
         if (m.room_code == roomCode) {
             await addMessage(m, true);
@@ -216,8 +324,25 @@ socket.on("after connection", async function (data) {
     });
     let messageContainer = document.getElementById("message-container");
     messageContainer.scrollTop = messageContainer.scrollHeight; // Needed because auto-scroll doesn't work when loading messages
+    updatePublicRooms(data.public_rooms);
+}
+
+// Apply the messages, edits and deletes missed while the socket was disconnected without reloading the room
+function applyRoomChanges (data) {
+    data.messages.forEach(async (m) => {
+        if (m.room_code == roomCode && document.getElementById(`msg-${m.msg_id}`) == null) {
+            await addMessage(m, false);
+        }
+        lastMsgId = Math.max(lastMsgId, m.msg_id);
+    });
+    data.edited.forEach(e => applyMessageEdit(e.msg_id, e.new_content));
+    data.deleted.forEach(msgId => markMessageDeleted(msgId));
+    watermark = data.watermark;
+    updatePublicRooms(data.public_rooms);
+}
+
+function updatePublicRooms (publicRoomCodes) {
     // Update the public room display
-    let publicRoomCodes = data.public_rooms;
     publicRoomCodes.forEach(c => addPublicRoomCode(c));
     // Update the room status display 
     if (publicRoomCodes.includes(roomCode) || roomCode == "GLOBAL") {
@@ -225,11 +350,23 @@ socket.on("after connection", async function (data) {
     } else {
         roomStatus.innerText = "Private";
     }
-})
+}
+
+// Load older messages when the user scrolls to the top of the messages
+document.addEventListener("DOMContentLoaded", function () {
+    document.getElementById("message-container").addEventListener("scroll", function () {
+        if (this.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
+});
 
 // Display new message onto the screen when the server sends the message data
 socket.on("new message", async function (message) {
-    if (message.room_code == roomCode) {
+    await roomDataDecoded;
+    // Skip messages that were already in the history of the room
+    if (message.room_code == roomCode && document.getElementById(`msg-${message.msg_id}`) == null) {
+        lastMsgId = Math.max(lastMsgId, message.msg_id);
         await addMessage(message, false);
     }
 })
@@ -250,30 +387,51 @@ socket.on("room status changed", async function (data) {
 })
 
 socket.on("message deleted", async function (data) {
-    // Edit the message to say that the message was deleted
-    msgContainer = document.getElementById(`msg-${data.msg_id}`);
-    // Remove all icons attached to the message
-    try {
-        msgContainer.querySelector("#icons").remove();
-    } catch (error) {
-    }
-    // If the user is in the edit message UI, remove the edit UI and make the message content visible again
-    try {
-        msgContainer.querySelector("#edit-msg-input").remove();
-        $(msgContainer.querySelector("#content")).removeClass("d-none");
-    } catch (error) {
-    }
-    msgText = msgContainer.querySelector("p");
-    msgText.innerHTML = "<strong>Message Deleted</strong>";
+    await roomDataDecoded;
+    markMessageDeleted(data.msg_id);
+});
+
+socket.on("messages deleted", async function (data) {
+    await roomDataDecoded;
+    data.msg_ids.forEach(msgId => markMessageDeleted(msgId));
 });
 
 socket.on("message edited", async function (data) {
-    // Edit the existing msgContent element to have the new message content
-    msgContainer = document.getElementById(`msg-${data.msg_id}`);
-    msgContent = msgContainer.children["content"];
-    msgContent.innerHTML = data.new_content;
+    await roomDataDecoded;
+    applyMessageEdit(data.msg_id, data.new_content);
+})
+
+// The server tells a superuser how to use a command they got wrong
+socket.on("command error", function (data) {
+    alert(data.message);
 })
 
+// The server stops sending events to a client that falls too far behind, and asks it to reconnect once it has
+// caught up so that it is sent what it missed
+socket.on("resync", function () {
+    socket.disconnect();
+    socket.connect();
+})
+
+// Busy rooms may send several events in one packet, which are handled in order as if they were sent separately
+socket.on("events", async function (events) {
+    for (let e of events) {
+        for (let handler of socket.listeners(e.event)) {
+            await handler(e.data);
+        }
+    }
+})
+
+// Edit the existing msgContent element to have the new message content
+function applyMessageEdit (msgId, newContent) {
+    let msgContainer = document.getElementById(`msg-${msgId}`);
+    // Skip messages that are not loaded on the screen
+    if (msgContainer == null) {
+        return;
+    }
+    msgContainer.children["content"].innerHTML = newContent;
+}
+
 // Add a listener to perform an event every time the user presses the enter key
 document.addEventListener("keypress", function (event) {
     if (event.key == "Enter") {
@@ -0,0 +1,143 @@
+// Decoding of the compact wire format the server can use for room data, such as the history sent on
+// connect. A compact payload is a binary packet whose first byte is 0 for msgpack or 1 for msgpack
+// compressed with zlib, and whose messages use short keys and epoch timestamps.
+
+// The long keys of the fields of compact messages
+const compactMessageKeys = {
+    i: "msg_id",
+    c: "content",
+    a: "author_id",
+    u: "author_username",
+    t: "sent_at",
+    r: "room_code",
+    p: "replying_to"
+};
+
+// Formats timestamps the same way as the server, such as "03:14 PM on Monday, January 01 2024" in Eastern time
+const prettyTimestampFormat = new Intl.DateTimeFormat("en-US", {
+    timeZone: "America/New_York",
+    hour: "2-digit",
+    minute: "2-digit",
+    hour12: true,
+    weekday: "long",
+    month: "long",
+    day: "2-digit",
+    year: "numeric"
+});
+
+// The encodings this browser can decode, sent to the server when the socket connects
+function wireEncodings () {
+    let encodings = ["msgpack"];
+    if (typeof DecompressionStream != "undefined") {
+        encodings.push("deflate");
+    }
+    return encodings;
+}
+
+function prettyTimestamp (epochMs) {
+    let parts = {};
+    prettyTimestampFormat.formatToParts(new Date(epochMs)).forEach(p => parts[p.type] = p.value);
+    return `${parts.hour}:${parts.minute} ${parts.dayPeriod.toUpperCase()} on ${parts.weekday}, ${parts.month} ${parts.day} ${parts.year}`;
+}
+
+// Turn room data sent in the compact format back into the dicts used everywhere else
+async function decodeRoomData (buffer) {
+    let bytes = new Uint8Array(buffer);
+    let body = bytes.subarray(1);
+    if (bytes[0] == 1) {
+        let stream = new Blob([body]).stream().pipeThrough(new DecompressionStream("deflate"));
+        body = new Uint8Array(await new Response(stream).arrayBuffer());
+    }
+    let data = decodeMsgpack(body);
+    if (data.messages != undefined) {
+        data.messages = data.messages.map(function (compact) {
+            let m = {replying_to: 0};
+            for (let key in compact) {
+                m[compactMessageKeys[key]] = compact[key];
+            }
+            m.timestamp = prettyTimestamp(m.sent_at);
+            return m;
+        });
+    }
+    return data;
+}
+
+// Decode the subset of msgpack the server sends: nil, booleans, numbers, strings, binary, arrays and maps
+function decodeMsgpack (bytes) {
+    let view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let textDecoder = new TextDecoder();
+    let pos = 0;
+
+    function readString (length) {
+        let s = textDecoder.decode(bytes.subarray(pos, pos + length));
+        pos += length;
+        return s;
+    }
+    function readArray (length) {
+        let array = new Array(length);
+        for (let i = 0; i < length; i++) {
+            array[i] = read();
+        }
+        return array;
+    }
+    function readMap (length) {
+        let map = {};
+        for (let i = 0; i < length; i++) {
+            let key = read();
+            map[key] = read();
+        }
+        return map;
+    }
+    // Message ids are below 2^53, so 64 bit integers fit in a Number
+    function readUint64 () {
+        let value = view.getUint32(pos) * 4294967296 + view.getUint32(pos + 4);
+        pos += 8;
+        return value;
+    }
+    function readInt64 () {
+        let value = view.getInt32(pos) * 4294967296 + view.getUint32(pos + 4);
+        pos += 8;
+        return value;
+    }
+    function next (length, getter) {
+        let value = getter(pos);
+        pos += length;
+        return value;
+    }
+
+    function read () {
+        let type = bytes[pos++];
+        if (type <= 0x7f) return type;
+        if (type <= 0x8f) return readMap(type & 0x0f);
+        if (type <= 0x9f) return readArray(type & 0x0f);
+        if (type <= 0xbf) return readString(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: { let n = next(1, p => view.getUint8(p)); pos += n; return bytes.slice(pos - n, pos); }
+            case 0xc5: { let n = next(2, p => view.getUint16(p)); pos += n; return bytes.slice(pos - n, pos); }
+            case 0xc6: { let n = next(4, p => view.getUint32(p)); pos += n; return bytes.slice(pos - n, pos); }
+            case 0xca: return next(4, p => view.getFloat32(p));
+            case 0xcb: return next(8, p => view.getFloat64(p));
+            case 0xcc: return next(1, p => view.getUint8(p));
+            case 0xcd: return next(2, p => view.getUint16(p));
+            case 0xce: return next(4, p => view.getUint32(p));
+            case 0xcf: return readUint64();
+            case 0xd0: return next(1, p => view.getInt8(p));
+            case 0xd1: return next(2, p => view.getInt16(p));
+            case 0xd2: return next(4, p => view.getInt32(p));
+            case 0xd3: return readInt64();
+            case 0xd9: return readString(next(1, p => view.getUint8(p)));
+            case 0xda: return readString(next(2, p => view.getUint16(p)));
+            case 0xdb: return readString(next(4, p => view.getUint32(p)));
+            case 0xdc: return readArray(next(2, p => view.getUint16(p)));
+            case 0xdd: return readArray(next(4, p => view.getUint32(p)));
+            case 0xde: return readMap(next(2, p => view.getUint16(p)));
+            case 0xdf: return readMap(next(4, p => view.getUint32(p)));
+        }
+        throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+    }
+    return read();
+}
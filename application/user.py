@@ -1,7 +1,5 @@
-import random
-import time
-
 from .message import Message
+from .snowflake import generate_id
 
 
 class User:
@@ -15,8 +13,7 @@ class User:
 
         # Generate the user id if it is not provided
         if self.user_id is None:
-            time_created = round(time.time())
-            self.user_id = str(time_created) + str(random.randint(1000, 9999))
+            self.user_id = generate_id()
         self.user_id = int(self.user_id)
     
     def to_dict(self):
@@ -1,6 +1,8 @@
 import functools
 import json
+import os
 import re
+from types import MappingProxyType
 from markupsafe import Markup
 from markdown import markdown
 from profanity import censor_profanity
@@ -38,43 +40,137 @@ def is_superuser(func):
     return wrapper
 
 
+# PATTERNS
+
+# The markup characters users can surround text with, the pattern of the text they surround and the html
+# tags that replace them, in the order they are applied
+MARKUP_PATTERNS = (
+    ("**", re.compile(r"\*\*(.*?)\*\*"), ("<b>", "</b>")), # Bolded
+    ("*", re.compile(r"\*(.*?)\*"), ("<i>", "</i>")), # Italicized
+    ("__", re.compile(r"__(.*?)__"), ("<u>", "</u>")) # Underlined
+)
+
+# The characters of a url other than whitespace, parentheses and angle brackets
+_URL_CHARS = r"[^\s()<>]"
+# Balanced parentheses in a url, nested up to two deep, such as in wikipedia links
+_URL_PARENS = r"\(" + _URL_CHARS + r"*(?:\(" + _URL_CHARS + r"+\)" + _URL_CHARS + r"*)*\)"
+# The rest of a url after its start. It runs until whitespace, an angle bracket or an unbalanced
+# parenthesis, but does not end in punctuation so that the full stop of a sentence is not linked. Each
+# repetition starts with a parenthesis, so the characters can only be matched one way and a url is
+# matched in linear time
+_URL_BODY = (
+    r"(?:" + _URL_CHARS + r"|" + _URL_PARENS + r")" + _URL_CHARS + r"*(?:" + _URL_PARENS + _URL_CHARS + r"*)*"
+    + r"(?:" + _URL_PARENS + r"|[^\s`!()\[\]{};:'\".,<>?«»“”‘’])"
+)
+# A url, which starts with http(s):// or www., or with a domain name and a slash such as example.com/page.
+# A domain name url is only looked for at the first word boundary of each run of domain name characters,
+# since it cannot start later in the run if it does not start there and trying every position would
+# take quadratic time. Any dashes and dots before the boundary, or letters and numbers when the run comes
+# right after another word character, are not part of the url
+URL_REGEX = re.compile(
+    r"(?i)\b((?:https?://|www\d{0,3}[.])" + _URL_BODY + r")"
+    + r"|(?<![a-z0-9.\-])(?:(?<!\w)[.\-]*(?=[a-z0-9])|(?<=\w)[a-z0-9]*(?=[.\-]))"
+    + r"([a-z0-9.\-]+[.][a-z]{2,4}/" + _URL_BODY + r")"
+)
+
+
 # FUNCTIONS
 
+def _load_emojis():
+    # Note: Similar emojis have been removed from the json file such as emojis with different skin tones
+    # Note: The emoji file was sourced from: https://github.com/ArkinSolomon/discord-emoji-converter/blob/master/emojis.json
+    # The file is found from the package so that the app can be started from any working directory
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "emojis.json")
+    with open(path, 'rb') as f:
+        return MappingProxyType(json.load(f))
+
+# Every emoji, loaded once when the app starts, as a read-only {emoji_name: emoji} mapping
+EMOJIS = _load_emojis()
+
 def get_all_emojis():
-    """Gets all emojis from the JSON file containing the emojis and returns them. The emojis are
-    formatted as {emoji_name: emoji}.
+    """Gets all emojis, which are loaded from the JSON file containing the emojis when the app starts.
+    The emojis are formatted as {emoji_name: emoji}.
 
     Returns:
-        dict: A dict of all emojis with the emoji name as the key and the emoji as the value.
+        MappingProxyType: A read-only mapping of all emojis with the emoji name as the key and the emoji
+            as the value.
     """
-    # Note: Similar emojis have been removed from the json file such as emojis with different skin tones
-    # Note: The emoji file was sourced from: https://github.com/ArkinSolomon/discord-emoji-converter/blob/master/emojis.json
-    with open("./emojis.json", 'rb') as f:
-        emojis = json.load(f)
-    return emojis
+    return EMOJIS
+
+def replace_emojis(content: str):
+    """Replaces every :emoji_name: in a string with the emoji in one pass over the fragments between its
+    colons. Emoji names are not case sensitive, and they are matched from left to right, so the colon
+    that closes one emoji cannot open another.
 
-def markup_str(content: str, markup_chars: str, query_chars: str, replace_with: list):
-    """Marks up parts of a string with html if they are surrounded by the markup char. This is useful
+    Args:
+        content (str): The content of the message to be processed
+
+    Returns:
+        str: The content with the emojis in it
+    """
+    fragments = content.split(":")
+    if len(fragments) < 3:
+        return content
+    parts = [fragments[0]]
+    last = len(fragments) - 1
+    i = 1
+    while i <= last:
+        # A fragment is only an emoji name if there is a colon after it
+        emoji = EMOJIS.get(fragments[i].lower()) if i < last else None
+        if emoji is None:
+            parts.append(":")
+            parts.append(fragments[i])
+            i += 1
+        else:
+            parts.append(emoji)
+            parts.append(fragments[i + 1])
+            i += 2
+    return "".join(parts)
+
+def markup_str(content: str):
+    """Marks up parts of a string with html if they are surrounded by the markup chars. This is useful
     to allow users to add variance to their messages while making sure that only safe characters are being
-    used when they are adding variance to their messages.
+    used when they are adding variance to their messages. Each kind of markup is applied in one pass over
+    the string, in the order of MARKUP_PATTERNS.
 
     Args:
         content (str): The content of the message to be processed
-        markup_chars (str): The escaped characters to supply to the regex
-        query_chars (str): The exact characters to look for when replacing chars in the string
-        replace_with (list): The html to replace the characters with. The opening tag and closing tag
-            should be seperate elements in the list.
 
     Returns:
         str: The marked up message content
     """
-    regex = re.compile(f'{markup_chars}(.*?){markup_chars}')
-    for result in regex.findall(content):
-        replace_str = query_chars + result + query_chars
-        new_str = replace_with[0] + result + replace_with[1]
-        content = content.replace(replace_str, new_str)
+    for markup_chars, regex, (open_tag, close_tag) in MARKUP_PATTERNS:
+        if markup_chars in content:
+            content = regex.sub(lambda match: open_tag + match.group(1) + close_tag, content)
     return content
 
+def link_urls(content: str):
+    """Makes every url in a string clickable in one pass over the string, so a url that appears more
+    than once is only linked once at each place it appears.
+
+    Args:
+        content (str): The content of the message to be processed
+
+    Returns:
+        str: The content with the urls wrapped in links
+    """
+    # Every url starts with www or has a slash that does not close an html tag, so most messages can be
+    # skipped without searching them
+    if content.count("/") == content.count("</") and "www" not in content.lower():
+        return content
+    parts = []
+    end = 0 # The end of the last url that was linked
+    for match in URL_REGEX.finditer(content):
+        # Only the group of the alternative that matched is set, and it holds the url
+        url = match.group(match.lastindex)
+        parts.append(content[end:match.start(match.lastindex)])
+        parts.append(f'<a href="{url}" target="_blank">{url}</a>')
+        end = match.end()
+    if not parts:
+        return content
+    parts.append(content[end:])
+    return "".join(parts)
+
 def parse_message(content):
     """Parse the message contents and remove profanity, replace emoji codes with the actual
     emojis, and escape any html for non-superuser accounts. 
@@ -85,15 +181,8 @@ def parse_message(content):
     Returns:
         str: The parsed and edited message contents
     """
-    # Replace all emoji names with the actual emoji in the message content. This is done by slicing 
-    # the message content on the colon character and then trying to get each message fragment from
-    # the dict containing all the emojis. This is fast because of Big O time complexity
-    emoji_data = get_all_emojis()
-    m_content = content.split(":")
-    for emoji_name in m_content:
-        emoji = emoji_data.get(emoji_name.lower())
-        if emoji is not None:
-            content = content.replace(f":{emoji_name}:", emoji)
+    # Replace all emoji names with the actual emoji in the message content
+    content = replace_emojis(content)
     
     # Escape any html in the message if the user is not a superuser. Otherwise, convert the markdown into html
     if session.get("user").user_type != 1:
@@ -103,24 +192,12 @@ def parse_message(content):
         content = content.replace("<p>", "").replace("</p>", "") # Remove the <p> tags from the message so that it renders correctly
     
     # Markup up the message content based on what markup characters the user used in their message
-    content = markup_str(content, r'\*\*', "**", ["<b>", "</b>"]) # Bolded
-    content = markup_str(content, r'\*', "*", ["<i>", "</i>"]) # Italicized
-    content = markup_str(content, r'\_\_', "__", ["<u>", "</u>"]) # Underlined
+    content = markup_str(content)
     
     # Detect urls and make them clickable
-    urlRegex = re.compile(r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))")
-    for result in urlRegex.findall(content):
-        content = content.replace(result[0], f'<a href="{result[0]}" target="_blank">{result[0]}</a>')
+    content = link_urls(content)
     
     # Filter out any profanity from the message content
     content = censor_profanity(content)
     
     return content
-
-
-
-# VARIABLES
-
-claim_codes = [] # Contains all active claim codes in the application
-public_rooms = ["Suggestions", "Feedback"] # Contains the room codes for all the public rooms in the application
-ratelimits = {} # Contains the user ID and when the last message was sent
\ No newline at end of file
@@ -7,16 +7,23 @@ from flask import request
 from flask import session
 
 from application.database import DataBase
+from application.state import get_state_store
 from application.user import User
 from application.utils import get_all_emojis
 from application.utils import is_superuser
 from application.utils import logged_in
-from application.utils import claim_codes
 
 
 # Create the blueprint
 view = Blueprint("views", __name__)
 
+# The emojis shown on the emoji list page, sorted by name. Emojis with names that are too long are skipped
+EMOJI_LIST = tuple(
+    {"name": emoji_name, "emoji": emoji}
+    for emoji_name, emoji in sorted(get_all_emojis().items())
+    if len(emoji_name) <= 20
+)
+
 
 # Routes
 
@@ -108,16 +115,11 @@ def all_users():
 @is_superuser
 def create_claim_code():
     if request.method == "POST":
-        # Extract the data from the request form and add it to the claim_codes list
+        # Extract the data from the request form and add the claim code to the state store
         data = request.form.to_dict()
         new_claim_code = data["claim_code"]
         recipient_username = data["recipient_username"]
-        claim_codes.append(
-            {
-                "claim_code": new_claim_code,
-                "username": recipient_username
-            }
-        )
+        get_state_store().add_claim_code(new_claim_code, recipient_username)
         flash("Successfully created claim code for " + recipient_username, "success")
         return redirect(url_for("views.home"))
     else:
@@ -131,11 +133,10 @@ def claim_account():
         code = data["claim_code"]
         password = data["password"]
         confirm_password = data["confirm_password"]
-        # Check if the claim code is valid
-        for code_data in claim_codes:
-            if code_data["claim_code"] == code:
-                break
-        else:
+        # Check if the claim code is valid and has not expired
+        state = get_state_store()
+        username = state.get_claim_code(code)
+        if username is None:
             flash("Invalid Claim Code", "failure")
             return render_template("claim.html")
         # Check if the passwords match
@@ -143,11 +144,14 @@ def claim_account():
             flash("Passwords Do Not Match", "failure")
             return render_template("claim.html")
         # Create the account and add it to the database
-        u = User(code_data["username"], password, 0)
+        u = User(username, password, 0)
         db = DataBase()
-        db.add_user(u)
+        added = db.add_user(u)
         db.close()
-        claim_codes.remove(code_data) # Delete the claim code
+        if not added:
+            flash("Username Already Taken", "failure")
+            return render_template("claim.html")
+        state.remove_claim_code(code) # Delete the claim code
         flash(f"Successfully claimed account for {u.username}. Please log in using {u.username} as your username", "success")
         return redirect(url_for("views.home"))
     else:
@@ -175,18 +179,4 @@ def emoji_list():
                 if len(alias) > 20:
                     e['alias'].remove(alias)
         emojis.append(e)"""
-    emojis = []
-    emoji_data = get_all_emojis()
-    for emoji_name in emoji_data:
-        # Skip emojis with names that are too long
-        if len(emoji_name) > 20:
-            continue
-        # Add the emoji's data to the emojis list
-        emojis.append(
-            {
-                "name": emoji_name,
-                "emoji": emoji_data[emoji_name]
-            }
-        )
-    emojis.sort(key=lambda e: e["name"])
-    return render_template("emojis.html", emojis=emojis)
\ No newline at end of file
+    return render_template("emojis.html", emojis=EMOJI_LIST)
\ No newline at end of file
@@ -0,0 +1,97 @@
+import logging
+import zlib
+
+from config import Config
+
+# msgpack is only needed when the compact wire format is enabled
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+# Warn once when the app starts instead of every time a socket connects
+if Config.COMPACT_WIRE and msgpack is None:
+    logger.warning("COMPACT_WIRE is enabled, but msgpack is not installed, so JSON is used instead")
+
+
+# The short keys used for the fields of messages in the compact format
+COMPACT_MESSAGE_KEYS = {
+    "msg_id": "i",
+    "content": "c",
+    "author_id": "a",
+    "author_username": "u",
+    "sent_at": "t",
+    "room_code": "r",
+    "replying_to": "p"
+}
+
+# The first byte of a compact payload, which says how the rest of it is encoded
+FORMAT_MSGPACK = 0
+FORMAT_MSGPACK_DEFLATE = 1
+
+
+def negotiate_wire_format(auth):
+    """Picks the format of the room data sent to a socket from the encodings its client supports. The
+    client lists them in the `wire` field of its auth data, and the compact format is only used when
+    Config.COMPACT_WIRE is enabled.
+
+    Args:
+        auth (dict): The auth data of the socket
+
+    Returns:
+        str: "msgpack", "msgpack+deflate" if the client can also inflate zlib data, or None for JSON
+    """
+    if not Config.COMPACT_WIRE or not isinstance(auth, dict):
+        return None
+    encodings = auth.get("wire")
+    if not isinstance(encodings, list) or "msgpack" not in encodings:
+        return None
+    if msgpack is None:
+        return None
+    return "msgpack+deflate" if "deflate" in encodings else "msgpack"
+
+def compact_message(m: dict):
+    """Converts a message dict into the compact format, which uses short keys, leaves out a replying_to
+    of 0 and leaves out the pretty timestamp, which the client formats from the time the message was
+    sent in milliseconds since the UNIX epoch.
+
+    Args:
+        m (dict): The message dict sent to clients
+
+    Returns:
+        dict: The compact message
+    """
+    compact = {
+        "i": m["msg_id"],
+        "c": str(m["content"]),
+        "a": m["author_id"],
+        "u": m["author_username"],
+        "t": m["sent_at"],
+        "r": m["room_code"]
+    }
+    if m.get("replying_to"):
+        compact["p"] = m["replying_to"]
+    return compact
+
+def encode_room_data(data: dict, wire_format: str):
+    """Encodes the room data sent to a socket in the compact format. The messages are made compact, the
+    whole payload is packed with msgpack, and large payloads are compressed with zlib if the client
+    supports it. The result is sent as a binary Socket.IO packet.
+
+    Args:
+        data (dict): The room data, such as the bootstrap payload
+        wire_format (str): The format returned by negotiate_wire_format()
+
+    Returns:
+        bytes: The format byte followed by the encoded payload
+    """
+    body = dict(data)
+    if "messages" in body:
+        body["messages"] = [compact_message(m) for m in body["messages"]]
+    packed = msgpack.packb(body, use_bin_type=True)
+    if wire_format == "msgpack+deflate" and len(packed) >= Config.WIRE_COMPRESS_MIN_BYTES:
+        return bytes([FORMAT_MSGPACK_DEFLATE]) + zlib.compress(packed, Config.WIRE_COMPRESS_LEVEL)
+    return bytes([FORMAT_MSGPACK]) + packed
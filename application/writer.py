@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+
+    def __init__(self, insert_func, batch_size: int=100, flush_interval: float=0.05, max_pending: int=10000,
+                 max_retries: int=5, retry_backoff: float=0.1):
+        """Initializes a write-behind queue for new messages. Messages are handed to a background thread
+        which inserts them in batches, either when a full batch is waiting or when the oldest queued
+        message has waited for `flush_interval` seconds.
+
+        Args:
+            insert_func (function): Inserts a list of message dicts into the database. This must be safe
+                to call again with messages that were already inserted by a failed attempt.
+            batch_size (int, optional): The maximum number of messages inserted at once. Defaults to 100.
+            flush_interval (float, optional): The longest time in seconds a message waits in the queue
+                before it is written. Defaults to 0.05.
+            max_pending (int, optional): The maximum number of queued messages. Once the queue is full,
+                messages are inserted by the thread that sent them. Defaults to 10000.
+            max_retries (int, optional): The number of times a failed batch is retried before it is put
+                back at the front of the queue. Defaults to 5.
+            retry_backoff (float, optional): The delay in seconds before the first retry. The delay is
+                doubled after every failed attempt. Defaults to 0.1.
+        """
+        self.insert_func = insert_func
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.batches_written = 0
+        self.messages_written = 0
+        self.failed_attempts = 0
+        self._pending = OrderedDict() # msg_id -> message dict, ordered from old -> new
+        self._in_flight = {} # msg_id -> message dict for the batch currently being inserted
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock() # Held while a batch is being inserted
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="MessageWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, msg_dict: dict):
+        """Queues a new message to be inserted into the database.
+
+        Args:
+            msg_dict (dict): The message data in the format stored in the database
+        """
+        with self._lock:
+            if not self._closed and len(self._pending) < self.max_pending:
+                self._pending[msg_dict["_id"]] = msg_dict
+                if len(self._pending) >= self.batch_size:
+                    self._lock.notify()
+                return
+        # Apply backpressure by writing the message directly if the queue is full or closed
+        self.insert_func([msg_dict])
+
+    def update_pending(self, msg_id: int, fields: dict):
+        """Applies an update to a message that has not been written yet. If the message is part of the
+        batch being inserted right now, this waits for the insert to finish so that the caller's update
+        is applied after it.
+
+        Args:
+            msg_id (int): The unique id of the message
+            fields (dict): The fields to set on the message
+
+        Returns:
+            bool: True if the queued message was updated, or False if the message has already been written
+                and the caller has to update it in the database
+        """
+        while True:
+            with self._lock:
+                if msg_id in self._pending:
+                    self._pending[msg_id] = dict(self._pending[msg_id], **fields)
+                    return True
+                if msg_id not in self._in_flight:
+                    return False
+            # Check again once the insert is done, since a failed batch is put back in the queue
+            self._wait_for_flush()
+
+    def discard_pending(self, msg_id: int):
+        """Removes a message that has not been written yet from the queue. If the message is part of the
+        batch being inserted right now, this waits for the insert to finish so that the caller's delete
+        is applied after it.
+
+        Args:
+            msg_id (int): The unique id of the message
+
+        Returns:
+            bool: True if the message was removed from the queue, or False if the message has already been
+                written and the caller has to delete it from the database
+        """
+        while True:
+            with self._lock:
+                if self._pending.pop(msg_id, None) is not None:
+                    return True
+                if msg_id not in self._in_flight:
+                    return False
+            # Check again once the insert is done, since a failed batch is put back in the queue
+            self._wait_for_flush()
+
+    def get_pending(self, msg_id: int):
+        """Gets a message that has not been written to the database yet.
+
+        Args:
+            msg_id (int): The unique id of the message
+
+        Returns:
+            dict: The queued message data, or None if the message is not queued
+        """
+        with self._lock:
+            return self._pending.get(msg_id) or self._in_flight.get(msg_id)
+
+    def flush(self):
+        """Writes every queued message to the database before returning. This is used before reading
+        from the database so that reads include every message that has been sent.
+        """
+        while True:
+            with self._lock:
+                if not self._pending and not self._in_flight:
+                    return
+            self._write_batch(raise_errors=True)
+
+    def close(self):
+        """Stops the background thread and writes every queued message to the database. Messages sent
+        after the writer is closed are inserted directly.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify()
+        self._thread.join()
+        self.flush()
+
+    def stats(self):
+        """Returns the counters and the current size of the queue.
+
+        Returns:
+            dict: The writer statistics
+        """
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "batches_written": self.batches_written,
+                "messages_written": self.messages_written,
+                "failed_attempts": self.failed_attempts
+            }
+
+    def _wait_for_flush(self):
+        with self._flush_lock:
+            pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # Wait until a full batch is queued or the flush interval has passed
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._lock.wait(self.flush_interval)
+                if self._closed:
+                    return
+                if not self._pending:
+                    continue
+            if not self._write_batch(raise_errors=False):
+                # Give the database time to recover before the batch is attempted again
+                time.sleep(self.retry_backoff * 2 ** self.max_retries)
+
+    def _write_batch(self, raise_errors: bool):
+        with self._flush_lock:
+            # Move the oldest queued messages into the in-flight batch
+            with self._lock:
+                while self._pending and len(self._in_flight) < self.batch_size:
+                    msg_id, msg_dict = self._pending.popitem(last=False)
+                    self._in_flight[msg_id] = msg_dict
+                batch = list(self._in_flight.values())
+            if not batch:
+                return True
+
+            # Insert the batch, retrying with exponential backoff if it fails
+            delay = self.retry_backoff
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.insert_func(batch)
+                except Exception as e:
+                    self.failed_attempts += 1
+                    error = e
+                    if attempt < self.max_retries:
+                        logger.warning(f"Failed to write {len(batch)} messages to the database, retrying in {delay:.2f}s", exc_info=True)
+                        time.sleep(delay)
+                        delay *= 2
+                    else:
+                        logger.exception(f"Failed to write {len(batch)} messages to the database after {attempt + 1} attempts")
+                else:
+                    with self._lock:
+                        self._in_flight.clear()
+                        self.batches_written += 1
+                        self.messages_written += len(batch)
+                    return True
+
+            # Put the batch back at the front of the queue so that it is not lost
+            with self._lock:
+                for msg_dict in reversed(batch):
+                    self._pending[msg_dict["_id"]] = msg_dict
+                    self._pending.move_to_end(msg_dict["_id"], last=False)
+                self._in_flight.clear()
+            if raise_errors:
+                raise error
+            return False
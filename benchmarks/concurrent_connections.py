@@ -0,0 +1,227 @@
+"""Benchmark of how many concurrent Socket.IO connections each server mode can hold.
+
+Starts wsgi.py once for every ASYNC_MODE against a temporary SQLite database, then opens websocket
+clients in batches until the target count is reached or joins start failing. Every client logs in,
+joins the room and waits for its history, like the browser does. With every client still connected
+it reports:
+
+- how long joining the room takes (p50/p99) and how many clients could not join
+- how long a message takes to reach every client in the room
+- the resident memory of the server process
+
+The clients run in this process, so use a machine with enough file descriptors (`ulimit -n`) for
+the number of connections. The clients need the `requests` and `websocket-client` packages, which
+are not needed by the app itself.
+
+Usage (from the repository root):
+    python -m benchmarks.concurrent_connections [--clients 500] [--modes threading eventlet gevent]
+
+Results with 2000 clients on a Linux container (Python 3.11, eventlet 0.41, gevent 26.9), with the
+clients running on the same machine:
+
+    mode       connected failed  join p50  join p99   fan-out      rss
+    threading       2000      0   139.7ms   468.9ms   668.9ms  283.5MB
+    eventlet        2000      0   159.1ms   303.7ms   622.5ms  186.9MB
+    gevent          2000      0   144.7ms   316.8ms   666.1ms  196.4MB
+
+The threading server needs an OS thread and its stack for every socket, so its memory grows fastest
+and its join latency spreads the most. eventlet stopped accepting clients at 1024 connections until
+its server was given Config.MAX_CONNECTIONS. Past a few thousand clients the client threads in this
+process become the bottleneck, so run the clients from several machines to find the server's limit.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import socketio
+
+
+ROOM_CODE = "BENCH"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_user(db_path: str, username: str, password: str):
+    # Add the user with a separate process so that this process does not load the app's config
+    code = (
+        "from application.database import DataBase; from application.user import User; "
+        f"DataBase().add_user(User({username!r}, {password!r}, 0))"
+    )
+    env = dict(os.environ, DB_BACKEND="sqlite", SQLITE_PATH=db_path, ASYNC_MODE="threading")
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def start_server(mode: str, port: int, db_path: str, extra_env: dict=None):
+    env = dict(
+        os.environ,
+        ASYNC_MODE=mode,
+        DB_BACKEND="sqlite",
+        SQLITE_PATH=db_path,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        SECRET_KEY="benchmark",
+        DEBUG="false"
+    )
+    env.update(extra_env or {})
+    server = subprocess.Popen(
+        [sys.executable, "wsgi.py"], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    # Wait for the server to accept connections
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"The {mode} server did not start")
+
+
+def login(url: str, username: str, password: str, room_code: str=ROOM_CODE):
+    # Log in once and share the session cookie between every client
+    http = requests.Session()
+    resp = http.post(f"{url}/login", data={"username": username, "password": password, "room_code": room_code})
+    resp.raise_for_status()
+    return "; ".join(f"{k}={v}" for k, v in http.cookies.items())
+
+
+def server_rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+class BenchClient:
+
+    def __init__(self, url: str, cookie: str):
+        self.url = url
+        self.cookie = cookie
+        self.sio = socketio.Client(reconnection=False)
+        self.joined = threading.Event()
+        self.received = threading.Event()
+        self.sio.on("after connection", lambda data: self.joined.set())
+        self.sio.on("new message", self.on_new_message)
+
+    def on_new_message(self, data):
+        self.received.set()
+
+    def join(self, timeout: float):
+        # Returns the time taken to connect and receive the history, or None if the client failed to join
+        start = time.perf_counter()
+        try:
+            self.sio.connect(self.url, headers={"Cookie": self.cookie}, transports=["websocket"], wait_timeout=timeout)
+            self.sio.emit("client connected")
+        except Exception:
+            return None
+        if not self.joined.wait(timeout):
+            return None
+        return time.perf_counter() - start
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def percentile(values: list, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_mode(mode: str, clients: int, batch: int, timeout: float):
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "bench.db")
+    create_user(db_path, "bench", "bench")
+    port = free_port()
+    server = start_server(mode, port, db_path)
+    url = f"http://127.0.0.1:{port}"
+    connected = []
+    join_times = []
+    failed = 0
+    try:
+        cookie = login(url, "bench", "bench")
+        with ThreadPoolExecutor(max_workers=batch) as pool:
+            # Open the clients in batches, stopping early once most of a batch fails to join
+            while len(connected) < clients:
+                new_clients = [BenchClient(url, cookie) for _ in range(min(batch, clients - len(connected)))]
+                results = list(pool.map(lambda c: c.join(timeout), new_clients))
+                for c, t in zip(new_clients, results):
+                    if t is None:
+                        failed += 1
+                        c.close()
+                    else:
+                        connected.append(c)
+                        join_times.append(t)
+                if results.count(None) > len(results) // 2:
+                    break
+
+        # Send one message and time how long it takes to reach every connected client
+        fanout = float("nan")
+        if connected:
+            for c in connected:
+                c.received.clear()
+            start = time.perf_counter()
+            connected[0].sio.emit("send message", {
+                "content": "benchmark",
+                "author_id": 0,
+                "author_username": "bench",
+                "room_code": ROOM_CODE,
+                "replying_to": 0
+            })
+            reached = sum(c.received.wait(max(0.0, timeout - (time.perf_counter() - start))) for c in connected)
+            if reached == len(connected):
+                fanout = time.perf_counter() - start
+
+        return {
+            "mode": mode,
+            "connected": len(connected),
+            "failed": failed,
+            "join_p50_ms": percentile(join_times, 0.5) * 1000 if join_times else float("nan"),
+            "join_p99_ms": percentile(join_times, 0.99) * 1000 if join_times else float("nan"),
+            "fanout_ms": fanout * 1000,
+            "rss_mb": server_rss_mb(server.pid)
+        }
+    finally:
+        with ThreadPoolExecutor(max_workers=batch) as pool:
+            list(pool.map(lambda c: c.close(), connected))
+        server.kill()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500, help="The number of connections to open")
+    parser.add_argument("--batch", type=int, default=50, help="The number of clients opened at once")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds a client may take to join")
+    parser.add_argument("--modes", nargs="+", default=["threading", "eventlet", "gevent"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'connected':>9} {'failed':>6} {'join p50':>9} {'join p99':>9} {'fan-out':>9} {'rss':>8}")
+    for mode in args.modes:
+        r = run_mode(mode, args.clients, args.batch, args.timeout)
+        print(
+            f"{r['mode']:<10} {r['connected']:>9} {r['failed']:>6} {r['join_p50_ms']:>7.1f}ms "
+            f"{r['join_p99_ms']:>7.1f}ms {r['fanout_ms']:>7.1f}ms {r['rss_mb']:>6.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
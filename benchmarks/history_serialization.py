@@ -0,0 +1,104 @@
+"""Microbenchmark for serializing the history of a large room.
+
+Compares the old read path, which built a Message object for every row (running Message.__init__
+and converting the timezone twice) before calling to_dict(), against message_doc_to_dict(), which
+turns each database row straight into the dict sent to clients. The SQLite backend is also timed end
+to end on a temporary database.
+
+Usage (from the repository root):
+    python -m benchmarks.history_serialization [--messages 100000]
+"""
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import pytz
+from dateutil import tz
+
+
+def legacy_to_dict(msg: dict):
+    # The read path from before message_doc_to_dict() was added, kept here as the baseline
+    timestamp = msg["timestamp"]
+    utc_now = pytz.utc.localize(datetime.datetime.utcnow()).astimezone(pytz.timezone("US/Eastern"))
+    utc_now.strftime("%I:%M %p on %A, %B %d %Y")
+    int(str(round(time.time())) + str(random.randint(1000, 9999)))
+    timestamp = timestamp.replace(tzinfo=tz.tzutc())
+    timestamp = timestamp.astimezone(tz.gettz("US/Eastern"))
+    return {
+        "content": msg["content"],
+        "author_id": msg["author_id"],
+        "author_username": msg["author_username"],
+        "timestamp": timestamp.strftime("%I:%M %p on %A, %B %d %Y"),
+        "msg_id": int(msg["_id"]),
+        "room_code": msg["room_code"],
+        "replying_to": msg["replying_to"]
+    }
+
+
+def make_docs(count: int):
+    # Documents in the format returned by MongoDB, sent a few seconds apart
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        {
+            "_id": 1000000 + i,
+            "content": f"Message number {i}",
+            "author_id": 17000000001234,
+            "author_username": "bench",
+            "timestamp": start + datetime.timedelta(seconds=i * 7),
+            "room_code": "BENCH",
+            "replying_to": 0
+        } for i in range(count)
+    ]
+
+
+def best_of(func, repeat: int=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000, help="The number of messages in the room")
+    args = parser.parse_args()
+
+    # Use a temporary SQLite database so that the benchmark does not need MongoDB
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["RECENT_CACHE_MESSAGES_PER_ROOM"] = "0"
+    from application.database import DataBase
+    from application.message import Message
+    from application.message import message_doc_to_dict
+
+    docs = make_docs(args.messages)
+    assert [legacy_to_dict(d) for d in docs[:1000]] == [message_doc_to_dict(d) for d in docs[:1000]]
+
+    print(f"Serializing a {args.messages} message room (best of 3):")
+    legacy = best_of(lambda: [legacy_to_dict(d) for d in docs])
+    objects = best_of(lambda: [Message.construct_message(
+        d["content"], d["author_id"], d["author_username"], d["timestamp"], d["room_code"], d["_id"], d["replying_to"]
+    ).to_dict() for d in docs])
+    fast = best_of(lambda: [message_doc_to_dict(d) for d in docs])
+    print(f"  legacy Message path:        {legacy * 1000:8.1f} ms")
+    print(f"  construct_message+to_dict:  {objects * 1000:8.1f} ms ({legacy / objects:.1f}x)")
+    print(f"  message_doc_to_dict:        {fast * 1000:8.1f} ms ({legacy / fast:.1f}x)")
+
+    # Time the SQLite backend end to end, including the query
+    db = DataBase()
+    for i in range(0, len(docs), 10000):
+        db.insert_message_dicts(docs[i:i + 10000])
+    rows = best_of(lambda: [m.to_dict() for m in db.get_room_messages("BENCH")])
+    dicts = best_of(lambda: db.get_room_message_dicts("BENCH"))
+    print("SQLite get_room_messages + to_dict vs get_room_message_dicts:")
+    print(f"  Message objects:            {rows * 1000:8.1f} ms")
+    print(f"  dicts:                      {dicts * 1000:8.1f} ms ({rows / dicts:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Microbenchmark for the markup and url linking steps of parse_message().
+
+Compares the old formatter, which compiled its patterns on every call and applied each match with a
+global str.replace, against markup_str() and link_urls() in application/utils.py, which apply
+precompiled patterns in one pass each. Both are timed on a short chat message and on long messages
+full of links. The old url regex had nested quantifiers, so the time it takes on text like
+"http://" followed by punctuation doubles with every character, and the time it takes on a long run of
+"a.a.a." grows with the square of its length. Both are timed on those inputs as well.
+
+Usage (from the repository root):
+    python -m benchmarks.message_formatting [--repeat 200]
+
+Results on a Linux container (Python 3.11, --repeat 1000):
+
+    input                                     old        new
+    short message                           5.8us      1.4us
+    short message with a link               5.4us      6.1us
+    long message, 40 links (3 KB)         298.5us    235.3us
+    long message, 200 links (17 KB)      4255.6us   1242.2us
+    "http://" + 18 dots                   21.33ms     0.01ms
+    "http://" + 22 dots                  328.29ms     0.04ms
+    "a." * 2000 + " /"                   243.56ms     0.43ms
+    "a." * 8000 + " /"                  4753.70ms     2.07ms
+
+A short message with a link costs about the same, since building the link dominates both. The old
+formatter's time grows faster than the number of links, because every link rescans the whole message.
+"""
+import argparse
+import random
+import re
+import time
+
+
+WORDS = "the a to and of you it is that in for on this be have with are not just was but so what like lol ok".split()
+LINKS = [
+    "https://example.com/page?id={}",
+    "http://en.wikipedia.org/wiki/Python_(programming_language)#{}",
+    "www.example.org/docs/{}/index.html",
+    "github.com/user/repo/issues/{}",
+    "https://example.com/search?q=chat&amp;page={}."
+]
+
+
+def legacy_markup_str(content: str, markup_chars: str, query_chars: str, replace_with: list):
+    # The formatter from before the patterns were precompiled, kept here as the baseline
+    regex = re.compile(f'{markup_chars}(.*?){markup_chars}')
+    for result in regex.findall(content):
+        replace_str = query_chars + result + query_chars
+        new_str = replace_with[0] + result + replace_with[1]
+        content = content.replace(replace_str, new_str)
+    return content
+
+def legacy_format(content: str):
+    content = legacy_markup_str(content, r'\*\*', "**", ["<b>", "</b>"])
+    content = legacy_markup_str(content, r'\*', "*", ["<i>", "</i>"])
+    content = legacy_markup_str(content, r'\_\_', "__", ["<u>", "</u>"])
+    urlRegex = re.compile(r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))")
+    for result in urlRegex.findall(content):
+        content = content.replace(result[0], f'<a href="{result[0]}" target="_blank">{result[0]}</a>')
+    return content
+
+
+def make_message(links: int, rng):
+    # No link is repeated or the start of another, since the old formatter wraps those more than once
+    parts = []
+    for i in range(links):
+        parts.extend(rng.choice(WORDS) for _ in range(rng.randint(5, 15)))
+        parts.append(rng.choice(LINKS).format(f"{i:04d}"))
+        if rng.random() < 0.2:
+            parts.append(f"**{rng.choice(WORDS)}**")
+    return " ".join(parts)
+
+
+def best_of(func, content: str, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="The number of times each input is formatted")
+    args = parser.parse_args()
+
+    from application.utils import link_urls
+    from application.utils import markup_str
+
+    def new_format(content: str):
+        return link_urls(markup_str(content))
+
+    rng = random.Random(42)
+    long_message = make_message(40, rng)
+    longer_message = make_message(200, rng)
+    inputs = [
+        ("short message", "haha that is **so** good, see you at the game tonight", args.repeat, "us"),
+        ("short message with a link", "check out https://example.com/page it is **so** good", args.repeat, "us"),
+        (f"long message, 40 links ({len(long_message) // 1000} KB)", long_message, args.repeat, "us"),
+        (f"long message, 200 links ({len(longer_message) // 1000} KB)", longer_message, args.repeat // 10, "us"),
+        ('"http://" + 18 dots', "http://" + "." * 18 + " ", 3, "ms"),
+        ('"http://" + 22 dots', "http://" + "." * 22 + " ", 1, "ms"),
+        ('"a." * 2000 + " /"', "a." * 2000 + " /", 3, "ms"),
+        ('"a." * 8000 + " /"', "a." * 8000 + " /", 1, "ms")
+    ]
+
+    print(f"{'input':<34} {'old':>10} {'new':>10}")
+    for name, content, repeat, unit in inputs:
+        assert legacy_format(content) == new_format(content)
+        scale, digits = (1e6, 1) if unit == "us" else (1e3, 2)
+        old = best_of(legacy_format, content, max(repeat, 1)) * scale
+        new = best_of(new_format, content, max(repeat, 1)) * scale
+        print(f"{name:<34} {old:>8.{digits}f}{unit} {new:>8.{digits}f}{unit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Load generator that measures the message throughput and delivery latency of the Socket.IO server.
+
+Starts wsgi.py for every ASYNC_MODE against a local store, logs in N simulated users spread over M
+rooms and connects each one over a websocket. Every client then sends a steady stream of operations
+through the same events as the browser: "send message", "on message edit", "on message delete" and
+"client connected". Each operation is tagged so that every client in the room can time how long it took
+to arrive as a "new message", "message edited" or "message deleted" event, including the events batched
+by the coalescer. A "client connected" is answered with an "after connection" event holding the newest
+messages of the room, which only the client that asked receives. For every mode it reports:
+
+- the operations sent per second and the deliveries received per second
+- the p50/p99 delivery latency of each kind of operation, from the emit to each client in the room
+- the deliveries that never arrived, such as those dropped by the ratelimits or the outbound queue guard
+- the CPU time used by the server process and its resident memory
+
+The store is a temporary SQLite database by default. `--mongo-uri` runs against a local mongod
+instead, which should be a throwaway instance since the benchmark writes to the app's database.
+mongomock cannot be used, since it only lives inside one process and the server runs in its own.
+
+Each user is ratelimited like a real one, so keep `--rate` under the limits in config.py or pass
+`--no-ratelimit` to measure the raw capacity of the server. The clients run in this process and need
+the `requests` and `websocket-client` packages. `--output` writes the results as JSON, along with the
+settings and commit they were measured with, so that runs can be compared between releases.
+
+Usage (from the repository root):
+    python -m benchmarks.socket_load [--clients 100] [--rooms 10] [--duration 30] [--rate 1]
+        [--modes threading eventlet gevent] [--output results.json]
+
+Results with 100 clients in 10 rooms each sending 1 operation per second for 20s, on a Linux container
+with one CPU (Python 3.11, SQLite, eventlet 0.41, gevent 26.9), with the clients on the same machine:
+
+    mode          ops/s  deliv/s  msg p50  msg p99  edit p99  del p99  join p99  lost    cpu      rss
+    threading     100.0    957.7    6.2ms   34.9ms    28.5ms   44.6ms    26.6ms     0  20.8%   72.6MB
+    eventlet      100.0    957.4    6.3ms   44.0ms    60.1ms   37.5ms    61.2ms     0  21.6%   73.8MB
+    gevent        100.0    957.7    6.8ms   57.1ms    43.2ms   50.7ms    52.9ms     0  21.3%   71.0MB
+
+5% of the operations were joins, which are delivered to one client instead of the whole room, so fewer
+deliveries are made per operation than with messages alone.
+
+With 200 clients the latencies grew to tens of seconds and a third (eventlet, gevent) to two thirds
+(threading) of the deliveries had not arrived by the end of the drain, while the server used under 60%
+of the CPU. The client threads in this process took the rest of the single core, so run the clients on
+another machine to find the limit of the server.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import socketio
+
+from benchmarks.concurrent_connections import free_port
+from benchmarks.concurrent_connections import login
+from benchmarks.concurrent_connections import percentile
+from benchmarks.concurrent_connections import server_rss_mb
+from benchmarks.concurrent_connections import start_server
+
+
+# The operations a client sends and the events they are delivered as
+OPERATIONS = ["send", "edit", "delete", "join"]
+# Messages are tagged with "m<client>x<seq>" and edits with "e<client>x<seq>"
+TAG_REGEX = re.compile(r"\b([me]\d+x\d+)\b")
+FILLER = "the quick brown fox jumps over the lazy dog ".split()
+
+
+def create_users(env: dict, usernames: list):
+    # Add every user with one separate process so that this process does not load the app's config
+    code = (
+        "import sys; from application.database import DataBase; from application.user import User; "
+        "db = DataBase(); [db.add_user(User(u, u, 0)) for u in sys.argv[1:]]; db.close()"
+    )
+    subprocess.run([sys.executable, "-c", code, *usernames], env=dict(os.environ, ASYNC_MODE="threading", **env), check=True)
+
+
+def server_cpu_seconds(pid: int):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The fields after the process name, which may contain spaces, start at the state
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError):
+        return float("nan")
+
+
+class LoadStats:
+
+    def __init__(self):
+        self.sent = dict.fromkeys(OPERATIONS, 0)
+        self.expected = dict.fromkeys(OPERATIONS, 0)
+        self.latencies = {op: [] for op in OPERATIONS}
+        self.resyncs = 0
+        self.last_delivery = None
+        self._pending = {} # tag -> [operation, time sent, deliveries left]
+        self._lock = threading.Lock()
+
+    def sending(self, op: str, tag: str, recipients: int):
+        # Called before the event is emitted so that no delivery can arrive before it is tracked
+        with self._lock:
+            self.sent[op] += 1
+            self.expected[op] += recipients
+            self._pending[tag] = [op, time.perf_counter(), recipients]
+
+    def delivered(self, tag: str):
+        now = time.perf_counter()
+        with self._lock:
+            pending = self._pending.get(tag)
+            if pending is None:
+                return
+            op, sent_at, left = pending
+            self.latencies[op].append(now - sent_at)
+            self.last_delivery = now
+            if left == 1:
+                del self._pending[tag]
+            else:
+                pending[2] = left - 1
+
+    def resynced(self):
+        with self._lock:
+            self.resyncs += 1
+
+    def waiting(self):
+        with self._lock:
+            return len(self._pending)
+
+
+class LoadClient:
+
+    def __init__(self, index: int, url: str, cookie: str, stats: LoadStats, message_size: int, seed: int):
+        self.index = index
+        self.url = url
+        self.cookie = cookie
+        self.stats = stats
+        self.message_size = message_size
+        self.rng = random.Random(seed)
+        self.room_code = None
+        self.room = None # The clients in the same room, including this one
+        self.user = None
+        self.seq = 0
+        self.own_tags = set() # Tags of the messages sent by this client that have not arrived yet
+        self.own_ids = [] # Ids of the messages sent by this client that can be edited or deleted
+        self.join_tags = deque() # Tags of the joins sent by this client, which are answered in order
+        self.sio = socketio.Client(reconnection=False)
+        self.bootstrapped = threading.Event()
+        self.sio.on("bootstrap", self.on_bootstrap)
+        self.sio.on("new message", self.on_new_message)
+        self.sio.on("message edited", self.on_message_edited)
+        self.sio.on("message deleted", self.on_message_deleted)
+        self.sio.on("after connection", self.on_after_connection)
+        self.sio.on("events", self.on_events)
+        self.sio.on("resync", self.on_resync)
+
+    def connect(self, timeout: float):
+        try:
+            self.sio.connect(self.url, headers={"Cookie": self.cookie}, transports=["websocket"], wait_timeout=timeout)
+        except Exception:
+            return False
+        return self.bootstrapped.wait(timeout)
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+    def on_bootstrap(self, data):
+        self.user = data["user"]
+        self.room_code = data["room_code"]
+        self.bootstrapped.set()
+
+    def on_new_message(self, data):
+        match = TAG_REGEX.search(data["content"])
+        if match is None:
+            return
+        tag = match.group(1)
+        if tag in self.own_tags:
+            self.own_ids.append(data["msg_id"])
+            self.own_tags.discard(tag)
+        self.stats.delivered(tag)
+
+    def on_message_edited(self, data):
+        match = TAG_REGEX.search(str(data["new_content"]))
+        if match is not None:
+            self.stats.delivered(match.group(1))
+
+    def on_message_deleted(self, data):
+        self.stats.delivered(f"d{data['msg_id']}")
+
+    def on_after_connection(self, data):
+        # The reply holds no tag, but a client's joins are answered in the order they were sent
+        try:
+            tag = self.join_tags.popleft()
+        except IndexError:
+            return
+        self.stats.delivered(tag)
+
+    def on_events(self, events):
+        # Events batched by the coalescer or the outbound queue guard
+        handlers = {
+            "new message": self.on_new_message,
+            "message edited": self.on_message_edited,
+            "message deleted": self.on_message_deleted,
+            "after connection": self.on_after_connection
+        }
+        for e in events:
+            handler = handlers.get(e["event"])
+            if handler is not None:
+                handler(e["data"])
+
+    def on_resync(self):
+        # The server dropped events because this client fell behind, which shows up as lost deliveries
+        self.stats.resynced()
+
+    def run(self, start: float, duration: float, rate: float, edit_ratio: float, delete_ratio: float, join_ratio: float):
+        # Send operations at a steady rate, starting at a random offset so that the clients are spread out
+        interval = 1 / rate
+        next_op = start + self.rng.random() * interval
+        while True:
+            delay = next_op - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if next_op >= start + duration:
+                return
+            self.send_operation(edit_ratio, delete_ratio, join_ratio)
+            next_op += interval
+
+    def send_operation(self, edit_ratio: float, delete_ratio: float, join_ratio: float):
+        self.seq += 1
+        roll = self.rng.random()
+        try:
+            if roll < join_ratio:
+                tag = f"j{self.index}x{self.seq}"
+                self.join_tags.append(tag)
+                self.stats.sending("join", tag, 1)
+                self.sio.emit("client connected")
+            elif self.own_ids and roll < join_ratio + edit_ratio:
+                tag = f"e{self.index}x{self.seq}"
+                self.stats.sending("edit", tag, len(self.room))
+                self.sio.emit("on message edit", {"msg_id": self.rng.choice(self.own_ids), "new_content": f"edited {tag}"})
+            elif self.own_ids and roll < join_ratio + edit_ratio + delete_ratio:
+                msg_id = self.own_ids.pop(self.rng.randrange(len(self.own_ids)))
+                self.stats.sending("delete", f"d{msg_id}", len(self.room))
+                self.sio.emit("on message delete", {"msg_id": msg_id})
+            else:
+                tag = f"m{self.index}x{self.seq}"
+                self.own_tags.add(tag)
+                self.stats.sending("send", tag, len(self.room))
+                self.sio.emit("send message", {
+                    "content": self.make_content(tag),
+                    "author_id": self.user["user_id"],
+                    "author_username": self.user["username"],
+                    "room_code": self.room_code,
+                    "replying_to": 0
+                })
+        except Exception:
+            # The socket was disconnected, so the operation is counted as lost
+            pass
+
+    def make_content(self, tag: str):
+        words = [tag]
+        length = len(tag)
+        while length < self.message_size:
+            word = self.rng.choice(FILLER)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+
+def summarize(values: list):
+    if not values:
+        return {"count": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2)
+    }
+
+
+def run_mode(mode: str, args):
+    tmp = tempfile.mkdtemp()
+    db_env = {"DB_BACKEND": "sqlite", "SQLITE_PATH": os.path.join(tmp, "bench.db")}
+    if args.mongo_uri:
+        db_env = {"DB_BACKEND": "mongo", "DB_CONNECTION_STRING": args.mongo_uri}
+    server_env = dict(db_env)
+    if args.no_ratelimit:
+        for name in ["MESSAGE", "EDIT", "DELETE"]:
+            server_env[f"RATELIMIT_{name}_RATE"] = "1000000"
+            server_env[f"RATELIMIT_{name}_BURST"] = "1000000"
+
+    # Every client is its own user, so that each one has its own ratelimit
+    run_id = random.randrange(16 ** 6)
+    usernames = [f"load{run_id:06x}_{i}" for i in range(args.clients)]
+    create_users(db_env, usernames)
+    port = free_port()
+    server = start_server(mode, port, db_env.get("SQLITE_PATH", ""), server_env)
+    url = f"http://127.0.0.1:{port}"
+    stats = LoadStats()
+    clients = []
+    try:
+        # Log in every user to its room and connect them all before any load is sent
+        rooms = {}
+        with ThreadPoolExecutor(max_workers=args.batch) as pool:
+            def connect(i):
+                room_code = f"LOAD{i % args.rooms}"
+                client = LoadClient(i, url, login(url, usernames[i], usernames[i], room_code), stats, args.message_size, args.seed + i)
+                return room_code, client, client.connect(args.timeout)
+            for room_code, client, connected in pool.map(connect, range(args.clients)):
+                if connected:
+                    clients.append(client)
+                    rooms.setdefault(room_code, []).append(client)
+                else:
+                    client.close()
+        for client in clients:
+            client.room = rooms[client.room_code]
+
+        # Send the load from one thread per client, measuring the server over the same window
+        cpu_before = server_cpu_seconds(server.pid)
+        peak_rss = server_rss_mb(server.pid)
+        start = time.perf_counter() + 0.5
+        threads = [
+            threading.Thread(
+                target=c.run, args=(start, args.duration, args.rate, args.edit_ratio, args.delete_ratio, args.join_ratio), daemon=True
+            )
+            for c in clients
+        ]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+            peak_rss = max(peak_rss, server_rss_mb(server.pid))
+        # Give the deliveries that are still in flight time to arrive
+        drain_deadline = time.perf_counter() + args.drain
+        while stats.waiting() and time.perf_counter() < drain_deadline:
+            time.sleep(0.1)
+        end = stats.last_delivery or time.perf_counter()
+        cpu_seconds = server_cpu_seconds(server.pid) - cpu_before
+        wall = max(end - start, args.duration)
+
+        delivered = sum(len(v) for v in stats.latencies.values())
+        expected = sum(stats.expected.values())
+        return {
+            "mode": mode,
+            "clients": len(clients),
+            "failed_clients": args.clients - len(clients),
+            "rooms": len(rooms),
+            "ops_sent": dict(stats.sent),
+            "ops_per_s": round(sum(stats.sent.values()) / args.duration, 1),
+            "deliveries": delivered,
+            "deliveries_per_s": round(delivered / wall, 1),
+            "lost_deliveries": expected - delivered,
+            "resyncs": stats.resyncs,
+            "latency": {op: summarize(stats.latencies[op]) for op in OPERATIONS},
+            "all_latency": summarize([t for v in stats.latencies.values() for t in v]),
+            "server_cpu_seconds": round(cpu_seconds, 2),
+            "server_cpu_percent": round(cpu_seconds / wall * 100, 1),
+            "server_rss_peak_mb": round(peak_rss, 1),
+            "server_rss_end_mb": round(server_rss_mb(server.pid), 1)
+        }
+    finally:
+        with ThreadPoolExecutor(max_workers=args.batch) as pool:
+            list(pool.map(lambda c: c.close(), clients))
+        server.kill()
+        server.wait()
+
+
+def format_ms(value):
+    return f"{value:.1f}ms" if value is not None else "-"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100, help="The number of simulated users")
+    parser.add_argument("--rooms", type=int, default=10, help="The number of rooms the users are spread over")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send load for")
+    parser.add_argument("--rate", type=float, default=1, help="Operations sent per second by each client")
+    parser.add_argument("--edit-ratio", type=float, default=0.1, help="The share of operations that are edits")
+    parser.add_argument("--delete-ratio", type=float, default=0.1, help="The share of operations that are deletes")
+    parser.add_argument("--join-ratio", type=float, default=0.05, help="The share of operations that ask for the room's messages")
+    parser.add_argument("--message-size", type=int, default=100, help="The length of each message in characters")
+    parser.add_argument("--modes", nargs="+", default=["threading", "eventlet", "gevent"])
+    parser.add_argument("--mongo-uri", help="Run against this local mongod instead of a temporary SQLite database")
+    parser.add_argument("--no-ratelimit", action="store_true", help="Lift the ratelimits of the message events")
+    parser.add_argument("--batch", type=int, default=50, help="The number of clients connected at once")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds a client may take to connect")
+    parser.add_argument("--drain", type=float, default=10, help="Seconds to wait for deliveries after the load stops")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'mode':<10} {'ops/s':>8} {'deliv/s':>8} {'msg p50':>8} {'msg p99':>8} {'edit p99':>9} {'del p99':>8} "
+        f"{'join p99':>9} {'lost':>5} {'cpu':>6} {'rss':>8}"
+    )
+    for mode in args.modes:
+        r = run_mode(mode, args)
+        results.append(r)
+        print(
+            f"{r['mode']:<10} {r['ops_per_s']:>8.1f} {r['deliveries_per_s']:>8.1f} {format_ms(r['latency']['send']['p50_ms']):>8} "
+            f"{format_ms(r['latency']['send']['p99_ms']):>8} {format_ms(r['latency']['edit']['p99_ms']):>9} "
+            f"{format_ms(r['latency']['delete']['p99_ms']):>8} {format_ms(r['latency']['join']['p99_ms']):>9} "
+            f"{r['lost_deliveries']:>5} {r['server_cpu_percent']:>5.1f}% "
+            f"{r['server_rss_peak_mb']:>6.1f}MB"
+        )
+
+    if args.output:
+        settings = {k: v for k, v in vars(args).items() if k not in ["output", "mongo_uri"]}
+        settings["store"] = "mongo" if args.mongo_uri else "sqlite"
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "socket_load",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "settings": settings,
+                "results": results
+            }, f, indent=2)
+        print(f"Wrote the results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
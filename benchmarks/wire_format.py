@@ -0,0 +1,98 @@
+"""Benchmark of the bytes on the wire and the encode time of the room history sent on connect.
+
+Compares the JSON packet Socket.IO sends by default against the compact wire format in
+application/wire.py: msgpack with short keys and epoch timestamps, with and without zlib. The history
+is made of realistic chat messages from a handful of authors, and each encoding is timed on the same
+payload. The sizes are those of the Socket.IO packet body, without the websocket framing.
+
+Usage (from the repository root):
+    python -m benchmarks.wire_format [--messages 50 200 1000]
+
+Results on a Linux container (Python 3.11, msgpack 1.2):
+
+    messages  format             bytes  vs json  encode
+          50  json               14340    1.00x   0.11ms
+          50  msgpack             6778    0.47x   0.04ms
+          50  msgpack+deflate     2219    0.15x   0.16ms
+         200  json               57067    1.00x   0.40ms
+         200  msgpack            26914    0.47x   0.17ms
+         200  msgpack+deflate     7736    0.14x   1.11ms
+        1000  json              282773    1.00x   1.95ms
+        1000  msgpack           132194    0.47x   0.82ms
+        1000  msgpack+deflate    35352    0.13x   8.35ms
+
+Short keys and leaving out the pretty timestamps more than halve the history and encode faster than
+JSON. zlib shrinks it to under a sixth, since usernames, room codes and words repeat from message to
+message, but costs about 4x the CPU of JSON. WIRE_COMPRESS_MIN_BYTES keeps small payloads, where
+compression saves little, uncompressed.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+
+WORDS = (
+    "the a to and of you i it is that in for on this be have with are not just was but so what like "
+    "get can do we they know if at my your all about one out up me there how when will no think go "
+    "lol ok yeah game chat room link https://example.com/page?id=42 :smile: **bold** @everyone"
+).split()
+
+
+def make_history(count: int):
+    # Messages from a few authors sent about a minute apart, in the format sent to clients
+    from application.message import message_doc_to_dict
+    rng = random.Random(42)
+    authors = [(17000000000000 + i, f"user{i}") for i in range(8)]
+    start = 1704110400
+    docs = []
+    for i in range(count):
+        author_id, author_username = rng.choice(authors)
+        docs.append(message_doc_to_dict({
+            "_id": 2 ** 50 + i * 4096,
+            "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))),
+            "author_id": author_id,
+            "author_username": author_username,
+            "timestamp": start + i * 61,
+            "room_code": "GLOBAL",
+            "replying_to": 2 ** 50 + (i - 1) * 4096 if i > 0 and rng.random() < 0.1 else 0
+        }))
+    return {"messages": docs, "public_rooms": ["Suggestions", "Feedback"], "has_more": True, "watermark": 1704110400000}
+
+
+def best_of(func, repeat: int=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, nargs="+", default=[50, 200, 1000], help="The history sizes to encode")
+    args = parser.parse_args()
+
+    os.environ["COMPACT_WIRE"] = "true"
+    from application import wire
+
+    print(f"{'messages':>8}  {'format':<16} {'bytes':>7}  vs json  encode")
+    for count in args.messages:
+        history = make_history(count)
+        # Socket.IO sends the event name and its data as a compact JSON array
+        encodings = [
+            ("json", lambda: json.dumps(["bootstrap", history], separators=(",", ":")).encode("utf-8")),
+            ("msgpack", lambda: wire.encode_room_data(history, "msgpack")),
+            ("msgpack+deflate", lambda: wire.encode_room_data(history, "msgpack+deflate"))
+        ]
+        json_size = None
+        for name, encode in encodings:
+            seconds, payload = best_of(encode)
+            json_size = json_size or len(payload)
+            print(f"{count:>8}  {name:<16} {len(payload):>7}  {len(payload) / json_size:6.2f}x  {seconds * 1000:5.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,124 @@ class Config:
 
     # Load environment variables
     DB_CONNECTION_STRING = os.getenv("DB_CONNECTION_STRING")
-    DEBUG = os.getenv("DEBUG")
+    DEBUG = os.getenv("DEBUG", "false").lower() == "true"
     HOST = os.getenv("HOST")
-    PORT = os.getenv("PORT")
+    PORT = int(os.getenv("PORT", 5000))
     SECRET_KEY = os.getenv("SECRET_KEY")
-    SITE_URL = os.getenv("SITE_URL")
\ No newline at end of file
+    SITE_URL = os.getenv("SITE_URL")
+
+    # Database connection pool settings. These are shared by every DataBase instance in the process
+    DB_MAX_POOL_SIZE = int(os.getenv("DB_MAX_POOL_SIZE", 50))
+    DB_MIN_POOL_SIZE = int(os.getenv("DB_MIN_POOL_SIZE", 0))
+    DB_MAX_IDLE_TIME_MS = int(os.getenv("DB_MAX_IDLE_TIME_MS", 60000))
+    DB_CONNECT_TIMEOUT_MS = int(os.getenv("DB_CONNECT_TIMEOUT_MS", 5000))
+    DB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("DB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+    DB_SOCKET_TIMEOUT_MS = int(os.getenv("DB_SOCKET_TIMEOUT_MS", 10000))
+
+    # The number of messages sent to clients when they join a room and in each page of older messages
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 50))
+    HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 100))
+
+    # Reconnecting clients are only sent the messages, edits and deletes they missed if they were away for
+    # less than RESYNC_MAX_AGE seconds. Deleted message ids are kept for this long to make that possible
+    RESYNC_MAX_AGE = int(os.getenv("RESYNC_MAX_AGE", 24 * 60 * 60))
+
+    # Limits for the in-memory cache of the newest messages in recently used rooms. Setting the number
+    # of messages per room to 0 disables the cache
+    RECENT_CACHE_ROOMS = int(os.getenv("RECENT_CACHE_ROOMS", 1000))
+    RECENT_CACHE_MESSAGES_PER_ROOM = int(os.getenv("RECENT_CACHE_MESSAGES_PER_ROOM", 200))
+    RECENT_CACHE_MAX_MESSAGES = int(os.getenv("RECENT_CACHE_MAX_MESSAGES", 100000))
+
+    # Write-behind queue for new messages. When enabled, messages are broadcast before they are written
+    # and are inserted into the database in batches by a background thread. Only a single worker can use
+    # it, since an edit or delete handled by another worker could be applied before the message is written,
+    # so the app refuses to start with WRITE_BEHIND and WORKERS > 1 or a MESSAGE_QUEUE
+    WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+    WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", 50))
+    WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+    WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", 5))
+    WRITE_BEHIND_RETRY_BACKOFF_MS = int(os.getenv("WRITE_BEHIND_RETRY_BACKOFF_MS", 100))
+
+    # The storage backend, either "mongodb" or "sqlite", and the settings for the SQLite backend
+    DB_BACKEND = os.getenv("DB_BACKEND", "mongodb").lower()
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "database.db")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+    # The id of this worker process, from 0 to 31. Every process that writes to the same database must
+    # use a different worker id so that the message and user ids they generate cannot collide
+    WORKER_ID = int(os.getenv("WORKER_ID", 0))
+
+    # Limits for the cache of users looked up by their id
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))
+
+    # The server mode, either "threading" (the Werkzeug server, for development), "eventlet" or "gevent".
+    # Blocking database calls are run on a bounded executor so that a slow query only holds up the
+    # socket that made it. Setting the executor size to 0 runs the calls inline
+    ASYNC_MODE = os.getenv("ASYNC_MODE", "threading").lower()
+    DB_EXECUTOR_SIZE = int(os.getenv("DB_EXECUTOR_SIZE", 20))
+
+    # The maximum number of connections served at once by the eventlet and gevent servers. Every open
+    # socket holds a connection, so this caps the number of connected clients
+    MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 10000))
+
+    # The message queue that shares Socket.IO events between workers, so that clients connected to any
+    # worker receive every message. Leave this empty for a single worker, use "unix://<socket path>" for
+    # the broker in application/broker.py, or a "redis://" URL. workers.py starts WORKERS workers that
+    # share the port and the broker
+    MESSAGE_QUEUE = os.getenv("MESSAGE_QUEUE", "")
+    WORKERS = int(os.getenv("WORKERS", 1))
+
+    # Where the public rooms and claim codes are kept, either "memory" for a single worker or
+    # "database" to share them between workers through the database. Claim codes expire after CLAIM_CODE_TTL
+    # seconds
+    STATE_BACKEND = os.getenv("STATE_BACKEND", "database" if MESSAGE_QUEUE else "memory").lower()
+    CLAIM_CODE_TTL = int(os.getenv("CLAIM_CODE_TTL", 7 * 24 * 60 * 60))
+
+    # Coalescing of the new, edited and deleted message events sent to each room. Events are held back until
+    # the room has been quiet for COALESCE_WINDOW_MS, for at most COALESCE_MAX_DELAY_MS, and are then sent in
+    # one "events" packet of at most COALESCE_MAX_BATCH events. A window of 0 sends every event right away
+    COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", 0))
+    COALESCE_MAX_DELAY_MS = float(os.getenv("COALESCE_MAX_DELAY_MS", 100))
+    COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", 100))
+
+    # The compact wire format for the room data sent to each socket, such as the history sent on connect.
+    # Clients that support it are sent msgpack with short keys and epoch timestamps, and payloads of at least
+    # WIRE_COMPRESS_MIN_BYTES are compressed with zlib if the client can inflate them. Needs the msgpack package
+    COMPACT_WIRE = os.getenv("COMPACT_WIRE", "false").lower() == "true"
+    WIRE_COMPRESS_MIN_BYTES = int(os.getenv("WIRE_COMPRESS_MIN_BYTES", 1024))
+    WIRE_COMPRESS_LEVEL = int(os.getenv("WIRE_COMPRESS_LEVEL", 6))
+
+    # The number of packets that can be waiting to be sent to one socket before it is treated as a slow
+    # consumer, and what happens to it then: "resync" drops its packets and has it reconnect once it has
+    # caught up, "coalesce" holds its events back and sends them in one packet, and "disconnect" closes it.
+    # A limit of 0 lets the queues grow without a limit
+    OUTBOUND_QUEUE_LIMIT = int(os.getenv("OUTBOUND_QUEUE_LIMIT", 500))
+    SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "resync").lower()
+
+    # The Socket.IO and Engine.IO servers can log every packet, which slows them down under load. PACKET_LOGGING
+    # is "all", "sampled" to log a random PACKET_LOG_SAMPLE_RATE of the packets, or "off" to only log errors
+    PACKET_LOGGING = os.getenv("PACKET_LOGGING", "all" if DEBUG else "off").lower()
+    PACKET_LOG_SAMPLE_RATE = float(os.getenv("PACKET_LOG_SAMPLE_RATE", 0.01))
+
+    # The token scrapers have to send as a bearer token to read /metrics. Leave this empty to let anyone read it
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # The longest CPU profile superusers can take through /admin/profile, in seconds
+    PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+
+    # Token bucket ratelimits of the socket events sent by users. Each RATE is the number of events allowed
+    # per second over time, and each BURST is the number of events that can be sent at once. Idle buckets
+    # are removed every RATELIMIT_SWEEP_INTERVAL seconds, and at most RATELIMIT_MAX_ENTRIES are kept. With a
+    # "database" STATE_BACKEND the buckets are kept in the database instead, so that every worker shares them
+    RATELIMIT_MESSAGE_RATE = float(os.getenv("RATELIMIT_MESSAGE_RATE", 4))
+    RATELIMIT_MESSAGE_BURST = int(os.getenv("RATELIMIT_MESSAGE_BURST", 8))
+    RATELIMIT_EDIT_RATE = float(os.getenv("RATELIMIT_EDIT_RATE", 1))
+    RATELIMIT_EDIT_BURST = int(os.getenv("RATELIMIT_EDIT_BURST", 5))
+    RATELIMIT_DELETE_RATE = float(os.getenv("RATELIMIT_DELETE_RATE", 2))
+    RATELIMIT_DELETE_BURST = int(os.getenv("RATELIMIT_DELETE_BURST", 10))
+    RATELIMIT_ROOM_STATUS_RATE = float(os.getenv("RATELIMIT_ROOM_STATUS_RATE", 0.5))
+    RATELIMIT_ROOM_STATUS_BURST = int(os.getenv("RATELIMIT_ROOM_STATUS_BURST", 3))
+    RATELIMIT_SWEEP_INTERVAL = int(os.getenv("RATELIMIT_SWEEP_INTERVAL", 60))
+    RATELIMIT_MAX_ENTRIES = int(os.getenv("RATELIMIT_MAX_ENTRIES", 100000))
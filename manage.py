@@ -22,9 +22,12 @@ elif action == 1:
     user_type = int(input("Type the user type, 1 for superuser and 0 for regular user: "))
     u = User(username, password, user_type)
     db = DataBase()
-    db.add_user(u)
+    added = db.add_user(u)
     db.close()
-    print(f"Success. User created with username `{username}`, password `{password}`, user type `{u.user_type}`, and user id `{u.user_id}`.")
+    if not added:
+        print(f"A user with the username `{username}` already exists.")
+    else:
+        print(f"Success. User created with username `{username}`, password `{password}`, user type `{u.user_type}`, and user id `{u.user_id}`.")
 elif action == 2:
     username = input("Type the user's username: ")
     db = DataBase()
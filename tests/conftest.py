@@ -0,0 +1,8 @@
+import os
+import sys
+
+
+# The tests import the app the same way wsgi.py does, from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
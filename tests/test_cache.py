@@ -0,0 +1,61 @@
+"""Tests of the loads of RecentMessageCache racing with writes to the room being loaded."""
+from application.cache import RecentMessageCache
+
+
+def message(msg_id: int):
+    return {"msg_id": msg_id, "content": f"message {msg_id}"}
+
+
+def test_load_is_cached():
+    cache = RecentMessageCache()
+    version = cache.begin_load("R")
+    cache.finish_load("R", [message(1)], False, version)
+    assert cache.get("R", 5) == [message(1)]
+
+
+def test_load_is_not_cached_after_a_write():
+    cache = RecentMessageCache()
+    version = cache.begin_load("R")
+    cache.add("R", message(2))
+    cache.finish_load("R", [message(1)], False, version)
+    assert cache.get("R", 5) is None
+
+
+def test_overlapping_loads_keep_the_write_between_them():
+    cache = RecentMessageCache()
+    first = cache.begin_load("R")
+    cache.add("R", message(2))
+    second = cache.begin_load("R")
+    # The first load missed message 2, so it is not cached
+    cache.finish_load("R", [message(1)], False, first)
+    assert cache.get("R", 5) is None
+    # The second load began after message 2 was written, so it saw it
+    cache.finish_load("R", [message(1), message(2)], False, second)
+    assert cache.get("R", 5) == [message(1), message(2)]
+
+
+def test_overlapping_loads_finished_in_reverse_order():
+    cache = RecentMessageCache()
+    first = cache.begin_load("R")
+    cache.add("R", message(2))
+    second = cache.begin_load("R")
+    cache.finish_load("R", [message(1), message(2)], False, second)
+    cache.finish_load("R", [message(1)], False, first)
+    assert cache.get("R", 5) == [message(1), message(2)]
+
+
+def test_edits_and_deletes_invalidate_every_load():
+    cache = RecentMessageCache()
+    for write in (lambda: cache.edit(1, "edited"), lambda: cache.remove([1]), cache.clear):
+        version = cache.begin_load("R")
+        write()
+        cache.finish_load("R", [message(1)], False, version)
+        assert cache.get("R", 5) is None
+
+
+def test_failed_load_is_no_longer_tracked():
+    cache = RecentMessageCache()
+    version = cache.begin_load("R")
+    cache.finish_load("R", None, False, version)
+    assert cache.get("R", 5) is None
+    assert not cache._loading
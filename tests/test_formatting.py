@@ -0,0 +1,186 @@
+"""Golden tests of the message formatting in application/utils.py, and a comparison against the old
+formatter in benchmarks/message_formatting.py, which markup_str() and link_urls() replaced.
+
+The old formatter applied every match with a global str.replace, so it wrapped text in more than one
+place when the text of a match appeared anywhere else in the message. The comparison skips the inputs
+where that happens, and the new formatter must give the same output as the old one on every other input.
+"""
+import random
+import re
+import time
+
+import pytest
+from markupsafe import Markup
+
+from application.utils import URL_REGEX
+from application.utils import link_urls
+from application.utils import markup_str
+from application.utils import replace_emojis
+from benchmarks.message_formatting import legacy_format
+from benchmarks.message_formatting import legacy_markup_str
+
+
+# The number of seconds a pathological input may take to format
+TIME_BOUND = 1
+# The old url regex takes exponential time on long runs of punctuation, so the compared inputs are kept short
+FUZZ_INPUTS = 20000
+FUZZ_MAX_LENGTH = 16
+FUZZ_TOKENS = [
+    "http://", "https://", "HTTP://", "www.", "www12.", "a", "b", "Com", "com", ".", "..", "/", "-", "_",
+    "(", ")", "((", "))", " ", "<", ">", "é", "x.com/", "ex.org/p", "!", ",", "&", ":", "**", "*", "__",
+    "K", "?", "\n", "'", "1"
+]
+# The arguments the old formatter passed to legacy_markup_str(), in the order it applied them
+OLD_MARKUP_PATTERNS = [
+    (r"\*\*", "**", ["<b>", "</b>"]),
+    (r"\*", "*", ["<i>", "</i>"]),
+    (r"\_\_", "__", ["<u>", "</u>"])
+]
+
+
+def link(url: str):
+    return f'<a href="{url}" target="_blank">{url}</a>'
+
+
+def format_message(content: str):
+    return link_urls(markup_str(content))
+
+
+@pytest.mark.parametrize("content, expected", [
+    # Nested markup
+    ("**a *b* c**", "<b>a <i>b</i> c</b>"),
+    ("*a **b** c*", "<i>a <b>b</b> c</i>"),
+    ("__a **b** c__", "<u>a <b>b</b> c</u>"),
+    ("***a***", "<b><i>a</b></i>"),
+    # Overlapping markup is applied one kind at a time, in the order of MARKUP_PATTERNS
+    ("**a__b**c__", "<b>a<u>b</b>c</u>"),
+    ("*a__b*c__", "<i>a<u>b</i>c</u>"),
+    # Repeated and unclosed markup
+    ("__a__ __b__", "<u>a</u> <u>b</u>"),
+    ("a**b**c**d", "a<b>b</b>c<i></i>d"),
+    ("****", "<b></b>"),
+    ("**a", "<i></i>a"),
+    ("*a", "*a"),
+    ("_a_", "_a_"),
+    # Markup does not span lines
+    ("**a\nb**", "<i></i>a\nb<i></i>"),
+    ("plain text", "plain text"),
+    ("", "")
+])
+def test_markup_str(content, expected):
+    assert markup_str(content) == expected
+
+
+@pytest.mark.parametrize("content, expected", [
+    # Repeated urls are linked once at each place they appear
+    ("see https://a.com/x and https://a.com/x", f"see {link('https://a.com/x')} and {link('https://a.com/x')}"),
+    ("https://a.com/x https://a.com/xy", f"{link('https://a.com/x')} {link('https://a.com/xy')}"),
+    # Wikipedia style parentheses
+    (
+        "http://en.wikipedia.org/wiki/Python_(programming_language)",
+        link("http://en.wikipedia.org/wiki/Python_(programming_language)")
+    ),
+    ("http://en.wikipedia.org/wiki/Foo_(bar_(baz))", link("http://en.wikipedia.org/wiki/Foo_(bar_(baz))")),
+    ("(see http://x.com/a)", f"(see {link('http://x.com/a')})"),
+    ("(www.a.com)", f"({link('www.a.com')})"),
+    ("https://a.com/(b))", f"{link('https://a.com/(b)')})"),
+    # Trailing punctuation is not part of the url
+    ("go to https://example.com/page.", f"go to {link('https://example.com/page')}."),
+    ("https://example.com/page?q=1!", f"{link('https://example.com/page?q=1')}!"),
+    ("https://a.com/b.)", f"{link('https://a.com/b')}.)"),
+    ("https://a.com/?x=1&amp;y=2;", f"{link('https://a.com/?x=1&amp;y=2')};"),
+    # www and domain name urls
+    ("is it www.example.com?", f"is it {link('www.example.com')}?"),
+    ("www2.example.org", link("www2.example.org")),
+    ("example.com/path, then", f"{link('example.com/path')}, then"),
+    ("a.b.example.co/x1", link("a.b.example.co/x1")),
+    # A domain name is only a url with a slash and at least two characters after it
+    ("example.com and example.com/", "example.com and example.com/"),
+    ("x.com/a", "x.com/a"),
+    ("foo.bar", "foo.bar"),
+    # Urls in markup
+    ("**https://a.com/b**", f"<b>{link('https://a.com/b')}</b>"),
+    ("no links here </b>", "no links here </b>")
+])
+def test_link_urls(content, expected):
+    assert format_message(content) == expected
+
+
+@pytest.mark.parametrize("content", [
+    "http://" + "." * 20000 + " ",
+    "http://" + "!" * 20000,
+    "a." * 50000 + " /",
+    "a." * 50000 + " example.com/ab"
+], ids=["http dots", "http exclamation marks", "a dots", "a dots then a url"])
+def test_pathological_urls_are_formatted_in_time(content):
+    start = time.perf_counter()
+    formatted = format_message(content)
+    assert time.perf_counter() - start < TIME_BOUND
+    # Only the url at the end of the long run of "a." is linked
+    if content.endswith("example.com/ab"):
+        assert formatted == content[:-len("example.com/ab")] + link("example.com/ab")
+    else:
+        assert formatted == content
+
+
+@pytest.mark.parametrize("content, expected", [
+    (":smile:", "😄"),
+    # Emoji names are not case sensitive
+    (":SMILE:", "😄"),
+    (":Smile:", "😄"),
+    # Adjacent emojis
+    (":smile::smile:", "😄😄"),
+    ("::smile::", ":😄:"),
+    # The colon that closes an emoji cannot open another
+    (":smile:smile:", "😄smile:"),
+    # Unknown names and unclosed emojis are left as they are
+    (":nope:", ":nope:"),
+    (":nope:smile:", ":nope😄"),
+    (":smile", ":smile"),
+    ("12:30", "12:30"),
+    ("", "")
+])
+def test_replace_emojis(content, expected):
+    assert replace_emojis(content) == expected
+
+
+def old_replaces_elsewhere(content: str):
+    """Checks whether the old formatter would apply a match to text other than the text that matched.
+
+    Args:
+        content (str): The escaped message content
+
+    Returns:
+        bool: True if a match of the old formatter also appears somewhere else in the content
+    """
+    for markup_chars, query_chars, replace_with in OLD_MARKUP_PATTERNS:
+        for result in re.findall(f"{markup_chars}(.*?){markup_chars}", content):
+            if content.count(query_chars + result + query_chars) > 1:
+                return True
+        content = legacy_markup_str(content, markup_chars, query_chars, replace_with)
+    for match in URL_REGEX.finditer(content):
+        url = match.group(match.lastindex)
+        start = match.start(match.lastindex)
+        if content.find(url) != start or content.find(url, start + 1) != -1:
+            return True
+    return False
+
+
+def test_same_output_as_the_old_formatter():
+    rng = random.Random(0)
+    compared = 0
+    for _ in range(FUZZ_INPUTS):
+        content = ""
+        while rng.random() > 0.08:
+            token = rng.choice(FUZZ_TOKENS)
+            if len(content) + len(token) > FUZZ_MAX_LENGTH:
+                break
+            content += token
+        # Messages are escaped before they are formatted
+        content = str(Markup.escape(content))
+        if old_replaces_elsewhere(content):
+            continue
+        assert format_message(content) == legacy_format(content), f"{content!r} is formatted differently"
+        compared += 1
+    # Most inputs have no repeated matches, so nearly all of them are compared
+    assert compared > FUZZ_INPUTS * 0.9
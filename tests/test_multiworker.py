@@ -0,0 +1,298 @@
+"""Integration test of several workers on one machine sharing their Socket.IO events and state.
+
+Starts the broker and three workers with workers.py against a temporary SQLite database, and connects a
+websocket client for each test user. The kernel spreads the connections across the workers, and the
+worker each client landed on is read from the ids of the messages it sends, since every id holds the
+WORKER_ID of the process that generated it.
+
+Needs eventlet, requests and websocket-client, and Linux for SO_REUSEPORT.
+"""
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+requests = pytest.importorskip("requests")
+socketio = pytest.importorskip("socketio")
+pytest.importorskip("eventlet")
+pytest.importorskip("websocket")
+
+from application.snowflake import MAX_WORKER_ID
+from application.snowflake import SEQUENCE_BITS
+from application.snowflake import WORKER_ID_BITS
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="the workers share the port with SO_REUSEPORT")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKERS = 3
+ROOM_CODE = "MULTI"
+USERNAMES = ["admin"] + [f"user{i}" for i in range(8)]
+PASSWORD = "password"
+TIMEOUT = 15
+# How long to keep listening for duplicates once every client has received an event
+SETTLE_TIME = 0.5
+# The default ratelimit of new messages
+MESSAGE_RATE = 4
+MESSAGE_BURST = 8
+
+
+def worker_of(msg_id):
+    return (int(msg_id) >> SEQUENCE_BITS) & MAX_WORKER_ID
+
+
+def time_of(msg_id):
+    # The number of seconds since the snowflake epoch at which the id was generated
+    return (int(msg_id) >> (WORKER_ID_BITS + SEQUENCE_BITS)) / 1000
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def listening_sockets(port: int):
+    # Every worker opens its own listening socket on the shared port
+    count = 0
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if int(fields[1].split(":")[1], 16) == port and fields[3] == "0A":
+                        count += 1
+        except OSError:
+            pass
+    return count
+
+
+def wait_until(condition, timeout: float=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+class ChatClient:
+
+    def __init__(self, url: str, username: str):
+        self.username = username
+        # Log in with a connection of its own, and then open the socket with the session cookie
+        http = requests.Session()
+        resp = http.post(f"{url}/login", data={"username": username, "password": PASSWORD, "room_code": ROOM_CODE})
+        resp.raise_for_status()
+        cookie = "; ".join(f"{k}={v}" for k, v in http.cookies.items())
+        http.close()
+        self.events = []
+        self._lock = threading.Lock()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on("*", self._on_event)
+        self.sio.connect(url, headers={"Cookie": cookie}, transports=["websocket"], wait_timeout=TIMEOUT)
+
+    def _on_event(self, event, data=None):
+        with self._lock:
+            self.events.append((event, data))
+
+    def received(self, event: str, match=lambda data: True):
+        with self._lock:
+            return [data for e, data in self.events if e == event and match(data)]
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def receive_once(clients: list, event: str, match):
+    """Waits for every client to receive a matching event, and checks that none received it twice."""
+    assert wait_until(lambda: all(c.received(event, match) for c in clients)), (
+        f"{event} did not reach {[c.username for c in clients if not c.received(event, match)]}"
+    )
+    time.sleep(SETTLE_TIME)
+    for c in clients:
+        assert len(c.received(event, match)) == 1, f"{c.username} received {event} more than once"
+    return [c.received(event, match)[0] for c in clients]
+
+
+@pytest.fixture(scope="module")
+def cluster(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("cluster")
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        ASYNC_MODE="eventlet",
+        WORKERS=str(WORKERS),
+        MESSAGE_QUEUE=f"unix://{tmp / 'broker.sock'}",
+        DB_BACKEND="sqlite",
+        SQLITE_PATH=str(tmp / "chat.db"),
+        HOST="127.0.0.1",
+        PORT=str(port),
+        SECRET_KEY="test",
+        DEBUG="false",
+        WRITE_BEHIND="false",
+        COALESCE_WINDOW_MS="0"
+    )
+    # Add the users before the workers start, with the first one as a superuser
+    code = (
+        "import sys; from application.database import DataBase; from application.user import User; "
+        "db = DataBase(); [db.add_user(User(u, sys.argv[1], 1 if i == 0 else 0)) for i, u in enumerate(sys.argv[2:])]"
+    )
+    subprocess.run([sys.executable, "-c", code, PASSWORD] + USERNAMES, env=dict(env, WORKERS="1", MESSAGE_QUEUE=""), cwd=tmp, check=True)
+
+    # The sessions are stored in the working directory, which every worker shares
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "workers.py")], env=env, cwd=tmp)
+    try:
+        if not wait_until(lambda: listening_sockets(port) == WORKERS or process.poll() is not None, 60) or process.poll() is not None:
+            pytest.fail("The workers did not start")
+        yield {"url": f"http://127.0.0.1:{port}", "db_path": str(tmp / "chat.db")}
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+@pytest.fixture(scope="module")
+def clients(cluster):
+    clients = [ChatClient(cluster["url"], username) for username in USERNAMES]
+    admin = clients[0]
+    # Each worker connects to the broker once its first client has connected, so keep sending an event
+    # that every worker relays until every client has seen one
+    deadline = time.monotonic() + TIMEOUT
+    while not all(c.received("room status changed") for c in clients) and time.monotonic() < deadline:
+        admin.sio.emit("room status update", {"action": "Ping", "room_code": ROOM_CODE})
+        time.sleep(0.2)
+    time.sleep(SETTLE_TIME)
+    yield clients
+    for c in clients:
+        c.close()
+
+
+@pytest.fixture
+def room(clients):
+    for c in clients:
+        c.clear()
+    return clients
+
+
+def send_message(sender: ChatClient, clients: list, content: str):
+    sender.sio.emit("send message", {
+        "content": content,
+        "author_id": 0,
+        "author_username": sender.username,
+        "room_code": ROOM_CODE,
+        "replying_to": 0
+    })
+    received = receive_once(clients, "new message", lambda data: data["content"] == content)
+    return received[0]["msg_id"]
+
+
+def test_messages_reach_every_client_once(room):
+    msg_ids = {c.username: send_message(c, room, f"hello from {c.username}") for c in room}
+    # Every client has every message exactly once, with the same id
+    for c in room:
+        received = c.received("new message")
+        assert sorted(m["msg_id"] for m in received) == sorted(msg_ids.values())
+    # The messages were handled by more than one worker, so they crossed the broker
+    assert len({worker_of(msg_id) for msg_id in msg_ids.values()}) > 1
+
+
+def test_edit_and_delete_reach_every_client_once(room):
+    workers = {c.username: worker_of(send_message(c, room, f"probe from {c.username}")) for c in room}
+    sender = room[0]
+    # Edit and delete the message from clients on another worker than the one that stored it
+    others = [c for c in room if workers[c.username] != workers[sender.username]]
+    assert others, "every client connected to the same worker"
+    msg_id = send_message(sender, room, "this message will be edited")
+
+    others[0].sio.emit("on message edit", {"msg_id": msg_id, "new_content": "edited"})
+    edits = receive_once(room, "message edited", lambda data: data["msg_id"] == msg_id)
+    assert all(edit["new_content"].startswith("edited") for edit in edits)
+
+    others[-1].sio.emit("on message delete", {"msg_id": msg_id})
+    receive_once(room, "message deleted", lambda data: data["msg_id"] == msg_id)
+
+
+def test_public_rooms_are_the_same_on_every_worker(room):
+    admin = room[0]
+    for action in ("Public", "Private"):
+        admin.sio.emit("room status update", {"action": action, "room_code": "SHARED"})
+        receive_once(room, "room status changed", lambda data: data["room_code"] == "SHARED" and data["action"] == action)
+        # Ask every client's worker for the public rooms
+        for c in room:
+            c.clear()
+            c.sio.emit("client connected")
+        assert wait_until(lambda: all(c.received("after connection") for c in room))
+        for c in room:
+            public_rooms = c.received("after connection")[0]["public_rooms"]
+            assert ("SHARED" in public_rooms) == (action == "Public"), f"{c.username} sees the old status"
+
+
+def test_claim_codes_are_the_same_on_every_worker(cluster, room):
+    url = cluster["url"]
+    admin_session = requests.Session()
+    admin_session.post(f"{url}/login", data={"username": "admin", "password": PASSWORD, "room_code": ROOM_CODE})
+    admin_cookie = {"Cookie": "; ".join(f"{k}={v}" for k, v in admin_session.cookies.items())}
+    admin_session.close()
+    names = [f"claimed{i}" for i in range(12)]
+    # Every request opens a new connection, so the codes are created and claimed on different workers
+    for name in names:
+        resp = requests.post(
+            f"{url}/create_claim_code",
+            data={"claim_code": f"code-{name}", "recipient_username": name},
+            headers=dict(admin_cookie, Connection="close"),
+            allow_redirects=False
+        )
+        assert resp.status_code == 302
+    for name in names:
+        form = {"claim_code": f"code-{name}", "password": PASSWORD, "confirm_password": PASSWORD}
+        resp = requests.post(f"{url}/claim_account", data=form, headers={"Connection": "close"}, allow_redirects=False)
+        assert resp.status_code == 302, f"the claim code for {name} was not found"
+        # A claimed code cannot be used again on any worker
+        resp = requests.post(f"{url}/claim_account", data=form, headers={"Connection": "close"}, allow_redirects=False)
+        assert resp.status_code == 200
+
+    # The accounts were created by more than one worker
+    with sqlite3.connect(cluster["db_path"]) as conn:
+        user_ids = [row[0] for row in conn.execute(
+            f"SELECT user_id FROM Users WHERE username IN ({', '.join('?' * len(names))})", names
+        )]
+    assert len(user_ids) == len(names)
+    assert len({worker_of(user_id) for user_id in user_ids}) > 1
+
+
+def test_ratelimits_are_shared_between_workers(cluster, room):
+    # Open several sockets for one user, which land on different workers
+    sockets = [ChatClient(cluster["url"], "user7") for _ in range(6)]
+    try:
+        for i in range(4):
+            for j, c in enumerate(sockets):
+                c.sio.emit("send message", {
+                    "content": f"burst {i} {j}",
+                    "author_id": 0,
+                    "author_username": "user7",
+                    "room_code": ROOM_CODE,
+                    "replying_to": 0
+                })
+        admin = room[0]
+        time.sleep(2)
+        msg_ids = [m["msg_id"] for m in admin.received("new message", lambda data: data["content"].startswith("burst"))]
+    finally:
+        for c in sockets:
+            c.close()
+    # One bucket allows a burst plus what was refilled while the messages were handled, while a bucket
+    # on every worker would let through almost every message
+    assert msg_ids
+    handled_for = max(map(time_of, msg_ids)) - min(map(time_of, msg_ids))
+    assert len(msg_ids) <= MESSAGE_BURST + MESSAGE_RATE * handled_for + 1
+    assert len(msg_ids) < len(sockets) * 4
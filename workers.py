@@ -0,0 +1,77 @@
+# workers.py - Runs several wsgi.py workers that share the server port, using one core each
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from config import Config
+from application.broker import DEFAULT_SOCKET_PATH
+
+
+logger = logging.getLogger(__name__)
+
+# The path of the worker script, so that the workers can be started from any directory
+WSGI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wsgi.py")
+
+
+def main():
+    """Starts Config.WORKERS wsgi.py workers on Config.PORT. The kernel spreads new connections across
+    the workers, and the workers share their Socket.IO events through the message broker so that every
+    client receives every message. Each worker gets its own WORKER_ID so that the ids they generate
+    cannot collide. If any process exits, the others are stopped as well.
+
+    Sharing the port needs eventlet, which opens its listening socket with SO_REUSEPORT. With a single
+    worker, this runs wsgi.py on its own.
+    """
+    if Config.WORKERS <= 1:
+        os.execv(sys.executable, [sys.executable, WSGI_PATH])
+    if Config.ASYNC_MODE != "eventlet":
+        sys.exit("Running more than one worker needs ASYNC_MODE=eventlet, since only eventlet shares the port")
+    if Config.WORKERS > 32:
+        sys.exit("At most 32 workers can be run, since each worker needs its own WORKER_ID")
+    if Config.WRITE_BEHIND:
+        sys.exit("Running more than one worker needs WRITE_BEHIND=false, since each worker only sees its own queued messages")
+
+    # Start the broker unless another message queue has been configured
+    processes = []
+    message_queue = Config.MESSAGE_QUEUE or f"unix://{DEFAULT_SOCKET_PATH}"
+    if message_queue.startswith("unix://"):
+        # The broker runs from the repository root, so the workers are given the absolute path
+        socket_path = os.path.abspath(message_queue[len("unix://"):] or DEFAULT_SOCKET_PATH)
+        message_queue = f"unix://{socket_path}"
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "application.broker", socket_path], cwd=os.path.dirname(WSGI_PATH)
+        ))
+        # Give the broker a moment to listen so that the workers do not log failed connections
+        deadline = time.monotonic() + 5
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    for worker_id in range(Config.WORKERS):
+        env = dict(os.environ, MESSAGE_QUEUE=message_queue, WORKER_ID=str(worker_id), WORKERS="1")
+        processes.append(subprocess.Popen([sys.executable, WSGI_PATH], env=env))
+
+    # Stop every process when this one is stopped or when any of them exits
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    exit_code = 0
+    try:
+        while all(p.poll() is None for p in processes):
+            time.sleep(0.5)
+        exit_code = 1
+        logger.error("A worker exited, stopping the others")
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for p in processes:
+            if p.poll() is None:
+                p.terminate()
+        for p in processes:
+            p.wait()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    main()
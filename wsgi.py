@@ -1,17 +1,42 @@
+from config import Config
+
+# Make the standard library cooperative before anything else is imported when running on eventlet or
+# gevent, so that sockets and threads opened by the other imports do not block the event loop
+if Config.ASYNC_MODE == "eventlet":
+    import eventlet
+    eventlet.monkey_patch()
+elif Config.ASYNC_MODE == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask_session import Session
 from flask_socketio import SocketIO
 from flask_socketio import emit
+from flask_socketio import join_room
 from markupsafe import Markup
-from time import time
 from flask import session
 
-from config import Config
 from application.database import DataBase
+from application.database import get_writer
+from application.database import now_ms
+from application.database import recent_messages
+from application.database import user_cache
 from application.message import Message
 from application import create_app
+from application.backpressure import OutboundQueueGuard
+from application.coalesce import EventCoalescer
+from application.metrics import instrument_socketio
+from application.metrics import packet_logger
+from application.metrics import registry
+from application.metrics import room_collector
+from application.metrics import stats_collector
+from application.pubsub import create_client_manager
+from application.ratelimit import limiter
+from application.ratelimit import ratelimited
+from application.state import get_state_store
 from application.utils import parse_message
-from application.utils import public_rooms
-from application.utils import ratelimits
+from application.wire import encode_room_data
+from application.wire import negotiate_wire_format
 
 
 # Create the app and set the secret key
@@ -23,52 +48,159 @@ app.config['SESSION_PERMANENT'] = False
 app.config['SESSION_TYPE'] = 'filesystem'
 Session(app)
 
-# Configure the socket interface
-socketio = SocketIO(app, logger=True, engineio_logger=True, cors_allowed_origins="*")
+# Configure the socket interface. Events are shared with the other workers through the message queue
+# when one is configured
+socketio = SocketIO(
+    app,
+    async_mode=Config.ASYNC_MODE,
+    client_manager=create_client_manager(Config.MESSAGE_QUEUE),
+    logger=packet_logger("socketio.server"),
+    engineio_logger=packet_logger("engineio.server"),
+    cors_allowed_origins="*"
+)
+# Time every socket event handler for the metrics
+instrument_socketio(socketio)
+
+# Hold back the packets sent to clients that are not reading them fast enough
+outbound_guard = None
+if Config.OUTBOUND_QUEUE_LIMIT > 0:
+    outbound_guard = OutboundQueueGuard(socketio.server, Config.OUTBOUND_QUEUE_LIMIT, Config.SLOW_CONSUMER_POLICY)
+
+# The new, edited and deleted message events of each room are sent in batches during bursts when
+# coalescing is enabled
+room_events = EventCoalescer(
+    socketio,
+    window_ms=Config.COALESCE_WINDOW_MS,
+    max_delay_ms=Config.COALESCE_MAX_DELAY_MS,
+    max_batch=Config.COALESCE_MAX_BATCH
+)
+
+# Export the state of the sockets, rooms, caches and queues of this worker on /metrics
+registry.register_collector(room_collector(socketio, lambda: get_state_store().get_public_rooms()))
+registry.register_collector(stats_collector("chatapp_recent_cache", "Recent message cache", recent_messages.stats))
+registry.register_collector(stats_collector("chatapp_user_cache", "User cache", user_cache.stats))
+registry.register_collector(stats_collector("chatapp_ratelimit", "Socket event ratelimits", limiter.stats))
+registry.register_collector(stats_collector("chatapp_coalesce", "Room event coalescing", room_events.stats))
+if outbound_guard is not None:
+    registry.register_collector(stats_collector("chatapp_outbound", "Outbound queues", outbound_guard.stats))
+if get_writer() is not None:
+    registry.register_collector(stats_collector("chatapp_writer", "Write-behind queue", get_writer().stats))
 
 
 # Socket events
 
 
-@socketio.on('client connected')
-def on_connect():
-    """Sends all messages from the database with the same room code as the client to the client 
-    on connection."""
+def join_session_room():
+    """Adds the client to the Socket.IO room for the room code in its session so that it receives the
+    messages sent in the room, and then gets the newest messages of the room. Older messages are fetched
+    by the client from the API as they are needed.
+
+    Returns:
+        dict: The newest messages of the room, whether there are older messages, the public rooms and the
+            watermark the client sends back when it reconnects
+    """
+    join_room(session.get("room_code"))
+    # The watermark is taken before the messages are read so that no later edit or delete is missed
+    watermark = now_ms()
     db = DataBase()
-    messages = db.get_room_messages(session.get("room_code"))
+    message_data = db.get_recent_messages(session.get("room_code"), limit=Config.HISTORY_PAGE_SIZE + 1)
     db.close()
-    # Convert message objects to json
-    message_data = []
-    for m in messages:
-        message_data.append(m.to_dict())
-    emit('after connection', {'messages': message_data, 'public_rooms': public_rooms})
+    # Check whether there are older messages that the client can load later
+    has_more = len(message_data) > Config.HISTORY_PAGE_SIZE
+    if has_more:
+        message_data = message_data[1:]
+    public_rooms = get_state_store().get_public_rooms()
+    return {'messages': message_data, 'public_rooms': public_rooms, 'has_more': has_more, 'watermark': watermark}
+
+def resync_session_room(auth):
+    """Adds a reconnecting client to the Socket.IO room for the room code in its session, and gets only
+    the changes made to the room since the client last saw it.
+
+    Args:
+        auth (dict): The auth data of the socket, containing the id of the newest message the client has
+            as `last_msg_id` and the watermark it was last given as `watermark`
+
+    Returns:
+        dict: The new messages, edits and deleted message ids of the room, the public rooms and the new
+            watermark, or None if the client has to be sent the newest messages instead
+    """
+    try:
+        last_msg_id = int(auth["last_msg_id"])
+        since = int(auth["watermark"])
+    except (TypeError, KeyError, ValueError):
+        return None
+    join_room(session.get("room_code"))
+    db = DataBase()
+    changes = db.get_room_changes(session.get("room_code"), last_msg_id, since)
+    db.close()
+    if changes is None:
+        return None
+    changes['resync'] = True
+    changes['public_rooms'] = get_state_store().get_public_rooms()
+    return changes
+
+def emit_room_data(event: str, data: dict):
+    """Sends room data, such as the history of the room, to the client of the current socket. The data
+    is sent in the compact wire format if it was negotiated when the socket connected.
+
+    Args:
+        event (str): The name of the event
+        data (dict): The room data
+    """
+    wire_format = session.get("wire_format")
+    if wire_format is None:
+        emit(event, data)
+    else:
+        emit(event, encode_room_data(data, wire_format))
+
+@socketio.on('connect')
+def on_socket_connect(auth=None):
+    """Sends everything the client needs to render its room as soon as the socket connects, so that the
+    page does not have to fetch the user and room code before asking for the messages. The data is taken
+    from the session the socket was opened with, so no database query is needed for the user. A client
+    that is reconnecting sends the newest message it has in `auth`, and is only sent what it missed.
+    """
+    user = session.get("user")
+    if user is None:
+        return
+    # The session of a socket is its own copy, so the format only applies to this socket
+    session["wire_format"] = negotiate_wire_format(auth)
+    user_data = user.to_dict()
+    user_data.pop("password")
+    bootstrap_data = resync_session_room(auth) or join_session_room()
+    bootstrap_data['user'] = user_data
+    bootstrap_data['room_code'] = session.get("room_code")
+    emit_room_data('bootstrap', bootstrap_data)
+
+@socketio.on('client connected')
+def on_connect():
+    """Sends the newest messages of the client's room to the client. This is kept for clients that ask
+    for the messages after connecting instead of using the bootstrap event."""
+    emit_room_data('after connection', join_session_room())
 
 @socketio.on('send message')
+@ratelimited('send message')
 def on_message_send(data, methods=["POST"]):
     """Handles socket connections related to when a user sends a message. The message is
-    added to the database and then broadcast to all connected clients. The client will 
-    check whether the room code matches the client's room code and then display the message
-    if it does.
+    added to the database and then sent to all clients connected to the message's room. Messages
+    can only be sent to the room in the sender's session, which is the room its socket joined.
 
     Args:
         data (dict): The message data that is generated when a user sends a message.
     """
     data = dict(data)
-    # Ratelimit the user if they send messages too fast and are not a superuser
-    current_time = time()
-    if session.get("user").user_type != 1:
-        if ratelimits.get(data["author_id"]) is not None:
-            if current_time - ratelimits[data["author_id"]] < 0.25:
-                return
-        ratelimits[data["author_id"]] = current_time # Update the time when the last message was sent
+    # Drop messages for any room other than the one the socket joined
+    room_code = session.get("room_code")
+    if room_code is None or data.get("room_code", room_code) != room_code:
+        return
     # Parse the message contents and edit it if needed
     data["content"] = parse_message(data["content"])
     # Construct the message object and add it to the database. Then, send the message to all clients
-    m = Message(data["content"], data["author_id"], data["author_username"], data["room_code"], data["replying_to"])
+    m = Message(data["content"], data["author_id"], data["author_username"], room_code, data["replying_to"])
     db = DataBase()
     db.add_message(m)
     db.close()
-    emit('new message', m.to_dict(), broadcast=True)
+    room_events.emit('new message', m.to_dict(), m.room_code)
     # Scrape the message contents for commands if the user is a superuser
     if session.get("user").user_type == 1:
         # Get the command name and args from the message content
@@ -79,25 +211,32 @@ def on_message_send(data, methods=["POST"]):
             # Try to get the number of messages to purge from the message args
             try:
                 num_msgs_to_purge = int(msg_args[0]) + 1 # Add one to delete the message the superuser sent as well
-            except:
-                pass
+            except (IndexError, ValueError):
+                num_msgs_to_purge = 0
+            # Only tell the superuser how to use the command if the number is missing or less than one
+            if num_msgs_to_purge < 2:
+                emit("command error", {"message": "Usage: /purge <number of messages to delete, at least 1>"})
             else:
-                # Create the database instance, get all messages from the room, and delete the 
-                # number of messages specified in the reverse order. After each message is
-                # deleted, notify the client in order to have it deleted off all users' screens
+                # Delete the newest messages from the room in one query and then notify the clients
+                # about all of the deleted messages at once
+                db = DataBase()
+                msg_ids = db.purge_room_messages(room_code, num_msgs_to_purge)
+                db.close()
+                room_events.emit("messages deleted", {"msg_ids": msg_ids}, m.room_code)
+        # Purge user command
+        elif cmd_name in ["/purgeuser"]:
+            if len(msg_args) > 0:
+                # Delete all messages sent by the user in the room as well as the message the superuser sent
                 db = DataBase()
-                all_msgs = db.get_room_messages(data["room_code"])
-                all_msgs.reverse()
-                for msg_num in range(0, num_msgs_to_purge):
-                    if msg_num + 1 > len(all_msgs):
-                        break
-                    else:
-                        msg = all_msgs[msg_num]
-                        db.delete_message(msg.msg_id)
-                        emit("message deleted", {"msg_id": msg.msg_id}, broadcast=True)
+                msg_ids = db.purge_author_messages(room_code, msg_args[0])
+                if m.msg_id not in msg_ids:
+                    db.delete_message(m.msg_id, m.room_code)
+                    msg_ids.append(m.msg_id)
                 db.close()
+                room_events.emit("messages deleted", {"msg_ids": msg_ids}, m.room_code)
 
 @socketio.on('room status update')
+@ratelimited('room status update')
 def on_room_status_update(data, methods=["POST"]):
     """Handles socket connections related to when the status of a public room changes. This can
     be when the room is changed from public to private or vice versa. 
@@ -106,17 +245,16 @@ def on_room_status_update(data, methods=["POST"]):
         data (dict): The room status data containing the new room status.
     """
     data = dict(data)
-    if data["action"] == "Public" and data["room_code"] not in public_rooms:
-        public_rooms.append(data["room_code"])
-    elif data["action"] == "Private" and data["room_code"] in public_rooms:
-        public_rooms.remove(data["room_code"])
+    if data["action"] in ["Public", "Private"]:
+        get_state_store().set_room_public(data["room_code"], data["action"] == "Public")
     emit('room status changed', data, broadcast=True)
 
 @socketio.on('on message edit')
+@ratelimited('on message edit')
 def on_message_edit(data, methods=["POST"]):
     """Handles socket connections to edit messages in the database. After editing the message,
-    this socket route then broadcasts the edited message to all clients who handle the editing
-    of the message to the screens of their users.
+    this socket route then sends the edited message to the clients in the message's room, who
+    handle the editing of the message to the screens of their users.
 
     Args:
         data (dict): JSON containing the msg_id and the new_content of the message to be edited
@@ -127,28 +265,51 @@ def on_message_edit(data, methods=["POST"]):
     data["new_content"] = parse_message(data["new_content"])
     # Add a message saying that the message was edited to the message content
     data["new_content"] = Markup(data["new_content"]) + Markup(' <small class="font-italic">(edited)</small>')
-    # Edit the message in the database and send out the message data to connected clients
+    # Edit the message in the database and send out the message data to the clients in its room
     db = DataBase()
+    room_code = db.get_message_room(data["msg_id"])
+    if room_code is None:
+        db.close()
+        return
     db.edit_message(data["msg_id"], data["new_content"])
     db.close()
-    emit("message edited", data, broadcast=True)
+    room_events.emit("message edited", data, room_code)
 
 @socketio.on('on message delete')
+@ratelimited('on message delete')
 def on_message_delete(data, methods=["POST"]):
-    """Handles socket connections to delete messages from the database. This route then broadcasts
-    a message deleted event to all connected clients, who then handle the deletion of the message 
-    from the screens of their users.
+    """Handles socket connections to delete messages from the database. This route then sends
+    a message deleted event to the clients in the message's room, who then handle the deletion of
+    the message from the screens of their users.
 
     Args:
         data (dict): Data containing the msg_id of the message to be deleted.
     """
     data = dict(data)
     db = DataBase()
-    db.delete_message(data["msg_id"])
+    room_code = db.get_message_room(data["msg_id"])
+    if room_code is None:
+        db.close()
+        return
+    db.delete_message(data["msg_id"], room_code)
     db.close()
-    emit("message deleted", data, broadcast=True)
+    room_events.emit("message deleted", data, room_code)
 
 
 # Mainline
 if __name__ == "__main__":
-    socketio.run(app, debug=Config.DEBUG, host=Config.HOST, port=Config.PORT)
\ No newline at end of file
+    # eventlet and gevent serve the app with their own production servers, while threading mode falls
+    # back to the Werkzeug development server
+    server_options = {}
+    if Config.ASYNC_MODE == "eventlet":
+        server_options["max_size"] = Config.MAX_CONNECTIONS
+    elif Config.ASYNC_MODE == "gevent":
+        server_options["spawn"] = Config.MAX_CONNECTIONS
+    socketio.run(
+        app,
+        debug=Config.DEBUG,
+        host=Config.HOST,
+        port=Config.PORT,
+        allow_unsafe_werkzeug=Config.ASYNC_MODE == "threading",
+        **server_options
+    )
\ No newline at end of file